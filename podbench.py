@@ -0,0 +1,550 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import gzip
+import hashlib
+import os
+import shutil
+import sys
+import time
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+import sqlite3
+import http.server
+from email.utils import formatdate
+
+import podplayer
+
+class FeedGenerator (object):
+    """Class FeedGenerator makes synthetic RSS feeds for the benchmarks.
+    Each item has a title, a description, a pubDate an hour apart, a
+    guid and an enclosure whose URL carries a query string that
+    changes from item to item, the way tracking redirects do.
+
+    """
+
+    #queries are cycled through so that the enclosure URLs don't all
+    #look alike to urlre.
+    queries = ["", "?source=rss", "?utm_source=feed&utm_medium=rss&id=%d", "?dest-id=%d&aid=%d&t=%d"]
+
+    def __init__(self, title="Benchmark", base_url="http://media.example.com", start=1700000000):
+        """FeedGenerator.__init__() copies its arguments to like-named
+        properties.  start is the Unix time of the newest item.
+
+        """
+
+        self.title    = title
+        self.base_url = base_url
+        self.start    = start
+
+    def enclosure_url(self, number):
+        """FeedGenerator.enclosure_url() returns the enclosure URL for item
+        number, with its query string.
+
+        """
+
+        query = self.queries[number % len(self.queries)]
+        if query.count("%d") > 0:
+            query = query % ((number,) * query.count("%d"))
+        return "%s/%s/episode-%d.mp3%s" % (self.base_url, self.title.lower(), number, query)
+
+    def make_feed(self, items):
+        """FeedGenerator.make_feed() returns a feed with the given number of
+        items, newest first, as bytes.
+
+        """
+
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel><title>%s</title>' % (self.title,)]
+        for number in range(items, 0, -1):
+            parts += ['<item><title>Episode %d</title><description>Synthetic episode %d of %s.</description>'
+                      '<pubDate>%s</pubDate><guid isPermaLink="false">%s-%d</guid>'
+                      '<enclosure url="%s" length="%d" type="audio/mpeg"/></item>'
+                      % (number, number, self.title, formatdate(self.start - (items - number) * 3600, usegmt=True),
+                         self.title, number, self.enclosure_url(number).replace("&", "&amp;"), 1000000 + number)]
+        parts += ['</channel></rss>\n']
+        return "".join(parts).encode('utf-8')
+
+class FeedServer (object):
+    """Class FeedServer is a local HTTP stand-in for the podcast hosts.
+    It serves feeds out of memory on a thread of its own, answers
+    If-None-Match with a 304, gzips when asked, and counts requests
+    and bytes sent.
+
+    """
+
+    def __init__(self):
+        """FeedServer.__init__() sets up an empty set of feeds.  The server
+        isn't listening until start() is called.
+
+        """
+
+        self.feeds    = {}
+        self.requests = 0
+        self.bytes    = 0
+        self.lock     = threading.Lock()
+        self.server   = None
+
+    def add_feed(self, path, body):
+        """FeedServer.add_feed() serves body at path, with an ETag made from
+        its hash.
+
+        """
+
+        self.feeds[path] = (body, '"%s"' % (hashlib.sha256(body).hexdigest()[:16],), gzip.compress(body))
+
+    def start(self):
+        """FeedServer.start() starts listening on a free port on localhost
+        and returns the base URL.
+
+        """
+
+        feedserver = self
+
+        class Handler (http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with feedserver.lock:
+                    feedserver.requests += 1
+                feed = feedserver.feeds.get(self.path.split("?")[0])
+                if feed is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body, etag, compressed = feed
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/rss+xml")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = compressed
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with feedserver.lock:
+                    feedserver.bytes += len(body)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:%d" % (self.server.server_address[1],)
+
+    def stop(self):
+        """FeedServer.stop() shuts the server down.
+
+        """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def contention_writer(dbpath, seconds, results):
+    """contention_writer() is the writer process of
+    Benchmark.run_contention().  It opens its own PodPlayerDB and, for
+    the given number of seconds, adds a new episode to a podcast and
+    marks it played, both in one transaction, the way a selection
+    cycle does.  It puts (operations, lock errors, other errors) on
+    results.
+
+    """
+
+    database = podplayer.PodPlayerDB(dbpath=dbpath)
+    podcasts = list(database.scan_podcasts())
+    done     = 0
+    locked   = 0
+    failed   = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        podcast = podcasts[done % len(podcasts)]
+        podcast.episode_index = podplayer.EpisodeIndex()
+        podcast.episode_index.insert(podplayer.Episode("http://media.example.com/contention/%d/%d.mp3" % (podcast.podcast_id, done), time.time(), 1000000, "audio/mpeg"), 0)
+        podcast.episodes_parsed = True
+        try:
+            with database.transaction():
+                database.merge_episodes(podcast)
+                database.update_last_played(podcast.podcast_url, podcast.episode_index.newest())
+            done += 1
+        except sqlite3.OperationalError as error:
+            if "locked" in str(error):
+                locked += 1
+            else:
+                failed += 1
+    database.dbi.close()
+    results.put(("writer", done, locked, failed))
+
+def contention_reader(dbpath, seconds, results):
+    """contention_reader() is a reader process of
+    Benchmark.run_contention().  It opens its own PodPlayerDB and, for
+    the given number of seconds, does what --list does, over and over.
+    It puts (operations, lock errors, other errors) on results.
+
+    """
+
+    database = podplayer.PodPlayerDB(dbpath=dbpath)
+    done     = 0
+    locked   = 0
+    failed   = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        try:
+            for podcast in list(database.scan_podcasts()):
+                database.count_unplayed(podcast)
+            done += 1
+        except sqlite3.OperationalError as error:
+            if "locked" in str(error):
+                locked += 1
+            else:
+                failed += 1
+    database.dbi.close()
+    results.put(("reader", done, locked, failed))
+
+def serve_feed(body, sink=None):
+    """serve_feed() stands in for Podcast.retrieve_feed_text() in the
+    benchmarks.  It returns body, or if sink is given, hands it to sink
+    64 KiB at a time, the way HttpClient.fetch() would, and returns
+    b''.
+
+    """
+
+    if sink is None:
+        return body
+    for start in range(0, len(body), 65536):
+        sink(body[start:start + 65536])
+    return b''
+
+#The schema of a database from the last release before schema
+#versions were kept, PodPlayerDB.init_if_needed_steps as it was then:
+#one table of podcasts, with no listeners.  Benchmark.run_migrate()
+#upgrades this.
+legacy_schema = [
+    "CREATE TABLE IF NOT EXISTS podcast_v1 (podcast_id INTEGER PRIMARY KEY AUTOINCREMENT, podcast_priority INTEGER DEFAULT 10, podcast_load_type TEXT DEFAULT 'back', podcast_url TEXT, podcast_name TEXT, podcast_last_played TEXT)",
+    "CREATE INDEX IF NOT EXISTS podcast_v1_priority ON podcast_v1(podcast_priority)",
+    "CREATE INDEX IF NOT EXISTS podcast_v1_url ON podcast_v1(podcast_url)"
+]
+
+def make_legacy_database(dbpath, podcasts):
+    """make_legacy_database() makes a database with legacy_schema at
+    dbpath, with the given number of podcasts, each with a priority, a
+    load type, a name and a last play.
+
+    """
+
+    connection = sqlite3.connect(dbpath)
+    for step in legacy_schema:
+        connection.execute(step)
+    connection.executemany("INSERT INTO podcast_v1 (podcast_url, podcast_load_type, podcast_priority, podcast_name, podcast_last_played) VALUES (?, ?, ?, ?, ?)",
+                           [("http://feeds.example.com/legacy-%d.xml" % (number,), ('back', 'front', 'random')[number % 3], number % 20,
+                             "Legacy %d" % (number,), "http://media.example.com/%d/1.mp3" % (number,)) for number in range(1, podcasts + 1)])
+    connection.commit()
+    connection.close()
+
+class Benchmark (object):
+    """Class Benchmark runs the benchmarks and collects the results.
+
+    """
+
+    def __init__(self, sizes, subscriptions, repeat, jobs=1, readers=4, seconds=5.0, verbose=False):
+        """Benchmark.__init__() copies its arguments to like-named
+        properties.  sizes is a list of feed sizes in items, and
+        subscriptions is how many feeds the full selection cycle runs
+        over.  readers and seconds are the number of reader processes
+        and how long the contention benchmark runs.
+
+        """
+
+        self.verbose       = verbose
+
+        self.sizes         = sizes
+        self.subscriptions = subscriptions
+        self.repeat        = repeat
+        self.jobs          = jobs
+        self.readers       = readers
+        self.seconds       = seconds
+        self.results       = []
+
+    def measure(self, name, size, work, count=1, setup=None):
+        """Benchmark.measure() calls setup() (if given) and then work()
+        self.repeat times, timing each call of work(), and then once
+        more under tracemalloc for the peak memory.  count is how many
+        things one call of work() handles, for the throughput.  The
+        result is added to self.results and returned.
+
+        """
+
+        timings = []
+        for attempt in range(self.repeat):
+            argument = None
+            if setup is not None:
+                argument = setup()
+            started = time.perf_counter()
+            work(argument)
+            timings += [time.perf_counter() - started]
+
+        argument = None
+        if setup is not None:
+            argument = setup()
+        tracemalloc.start()
+        work(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings.sort()
+        result = {
+            "benchmark":   name,
+            "size":        size,
+            "repeat":      self.repeat,
+            "min_s":       timings[0],
+            "p50_s":       timings[len(timings) // 2],
+            "p95_s":       timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+            "mean_s":      sum(timings) / len(timings),
+            "per_second":  count / timings[len(timings) // 2] if timings[len(timings) // 2] > 0 else None,
+            "peak_bytes":  peak
+        }
+        self.results += [result]
+        if self.verbose:
+            print ("%-24s %7d  p50 %10.6f s  %12.0f/s  peak %10d B" % (name, size, result["p50_s"], result["per_second"] or 0, peak))
+        return result
+
+    def run_parse(self):
+        """Benchmark.run_parse() times Podcast.get_episode_list() on feeds
+        of each size, with the full parse and with the streaming one,
+        for a back-loaded podcast with nothing played, which has to
+        keep every episode, and with the streaming one for a
+        back-loaded podcast that is ten episodes behind, which only
+        has to read the top of the feed.  The feed comes from memory,
+        so only the parse is measured.
+
+        """
+
+        generator = FeedGenerator()
+        for size in self.sizes:
+            body   = generator.make_feed(size)
+            recent = podplayer.Podcast().clean_url(generator.enclosure_url(max(1, size - 10)))
+            for name, streaming, last_played in (("parse", False, None), ("parse_stream", True, None), ("parse_stream_recent", True, recent)):
+                def setup():
+                    podcast = podplayer.Podcast(podcast_url="http://bench/feed.xml", podcast_load_type='back', podcast_last_played=last_played, streaming=streaming)
+                    podcast.retrieve_feed_text = lambda sink=None: serve_feed(body, sink)
+                    return podcast
+                self.measure(name, size, lambda podcast: podcast.get_episode_list(), count=size, setup=setup)
+
+    def run_urlre(self):
+        """Benchmark.run_urlre() times stripping query strings off of
+        enclosure URLs with Podcast.clean_url().
+
+        """
+
+        generator = FeedGenerator()
+        podcast   = podplayer.Podcast()
+        for size in self.sizes:
+            urls = [generator.enclosure_url(number) for number in range(size)]
+            def work(argument):
+                for url in urls:
+                    podcast.clean_url(url)
+            self.measure("urlre", size, work, count=size)
+
+    def run_selection(self):
+        """Benchmark.run_selection() times Podcast.make_selection() on an
+        already parsed feed of each size, for a back-loaded podcast
+        whose last play is in the middle of the feed.
+
+        """
+
+        generator = FeedGenerator()
+        for size in self.sizes:
+            body    = generator.make_feed(size)
+            podcast = podplayer.Podcast(podcast_url="http://bench/feed.xml", podcast_load_type='back')
+            podcast.retrieve_feed_text = lambda sink=None: serve_feed(body, sink)
+            podcast.get_episode_list()
+            podcast.podcast_last_played = podcast.episode_list[len(podcast.episode_list) // 2]
+            self.measure("podcast_selection", size, lambda argument: podcast.make_selection(), count=1)
+
+    def run_cycle(self):
+        """Benchmark.run_cycle() times PodPlayer.make_selection() over
+        self.subscriptions feeds served by a FeedServer, with nothing
+        to play in any of them, so that every feed is checked.  The
+        first cycle is timed on its own; the rest run against warm
+        caches.  Each feed is made due again before every cycle.
+
+        """
+
+        server   = FeedServer()
+        base_url = server.start()
+        directory = tempfile.mkdtemp(prefix="podbench-")
+        try:
+            for size in self.sizes:
+                generator = FeedGenerator(title="Cycle%d" % (size,))
+                server.add_feed("/feed-%d.xml" % (size,), generator.make_feed(size))
+                dbpath = os.path.join(directory, "cycle-%d.db" % (size,))
+                player = podplayer.PodPlayer(dbpath=dbpath, jobs=self.jobs, cachedir=os.path.join(directory, "media"))
+                urls   = ["%s/feed-%d.xml?subscriber=%d" % (base_url, size, number) for number in range(self.subscriptions)]
+                player.add_podcasts(urls, 10, 'front')
+
+                #Mark the newest episode of every feed played, so the
+                #cycle has to look at all of them.
+                newest = podplayer.Podcast().clean_url(generator.enclosure_url(size))
+                player.database.dbi.execute("UPDATE subscription_v1 SET podcast_last_played = ?", (newest,))
+                player.database.dbi.commit()
+
+                def setup():
+                    player.database.dbi.execute("DELETE FROM poll_v1")
+                    player.database.dbi.commit()
+
+                server.requests = 0
+                server.bytes    = 0
+                started = time.perf_counter()
+                player.make_selection()
+                cold = time.perf_counter() - started
+                cold_bytes = server.bytes
+
+                result = self.measure("cycle", size, lambda argument: player.make_selection(), count=self.subscriptions, setup=setup)
+                result["subscriptions"] = self.subscriptions
+                result["jobs"]          = self.jobs
+                result["cold_s"]        = cold
+                result["cold_bytes"]    = cold_bytes
+                result["requests"]      = server.requests
+                result["bytes"]         = server.bytes
+                player.database.dbi.close()
+                player.http.close()
+        finally:
+            server.stop()
+            shutil.rmtree(directory)
+
+    def run_contention(self):
+        """Benchmark.run_contention() runs one writer process and
+        self.readers reader processes against the same database for
+        self.seconds seconds, and counts how many operations each got
+        done and how many failed with "database is locked".  There
+        should never be any of those.
+
+        """
+
+        directory = tempfile.mkdtemp(prefix="podbench-")
+        try:
+            dbpath    = os.path.join(directory, "contention.db")
+            player    = podplayer.PodPlayer(dbpath=dbpath, cachedir=os.path.join(directory, "media"))
+            player.add_podcasts(["http://feeds.example.com/contention-%d.xml" % (number,) for number in range(self.subscriptions)], 10, 'back')
+            player.database.dbi.close()
+            player.http.close()
+
+            results   = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=contention_writer, args=(dbpath, self.seconds, results))]
+            for number in range(self.readers):
+                processes += [multiprocessing.Process(target=contention_reader, args=(dbpath, self.seconds, results))]
+            for process in processes:
+                process.start()
+            counts = [results.get(timeout=self.seconds + 60) for process in processes]
+            for process in processes:
+                process.join()
+        finally:
+            shutil.rmtree(directory)
+
+        result = {
+            "benchmark":       "contention",
+            "size":            self.subscriptions,
+            "seconds":         self.seconds,
+            "readers":         self.readers,
+            "writes":          sum([count[1] for count in counts if count[0] == "writer"]),
+            "reads":           sum([count[1] for count in counts if count[0] == "reader"]),
+            "locked_errors":   sum([count[2] for count in counts]),
+            "other_errors":    sum([count[3] for count in counts])
+        }
+        result["writes_per_second"] = result["writes"] / self.seconds
+        result["reads_per_second"]  = result["reads"] / self.seconds
+        self.results += [result]
+        if self.verbose:
+            print ("%-24s %7d  %10.0f writes/s  %10.0f reads/s  %d locked  %d other errors" % ("contention", self.subscriptions, result["writes_per_second"], result["reads_per_second"], result["locked_errors"], result["other_errors"]))
+        return result
+
+    def run_migrate(self):
+        """Benchmark.run_migrate() times opening a database made by
+        make_legacy_database(), with each size in podcasts, which runs
+        every upgrade in PodPlayerDB.migrations, and then opening it
+        again once it is up to date, which should run none.  Each
+        upgrade is timed on a fresh copy.  The counts afterwards show
+        that every podcast was carried over to the default listener.
+
+        """
+
+        directory = tempfile.mkdtemp(prefix="podbench-")
+        try:
+            for size in self.sizes:
+                template = os.path.join(directory, "legacy-%d.db" % (size,))
+                dbpath   = os.path.join(directory, "migrate-%d.db" % (size,))
+                make_legacy_database(template, size)
+
+                def setup():
+                    for suffix in ("", "-wal", "-shm"):
+                        if os.path.exists(dbpath + suffix):
+                            os.remove(dbpath + suffix)
+                    shutil.copyfile(template, dbpath)
+
+                def work(argument):
+                    podplayer.PodPlayerDB(dbpath=dbpath).dbi.close()
+
+                result = self.measure("migrate", size, work, count=size, setup=setup)
+                connection = sqlite3.connect(dbpath)
+                result["version"]        = connection.execute("PRAGMA user_version").fetchone()[0]
+                result["podcasts"]       = connection.execute("SELECT count(0) FROM podcast_v1").fetchone()[0]
+                result["subscribed"]     = connection.execute("SELECT count(0) FROM subscription_v1 WHERE listener_name = 'default' AND podcast_last_played IS NOT NULL").fetchone()[0]
+                connection.close()
+
+                self.measure("migrate_current", size, work, count=1)
+                os.remove(template)
+        finally:
+            shutil.rmtree(directory)
+
+    def run(self, names):
+        """Benchmark.run() runs the named benchmarks and returns the
+        results.
+
+        """
+
+        for name in names:
+            getattr(self, "run_" + name)()
+        return self.results
+
+def main():
+    parser=argparse.ArgumentParser(description="Benchmark PodPlayer against synthetic feeds.")
+    parser.add_argument("-v", "--verbose",       help="Print results as they come",    action="store_true")
+    parser.add_argument("-s", "--sizes",         help="Feed sizes in items",           type=str, default="10,100,1000,10000,50000")
+    parser.add_argument("-n", "--subscriptions", help="Feeds in a selection cycle",    type=int, default=50)
+    parser.add_argument("-r", "--repeat",        help="Runs of each benchmark",        type=int, default=5)
+    parser.add_argument("-j", "--jobs",          help="Feeds to fetch at once",        type=int, default=1)
+    parser.add_argument("-R", "--readers",       help="Readers in contention",         type=int, default=4)
+    parser.add_argument("-t", "--seconds",       help="Length of contention run",      type=float, default=5.0)
+    parser.add_argument("-o", "--output",        help="Where to write the JSON",       type=str, default=None)
+    parser.add_argument("benchmarks",            help="Benchmarks to run",             type=str, nargs="*",
+                        default=["parse", "urlre", "selection", "cycle", "contention", "migrate"])
+    args = parser.parse_args()
+
+    sizes     = [int(size) for size in args.sizes.split(",")]
+    benchmark = Benchmark(sizes=sizes, subscriptions=args.subscriptions, repeat=args.repeat, jobs=args.jobs, readers=args.readers, seconds=args.seconds, verbose=args.verbose)
+    report    = {
+        "started":    time.time(),
+        "python":     sys.version,
+        "sizes":      sizes,
+        "benchmarks": benchmark.run(args.benchmarks)
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print ()
+    else:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+
+if __name__ == "__main__":
+    main()
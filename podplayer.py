@@ -1,17 +1,874 @@
 #!/usr/bin/python3
 
 import argparse
+import sys
 import ssl
 import sqlite3
 import xml.etree.ElementTree as ET
 #import urllib.request #It stopped working, so I'm stopping using it.
+import http.client
+import urllib.parse
+import zlib
 import re
 import time
-from subprocess import call
+import json
+import io
+import hashlib
+import bisect
+import heapq
+import email.utils
+import calendar
+import os
+import shutil
+import threading
+import random
+import cProfile
+import contextlib
+import socket
+import socketserver
+from subprocess import Popen
+from concurrent.futures import ThreadPoolExecutor
 
 class ImNotDoingThat (Exception):
     pass
 
+class FetchError (Exception):
+    pass
+
+class MediaChanged (FetchError):
+    pass
+
+class Metrics (object):
+    """Class Metrics collects timings from the hot paths:  how long each
+    phase took, for which feed, how many bytes it handled, and why
+    it failed, if it did.  Records are kept in memory until drain()
+    hands them to PodPlayerDB.add_metrics(), so that timing a phase
+    never costs a database write of its own.  It is safe to share
+    between threads.
+
+    """
+
+    def __init__(self, clock=time):
+        """Metrics.__init__() sets up an empty list of records.  clock is
+        what the time of each record comes from, anything with a
+        time() like the time module's.
+
+        """
+
+        self.clock   = clock
+        self.lock    = threading.Lock()
+        self.records = []
+
+    def record(self, phase, podcast_url, seconds, size=None, error=None):
+        """Metrics.record() takes a phase name, the podcast URL it was for
+        (or None), the time it took in seconds, the number of bytes
+        handled and a failure reason, and keeps them for the next
+        drain().
+
+        """
+
+        with self.lock:
+            self.records.append((self.clock.time(), phase, podcast_url, seconds, size, error))
+
+    def drain(self):
+        """Metrics.drain() returns the records kept so far, as (time, phase,
+        podcast URL, seconds, bytes, error) tuples, and forgets them.
+
+        """
+
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+class HttpClient (object):
+    """Class HttpClient is a small HTTP/1.1 client that stands in for
+    wget.  It keeps connections open between requests, one pool per
+    host, asks for gzip or deflate on feeds, remembers permanent
+    redirects, and either hands back the body or downloads it into a
+    file, in pieces at once if the server takes Range requests.  It
+    is safe to share between threads.
+
+    """
+
+    user_agent    = "PodPlayer/1.0"
+    max_redirects = 5
+    max_idle      = 4
+    chunk_size    = 65536
+
+    #segment_size is the smallest piece a download is split into, and
+    #max_attempts how many times in a row a piece may fail before the
+    #download is given up on.
+    segment_size  = 8 * 1048576
+    max_attempts  = 3
+
+    def __init__(self, timeout=5, verbose=False, debug=False):
+        """HttpClient.__init__() copies its arguments to like-named
+        properties, and sets up an empty connection pool and redirect
+        cache.  timeout is in seconds and applies to connecting and to
+        each read.
+
+        """
+
+        self.verbose   = verbose or debug
+        self.debug     = debug
+
+        self.timeout   = timeout
+        self.context   = ssl.create_default_context()
+        self.lock      = threading.Lock()
+        self.idle      = {}
+        self.redirects = {}
+
+    def get_connection(self, key):
+        """HttpClient.get_connection() takes a (scheme, host, port) tuple and
+        returns a connection to it and whether that connection came
+        out of the pool.  A new one is made if the pool is empty.
+
+        """
+
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.context), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def release_connection(self, key, connection, response):
+        """HttpClient.release_connection() takes a (scheme, host, port)
+        tuple, a connection and the response that was just read from
+        it, and puts the connection back in the pool, unless the
+        server is closing it or the pool is full.
+
+        """
+
+        if not response.will_close:
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def close(self):
+        """HttpClient.close() closes every pooled connection.
+
+        """
+
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle = {}
+
+    def send(self, key, path, headers):
+        """HttpClient.send() takes a (scheme, host, port) tuple, a path and a
+        dict of headers, sends a GET and returns the connection and the
+        response.  A pooled connection the server has since dropped is
+        retried once on a fresh one.
+
+        """
+
+        connection, reused = self.get_connection(key)
+        try:
+            connection.request('GET', path, headers=headers)
+            return connection, connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+        connection, reused = self.get_connection(key)
+        while reused:
+            #Anything else in the pool for this host is probably just as stale.
+            connection.close()
+            connection, reused = self.get_connection(key)
+        connection.request('GET', path, headers=headers)
+        return connection, connection.getresponse()
+
+    def open(self, url, headers=None):
+        """HttpClient.open() takes a URL and optional dict of headers,
+        follows any redirects, and returns the (scheme, host, port)
+        tuple, connection and response for the final one.  The body is
+        still unread.  Permanent redirects are remembered so that the
+        next request goes straight to the new location.
+
+        """
+
+        url = self.redirects.get(url, url)
+        requested_url = url
+        for redirect in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.hostname:
+                raise FetchError("Can't fetch %s" % (url,))
+            if parts.port is None:
+                port = {'http': 80, 'https': 443}[parts.scheme]
+            else:
+                port = parts.port
+            key  = (parts.scheme, parts.hostname, port)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            request_headers = {'User-Agent': self.user_agent}
+            if headers is not None:
+                request_headers.update(headers)
+
+            connection, response = self.send(key, path, request_headers)
+            location = response.getheader('Location')
+            if response.status not in (301, 302, 303, 307, 308) or location is None:
+                return key, connection, response
+
+            response.read()
+            self.release_connection(key, connection, response)
+            url = urllib.parse.urljoin(url, location)
+            if response.status in (301, 308):
+                self.redirects[requested_url] = url
+            if self.debug:
+                print ("    Redirected to %s" % (url,))
+
+        raise FetchError("Too many redirects for %s" % (requested_url,))
+
+    def fetch(self, url, headers=None, cancelled=None, sink=None):
+        """HttpClient.fetch() takes a URL and an optional dict of headers,
+        and returns the status, a dict of response headers with
+        lowercase names, and the body as bytes, decompressed if the
+        server compressed it.  cancelled is an optional function that
+        is checked between reads; if it returns True, the fetch is
+        abandoned with a FetchError.  sink is an optional function
+        that is handed each piece of the body, decompressed, as it
+        comes in, instead of the body being kept; the body returned is
+        then empty.
+
+        """
+
+        request_headers = {'Accept-Encoding': 'gzip, deflate'}
+        if headers is not None:
+            request_headers.update(headers)
+
+        key, connection, response = self.open(url, request_headers)
+        response_headers = dict([(name.lower(), value) for name, value in response.getheaders()])
+
+        encoding = response_headers.get('content-encoding', '').lower()
+        if encoding == 'gzip':
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            #Servers disagree about whether deflate means zlib or raw;
+            #32 + MAX_WBITS handles zlib and gzip headers, and raw is
+            #tried if that fails.
+            decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        else:
+            decoder = None
+
+        body     = []
+        received = 0
+        if sink is None:
+            sink = body.append
+        try:
+            while True:
+                if cancelled is not None and cancelled():
+                    raise FetchError("Fetch of %s cancelled" % (url,))
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                if decoder is not None:
+                    try:
+                        try:
+                            chunk = decoder.decompress(chunk)
+                        except zlib.error:
+                            if encoding != 'deflate' or received > 0:
+                                raise
+                            decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                            chunk   = decoder.decompress(chunk)
+                    except zlib.error as error:
+                        raise FetchError("Can't decompress %s (%s)" % (url, error))
+                received += 1
+                sink(chunk)
+            if decoder is not None:
+                sink(decoder.flush())
+        except:
+            connection.close()
+            raise
+
+        self.release_connection(key, connection, response)
+        return response.status, response_headers, b''.join(body)
+
+    def receive(self, key, connection, response, media_path, written, progress=None):
+        """HttpClient.receive() takes the (scheme, host, port) tuple,
+        connection and response from open(), a file path and the
+        number of bytes already in the file, and appends the body to
+        the file.  It returns the size of the file afterwards.
+        progress is as for download().
+
+        """
+
+        try:
+            with open(media_path, 'ab') as outfile:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    outfile.write(chunk)
+                    written += len(chunk)
+                    if progress is not None:
+                        outfile.flush()
+                        progress(media_path, written)
+        except:
+            connection.close()
+            raise
+
+        self.release_connection(key, connection, response)
+        return written
+
+    def download(self, url, media_path, headers=None, progress=None, segments=1, expected_size=None):
+        """HttpClient.download() takes a URL, a file path and an optional
+        dict of headers, and downloads the body into the file.  It
+        returns the number of bytes written, and raises a FetchError
+        if the server doesn't answer with a 200 or 206 or the file
+        doesn't come out the size it should.
+
+        If the server takes Range requests, the file is fetched in up
+        to segments pieces at once, each into a file of its own, and
+        the pieces are joined at the end.  What has been downloaded so
+        far, and the ETag or Last-Modified it came from, is kept in
+        media_path + ".json", so that a later call for the same URL
+        picks up where this one left off, and a piece that drops
+        partway through is picked up again straight away.  Otherwise
+        the body is streamed into the file, and has to come out the
+        size the server said, or at least expected_size, the size
+        from the feed, if the server didn't say.
+
+        progress is an optional function that is called with the path
+        and the number of bytes written so far each time more of the
+        start of the file is on disk.  It is only called for the first
+        piece, so pass segments=1 with it.
+
+        """
+
+        state_path = media_path + ".json"
+        state      = None
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as infile:
+                    state = json.load(infile)
+            except ValueError:
+                state = None
+            #Without a validator there's no telling whether the pieces
+            #on disk are still the file on the server.
+            if state is not None and (state.get("url") != url or state.get("validator") is None):
+                state = None
+
+        if state is None:
+            self.discard_download(media_path)
+            request_headers = {'Range': 'bytes=0-0'}
+            if headers is not None:
+                request_headers.update(headers)
+            key, connection, response = self.open(url, request_headers)
+            state = self.plan_download(url, response, segments)
+            if state is None:
+                return self.download_whole(url, key, connection, response, media_path, progress, expected_size)
+            #The byte itself isn't needed, so a connection cut short of
+            #it only costs the connection.
+            try:
+                response.read()
+                self.release_connection(key, connection, response)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+            with open(state_path, 'w') as outfile:
+                json.dump(state, outfile)
+        else:
+            #Keep MediaCache.clean_partials() off a download still going.
+            os.utime(state_path)
+            if self.verbose:
+                print ("Resuming %s." % (url,))
+
+        ranges = state["ranges"]
+        paths  = [media_path] + ["%s.%d" % (media_path, index) for index in range(1, len(ranges))]
+        try:
+            if len(ranges) == 1:
+                self.download_range(url, media_path, ranges[0], state["validator"], headers, progress)
+            else:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    futures = [executor.submit(self.download_range, url, paths[index], ranges[index], state["validator"], headers, progress if index == 0 else None)
+                               for index in range(len(ranges))]
+                    for future in futures:
+                        future.result()
+        except MediaChanged:
+            #Start over next time rather than join pieces of two files.
+            self.discard_download(media_path)
+            raise
+
+        with open(media_path, 'ab') as outfile:
+            for path in paths[1:]:
+                with open(path, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, self.chunk_size)
+        written = os.path.getsize(media_path)
+        self.discard_download(media_path, keep=True)
+        if written != state["size"]:
+            os.remove(media_path)
+            raise FetchError("Got %d bytes of %s, expected %d" % (written, url, state["size"]))
+        return written
+
+    def plan_download(self, url, response, segments):
+        """HttpClient.plan_download() takes a URL, the response to a request
+        for its first byte and the most pieces to fetch it in, and
+        returns a dict with the URL, its size, the validator to send
+        in If-Range, and a [first, last] byte range for each piece.
+        It returns None if the server doesn't do ranges, in which case
+        the response is the whole body, still unread.
+
+        """
+
+        if response.status != 206:
+            return None
+        match = re.match("^bytes\\s+0-0/([0-9]+)$", response.getheader('Content-Range', '').strip())
+        if match is None or int(match.group(1)) == 0:
+            return None
+        size = int(match.group(1))
+
+        #A weak ETag doesn't promise the same bytes, so it can't be
+        #used to stitch ranges together.
+        validator = response.getheader('ETag')
+        if validator is None or validator.startswith('W/'):
+            validator = response.getheader('Last-Modified')
+
+        count  = max(1, min(segments, size // self.segment_size))
+        piece  = size // count
+        ranges = [[index * piece, (index + 1) * piece - 1] for index in range(count)]
+        ranges[-1][1] = size - 1
+        return {"url": url, "size": size, "validator": validator, "ranges": ranges}
+
+    def download_range(self, url, media_path, byte_range, validator, headers=None, progress=None):
+        """HttpClient.download_range() takes a URL, a file path, a [first,
+        last] byte range and the validator from plan_download(), and
+        fetches whatever part of the range isn't already in the file
+        onto the end of it.  A dropped connection or a timeout is
+        retried from where it stopped, until self.max_attempts tries
+        in a row get nowhere.  It raises MediaChanged if the server no longer has
+        the same file.
+
+        """
+
+        first, last = byte_range
+        length      = last - first + 1
+        failures    = 0
+        while True:
+            written = 0
+            if os.path.exists(media_path):
+                written = os.path.getsize(media_path)
+            if written > length:
+                #Left over from joining the pieces when that was cut short.
+                os.truncate(media_path, length)
+                written = length
+            if written == length:
+                if progress is not None:
+                    progress(media_path, written)
+                return written
+
+            request_headers = {'Range': 'bytes=%d-%d' % (first + written, last)}
+            if validator is not None:
+                request_headers['If-Range'] = validator
+            if headers is not None:
+                request_headers.update(headers)
+            try:
+                key, connection, response = self.open(url, request_headers)
+                content_range = response.getheader('Content-Range', '').strip()
+                if response.status == 200 or (response.status == 206 and not content_range.startswith('bytes %d-' % (first + written,))):
+                    connection.close()
+                    raise MediaChanged("%s changed during the download" % (url,))
+                if response.status != 206:
+                    connection.close()
+                    raise FetchError("HTTP %d for %s" % (response.status, url))
+                if self.receive(key, connection, response, media_path, written, progress) > written:
+                    failures = 0
+                    continue
+                error = "connection closed"
+            except (OSError, http.client.HTTPException) as caught:
+                error = str(caught) or type(caught).__name__
+            #A piece that keeps getting nowhere is given up on.
+            failures += 1
+            if failures >= self.max_attempts:
+                raise FetchError("Gave up on %s at byte %d (%s)" % (url, first + written, error))
+            if self.verbose:
+                print ("Retrying %s from byte %d (%s)." % (url, first + written, error))
+
+    def download_whole(self, url, key, connection, response, media_path, progress=None, expected_size=None):
+        """HttpClient.download_whole() takes a URL, the (scheme, host, port)
+        tuple, connection and unread response from open(), a file
+        path, and the progress function and size from the feed passed
+        to download(), and streams the body into the file.  The file
+        is removed if it doesn't come out the size the server said, or
+        if the server didn't say and it comes out smaller than the
+        feed said.  Feeds are often wrong about sizes, so a file that
+        comes out bigger is kept.
+
+        """
+
+        if response.status != 200:
+            connection.close()
+            raise FetchError("HTTP %d for %s" % (response.status, url))
+        content_length = response.getheader('Content-Length')
+
+        with open(media_path, 'wb'):
+            pass
+        try:
+            written = self.receive(key, connection, response, media_path, 0, progress)
+            if content_length is not None and content_length.strip().isdigit():
+                if written != int(content_length):
+                    raise FetchError("Got %d bytes of %s, expected %s" % (written, url, content_length.strip()))
+            elif expected_size and written < expected_size:
+                raise FetchError("Got %d bytes of %s, expected %d" % (written, url, expected_size))
+        except:
+            os.remove(media_path)
+            raise
+        return written
+
+    def discard_download(self, media_path, keep=False):
+        """HttpClient.discard_download() takes a file path passed to
+        download() and removes the pieces and state of a download into
+        it, and the file itself unless keep is True.
+
+        """
+
+        state_path = media_path + ".json"
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as infile:
+                    count = len(json.load(infile)["ranges"])
+            except (ValueError, KeyError):
+                count = 1
+            for index in range(1, count):
+                if os.path.exists("%s.%d" % (media_path, index)):
+                    os.remove("%s.%d" % (media_path, index))
+            os.remove(state_path)
+        if not keep and os.path.exists(media_path):
+            os.remove(media_path)
+
+
+class Episode (object):
+    """Class Episode is a compact record of one enclosure in a feed:  its
+    URL, with the query stripped, the item's publish time (0 if
+    unknown), and whatever the feed says about its size in bytes,
+    MIME type, duration in seconds and guid, any of which may be
+    None.  It has __slots__ rather than a dict, since a long back
+    catalog makes a lot of them, and MIME types, which are nearly
+    always the same from one episode to the next, are interned.
+
+    """
+
+    __slots__ = ("url", "published", "length", "type", "duration", "guid")
+
+    def __init__(self, url, published=0, length=None, type=None, duration=None, guid=None):
+        """Episode.__init__() copies its arguments to like-named
+        properties.
+
+        """
+
+        self.url       = url
+        self.published = published
+        self.length    = length
+        self.type      = None if type is None else sys.intern(type)
+        self.duration  = duration
+        self.guid      = guid
+
+    def __repr__(self):
+        return "Episode(%r, %r, %r, %r, %r, %r)" % (self.url, self.published, self.length, self.type, self.duration, self.guid)
+
+    def to_cache(self):
+        """Episode.to_cache() returns the episode as a list, in the order
+        __init__() takes its arguments, for the feed cache.
+
+        """
+
+        return [self.url, self.published, self.length, self.type, self.duration, self.guid]
+
+class EpisodeIndex (object):
+    """Class EpisodeIndex keeps a podcast's Episodes sorted from
+    oldest to newest.  Each episode is keyed on its publish time, and
+    then on its position in the feed, top being newest, for episodes
+    published at the same time or not dated at all.  Last comes the
+    generation the episode went in with, since two episodes from
+    different refreshes can have the same time and position; the
+    later one goes after.  A whole feed's
+    worth is sorted in one go when the index is made, and inserting
+    one more and finding the episode after a given one are binary
+    searches.  A PodPlayer keeps each podcast's index from one
+    refresh to the next, and update() only adds what is new.
+
+    """
+
+    #update() inserts up to insert_limit new episodes one at a time.
+    #Past that, merging them in with one pass over the index is
+    #cheaper than moving the rest of the index once for each.
+    insert_limit = 32
+
+    def __init__(self, episodes=None):
+        """EpisodeIndex.__init__() takes an optional list of Episodes in
+        feed order, top first, and sorts them into the index.  If a URL
+        is there more than once, the newest key wins, same as for
+        insert().  self.keys and self.episodes are parallel lists in
+        sorted order, self.key_of maps each URL to its key, and
+        self.generation counts the insert() and update() calls.
+
+        """
+
+        if episodes is None:
+            episodes = []
+        self.generation = 0
+        keys  = [(episode.published, -position, 0) for position, episode in enumerate(episodes)]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys     = [keys[index] for index in order]
+        self.episodes = [episodes[index] for index in order]
+        self.key_of   = dict([(episode.url, key) for key, episode in zip(self.keys, self.episodes)])
+        if len(self.key_of) < len(self.keys):
+            #In sorted order, the newest key for each URL went in last.
+            kept          = [index for index in range(len(self.keys)) if self.key_of[self.episodes[index].url] == self.keys[index]]
+            self.keys     = [self.keys[index] for index in kept]
+            self.episodes = [self.episodes[index] for index in kept]
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def __contains__(self, episode_url):
+        return episode_url in self.key_of
+
+    def insert(self, episode, position):
+        """EpisodeIndex.insert() takes an Episode and its position in the
+        feed, and puts it in order.  If the URL is already there, the
+        newer of the two keys wins.
+
+        """
+
+        self.generation += 1
+        key = (episode.published, -position, self.generation)
+        old = self.key_of.get(episode.url)
+        if old is not None:
+            if old[:2] >= key[:2]:
+                return
+            index = bisect.bisect_left(self.keys, old)
+            del self.keys[index]
+            del self.episodes[index]
+
+        index = bisect.bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.episodes.insert(index, episode)
+        self.key_of[episode.url] = key
+
+    def update(self, episodes):
+        """EpisodeIndex.update() takes a list of Episodes in feed order, top
+        first, as for __init__(), and adds the ones whose URLs aren't
+        in the index yet.  Episodes already there keep their places,
+        even if the feed has since dropped them.  It returns how many
+        were added.
+
+        """
+
+        new = [(position, episode) for position, episode in enumerate(episodes) if episode.url not in self.key_of]
+        if len(new) <= self.insert_limit:
+            for position, episode in new:
+                self.insert(episode, position)
+            return len(set([episode.url for position, episode in new]))
+
+        self.generation += 1
+        keys  = [(episode.published, -position, self.generation) for position, episode in new]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        #In sorted order, the newest key for each URL comes last.
+        newest = dict([(new[index][1].url, index) for index in order])
+        order  = [index for index in order if newest[new[index][1].url] == index]
+
+        #Both runs are already in order, so this sort is one merge.
+        merged_keys     = self.keys + [keys[index] for index in order]
+        merged_episodes = self.episodes + [new[index][1] for index in order]
+        merged          = sorted(range(len(merged_keys)), key=merged_keys.__getitem__)
+        self.keys       = [merged_keys[index] for index in merged]
+        self.episodes   = [merged_episodes[index] for index in merged]
+        for index in order:
+            self.key_of[new[index][1].url] = keys[index]
+        return len(order)
+
+    def get(self, episode_url):
+        """EpisodeIndex.get() takes an episode URL and returns its Episode,
+        or None if it isn't in the index.
+
+        """
+
+        key = self.key_of.get(episode_url)
+        if key is None:
+            return None
+        return self.episodes[bisect.bisect_left(self.keys, key)]
+
+    def newest(self):
+        """EpisodeIndex.newest() returns the newest episode URL, or None.
+
+        """
+
+        if len(self.episodes) == 0:
+            return None
+        return self.episodes[-1].url
+
+    def next_after(self, episode_url):
+        """EpisodeIndex.next_after() takes an episode URL and returns the URL
+        of the episode published after it, or None if it is the
+        newest.  If the URL isn't in the index, the oldest episode is
+        returned.
+
+        """
+
+        key = self.key_of.get(episode_url)
+        if key is None:
+            index = 0
+        else:
+            index = bisect.bisect_right(self.keys, key)
+        if index >= len(self.episodes):
+            return None
+        return self.episodes[index].url
+
+    def newest_first(self):
+        """EpisodeIndex.newest_first() returns a list of the Episodes, newest
+        first.
+
+        """
+
+        return self.episodes[::-1]
+
+class EpisodeStream (object):
+    """Class EpisodeStream hashes and parses a feed for a Podcast a piece
+    at a time, as it comes in, so that the feed is never all in
+    memory at once.  Each item is thrown away as soon as its
+    enclosures have been made into Episodes.  For a
+    front-loaded podcast the parse stops after the first item with an
+    enclosure, and for a back-loaded one it stops when it reaches the
+    last episode played, since make_selection() never looks any
+    further than that.  A back-loaded feed that turns out not to be
+    newest-first is read to the end.  The rest of the feed is still
+    hashed, so that the next fetch can tell whether it changed.
+
+    """
+
+    def __init__(self, podcast):
+        """EpisodeStream.__init__() takes the Podcast to fill in and sets up
+        an empty parse.  self.size is the number of bytes seen so far,
+        and self.seconds how long has been spent parsing them.
+
+        """
+
+        self.podcast    = podcast
+        self.parser     = ET.XMLPullParser(events=('start', 'end'))
+        self.digest     = hashlib.sha256()
+        self.size       = 0
+        self.seconds    = 0.0
+        self.done       = False
+        self.error      = None
+
+        self.depth      = 0
+        self.channel    = None
+        self.name_found = False
+        self.found      = []
+        self.previous   = None
+        self.ordered    = True
+
+        podcast.feed_complete = True
+
+    def feed(self, chunk):
+        """EpisodeStream.feed() takes the next piece of the feed, hashes it,
+        and parses it, unless the parse is already done.  A piece that
+        isn't XML ends the parse, and the error is raised by close().
+
+        """
+
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if self.done:
+            return
+        started = time.perf_counter()
+        try:
+            self.parser.feed(chunk)
+            self.read_events()
+        except ET.ParseError as error:
+            self.error = error
+            self.done  = True
+        self.seconds += time.perf_counter() - started
+
+    def close(self):
+        """EpisodeStream.close() finishes the parse once the whole feed has
+        been fed, and raises the ET.ParseError that ended it, if any.
+        Otherwise the episodes found go into the podcast's
+        episode_index, with Podcast.add_episodes().
+
+        """
+
+        if not self.done:
+            started = time.perf_counter()
+            self.done = True
+            try:
+                self.parser.close()
+                self.read_events()
+            except ET.ParseError as error:
+                self.error = error
+            self.seconds += time.perf_counter() - started
+        if self.error is not None:
+            raise self.error
+        self.podcast.add_episodes(self.found)
+
+    def hexdigest(self):
+        """EpisodeStream.hexdigest() returns the SHA-256 of everything fed so
+        far, in hex.
+
+        """
+
+        return self.digest.hexdigest()
+
+    def read_events(self):
+        """EpisodeStream.read_events() handles whatever the parser has made
+        of the pieces fed to it so far.  self.depth is how deep the
+        parse is, 1 being the root element, so the channel is at 2 and
+        its title and items at 3.
+
+        """
+
+        podcast = self.podcast
+        depth   = self.depth
+        try:
+            for event, elem in self.parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and elem.tag == 'channel':
+                        self.channel = elem
+                    continue
+                depth -= 1
+                if depth != 2 or self.channel is None:
+                    continue
+
+                if elem.tag == 'item':
+                    published = podcast.parse_pubdate(elem.findtext('pubDate'))
+                    guid      = elem.findtext('guid')
+                    duration  = elem.findtext(podcast.itunes_duration)
+                    episodes  = [podcast.make_episode(enclosure.attrib, published, guid, duration) for enclosure in elem.iterfind('enclosure')]
+
+                    #We're done with this one.  Let it go.
+                    elem.clear()
+                    self.channel.remove(elem)
+
+                    if published:
+                        if self.previous is not None and published > self.previous:
+                            self.ordered = False
+                        self.previous = published
+
+                    self.found += episodes
+
+                    if len(episodes) > 0:
+                        if podcast.podcast_load_type == 'front' or (self.ordered and podcast.podcast_last_played in [episode.url for episode in episodes]):
+                            podcast.feed_complete = False
+                            self.done             = True
+                            return
+                elif elem.tag == 'title' and not self.name_found:
+                    #Only the first channel's title counts, same as the
+                    #non-streaming parse.
+                    podcast.podcast_name = elem.text
+                    self.name_found      = True
+        finally:
+            self.depth = depth
+
 class Podcast (object):
 
     """Class Podcast is a data structure representing a podcast feed, with
@@ -25,14 +882,89 @@ class Podcast (object):
     #URLs match.
     urlre = re.compile ("(^http.*?)\?")
 
+
+    #Polling schedule, all in seconds.  A feed is polled
+    #poll_divisor times per typical gap between its episodes, but
+    #never more often than poll_min_interval or less often than
+    #poll_max_interval.  Until a gap has been seen, the interval
+    #doubles every time a poll finds nothing new.  poll_jitter is
+    #the fraction either way the next poll is moved at random, so
+    #that feeds don't all come due at the same instant.
+    poll_min_interval = 900.0
+    poll_max_interval = 86400.0
+    poll_divisor      = 4.0
+    poll_jitter       = 0.2
+
+    #Failure backoff, also in seconds.  After a failed poll, the feed
+    #is tried again in failure_min_wait, doubling with each failure
+    #in a row up to failure_max_wait, whatever its usual schedule.
+    #After failure_threshold failures in a row the feed is taken to
+    #be down:  when its retry comes due, one player gets to probe it,
+    #and the first poll that works puts it back on its usual
+    #schedule.
+    failure_threshold = 3
+    failure_min_wait  = 900.0
+    failure_max_wait  = 172800.0
+
+    #A player claims a feed for poll_claim_wait seconds before it
+    #fetches it, so that nobody else sharing the database fetches it
+    #too.  Polling puts the real next poll in place of the claim; the
+    #claim only runs out if the player stops partway.
+    poll_claim_wait   = 900.0
+
+    #itunes_duration is the tag of an item's <itunes:duration> once
+    #ElementTree has expanded the namespace.
+    itunes_duration = "{http://www.itunes.com/dtds/podcast-1.0.dtd}duration"
+
+    #pubdate_re matches the way nearly every feed writes its pubDates,
+    #"Wed, 02 Oct 2002 13:00:00 GMT" or with a numeric zone, so that
+    #parse_pubdate() only has to fall back on email.utils, which is
+    #several times slower, for the odd one out.
+    pubdate_re = re.compile("^(?:[A-Za-z]{3},\\s*)?([0-9]{1,2})\\s+([A-Za-z]{3})\\s+([0-9]{4})\\s+([0-9]{2}):([0-9]{2})(?::([0-9]{2}))?\\s+(?:(GMT|UTC?|Z)|([+-])([0-9]{2})([0-9]{2}))$")
+    months     = {"jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+                  "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12}
+
     def __init__(self, podcast_id=None, podcast_priority=None,
                  podcast_load_type=None, podcast_url=None, podcast_name=None,
-                 podcast_last_played=None, verbose=False, debug=False):
+                 podcast_last_played=None, feed_etag=None,
+                 feed_last_modified=None, feed_hash=None, feed_episodes=None,
+                 feed_complete=True, poll_interval=None, poll_next_due=None,
+                 poll_failures=0, poll_last_error=None, streaming=False, database=None, http=None, metrics=None,
+                 clock=time, verbose=False, debug=False):
 
         """Podcast.__init__() mostly copies its parameters to like-named
         properties in the instance.  It also initializes the
         self.episode_list property to None.
 
+        The feed_* parameters are the validators remembered from the
+        last time the feed was fetched, along with the list of
+        Episodes that was parsed out of it, newest first.
+        self.feed_changed gets set if any of those need to be written
+        back to the database.  feed_complete is False if that list was
+        cut short by a streaming parse.
+
+        poll_interval and poll_next_due are the polling schedule.  A
+        podcast that is not due yet is not fetched at all.
+        poll_failures is how many polls in a row have failed, and
+        poll_last_error why the last one did.
+
+        If streaming is set, the feed is hashed and parsed a piece at a
+        time as it comes in, with an EpisodeStream, and the parse stops
+        as soon as it has what make_selection() needs.
+
+        If a PodPlayerDB is given as database, newly seen episodes are
+        merged into it and the selection is made with a query against
+        it rather than by looking in self.episode_index.
+
+        http is the HttpClient to fetch the feed with.  If none is
+        given, one is made.
+
+        If a Metrics object is given as metrics, the fetch and the
+        parse are timed into it.
+
+        clock is what the polling schedule is worked out by, anything
+        with a time() like the time module's.
+
         """
         
         self.verbose             = verbose or debug
@@ -45,7 +977,32 @@ class Podcast (object):
         self.podcast_name        = podcast_name
         self.podcast_last_played = podcast_last_played
 
+        self.feed_etag           = feed_etag
+        self.feed_last_modified  = feed_last_modified
+        self.feed_hash           = feed_hash
+        self.feed_episodes       = feed_episodes
+        self.feed_complete       = feed_complete
+        self.feed_status         = None
+        self.feed_error          = None
+        self.feed_changed        = False
+        self.episodes_parsed     = False
+        self.episodes_added      = 0
+
+        self.poll_interval       = poll_interval
+        self.poll_next_due       = poll_next_due
+        self.poll_failures       = poll_failures or 0
+        self.poll_last_error     = poll_last_error
+        self.polled              = False
+
+        self.fetch_cancelled     = False
+
+        self.streaming           = streaming
+        self.database            = database
+        self.http                = http
+        self.metrics             = metrics
+        self.clock               = clock
         self.episode_list        = None
+        self.episode_index       = None
 
     def make_selection(self):
         """Podcast.make_selection() calls get_episode_list() (if needed) and
@@ -61,458 +1018,2974 @@ class Podcast (object):
         podcast, select the most recent episode and return a Selection
         object with that.
 
-        OTOH, if it is a rear-loaded one, find the episode after the
-        most-recent played, and return a Selection object with that.
+        OTOH, if it is a rear-loaded one, find the episode after the
+        most-recent played, and return a Selection object with that.
+
+        If we have a database, the same decision is made by
+        make_database_selection() instead.
+
+        """
+
+        if self.verbose:
+            if self.podcast_name is None:
+                usename = self.podcast_url
+            else:
+                usename = self.podcast_name
+            print ("Checking %s for new content." % (usename,))
+        if self.episode_list is None:
+            self.get_episode_list()
+
+        if self.database is not None:
+            return self.make_database_selection()
+
+        if len(self.episode_index) == 0:
+            return None
+
+        if self.debug:
+            for episode in self.episode_list:
+                print("   ", episode)
+            print (self.podcast_last_played)
+        
+        if self.podcast_last_played == self.episode_index.newest():
+            if self.debug:
+                print("I select none of these becasue the most recent episode has been played.")
+            return None
+        
+        if self.podcast_load_type == 'front':
+            episode_url = self.episode_index.newest()
+            if self.debug:
+                print("I select %s, which is the newest episode." % (episode_url,))
+        else:
+            episode_url = self.episode_index.next_after(self.podcast_last_played)
+
+        if episode_url is None:
+            return None
+        else:
+            return Selection(podcast=self, episode_url=episode_url, episode=self.episode_index.get(episode_url), verbose=self.verbose, debug=self.debug)
+
+    def make_database_selection(self):
+        """Podcast.make_database_selection() merges any new episodes into the
+        database and then makes the same decision as make_selection()
+        with a single indexed query:  the newest episode for a
+        front-loaded podcast, unless it has been played, or the
+        episode after the last one played for a back-loaded podcast.
+
+        """
+
+        started = time.perf_counter()
+        self.database.merge_episodes(self)
+        if self.metrics is not None and self.episodes_parsed:
+            self.metrics.record("merge", self.podcast_url, time.perf_counter() - started)
+
+        episode = self.database_choice()
+        if episode is None:
+            return None
+        return Selection(podcast=self, episode_url=episode.url, episode=episode, verbose=self.verbose, debug=self.debug)
+
+    def database_choice(self):
+        """Podcast.database_choice() returns the Episode that
+        make_database_selection() would choose from the episodes
+        already in the database, or None, without fetching or merging
+        anything.
+
+        """
+
+        if self.podcast_load_type == 'front':
+            episode_url = self.database.newest_episode(self.podcast_id)
+            if episode_url == self.podcast_last_played:
+                episode_url = None
+        else:
+            episode_url = self.database.next_episode(self.podcast_id, self.podcast_last_played)
+
+        if self.debug:
+            print("I select %s." % (episode_url,))
+
+        if episode_url is None:
+            return None
+        if self.episode_index is not None:
+            episode = self.episode_index.get(episode_url)
+            if episode is not None:
+                return episode
+        return self.database.find_episode(self.podcast_id, episode_url)
+
+    def retrieve_feed_text(self, sink=None):
+        """Podcast.retrieve_feed_text() retrieves the XML from the podcast
+        feed and returns it as bytes.  If we have an ETag or a
+        Last-Modified from an earlier fetch, they are sent along as
+        conditional headers.  The HTTP status is left in
+        self.feed_status, and new validators are put on the instance.
+        A 304 returns None, same as a failed download, so check
+        self.feed_status to tell them apart.  Why a download failed
+        ends up in self.feed_error.  If sink is given, the XML is
+        handed to it a piece at a time, as for HttpClient.fetch(), and
+        b'' is returned in its place.
+
+        """
+
+        #Welp, urllib stopped working for one of my subscriptions, and
+        #for a while we used wget.  HttpClient is built straight on
+        #http.client, so it keeps connections open and skips the
+        #trip through /dev/shm that wget needed.
+
+        #try:
+        #    context = ssl.create_default_context()
+        #    context.set_alpn_protocols(['spdy/3', 'spdy/2', 'spdy/1', 'http/1.1'])
+        #    
+        #    with urllib.request.urlopen(self.podcast_url, None, 5, context=context) as infile:
+        #        return infile.read()
+
+        if self.http is None:
+            self.http = HttpClient(verbose=self.verbose, debug=self.debug)
+
+        headers = {}
+        if self.cached_episodes_usable():
+            if self.feed_etag is not None:
+                headers['If-None-Match'] = self.feed_etag
+            if self.feed_last_modified is not None:
+                headers['If-Modified-Since'] = self.feed_last_modified
+
+        self.feed_status = None
+        self.feed_error  = None
+        if self.fetch_cancelled:
+            self.feed_error = "cancelled"
+            return None
+
+        try:
+            self.feed_status, response_headers, body = self.http.fetch(self.podcast_url, headers, cancelled=lambda: self.fetch_cancelled, sink=sink)
+        except (FetchError, OSError, http.client.HTTPException) as error:
+            self.feed_error = str(error) or type(error).__name__
+            if self.verbose:
+                print ("    Download failed (%s).  Trying next feed." % (error,))
+            return None
+
+        if self.feed_status == 304:
+            if self.verbose:
+                print ("    Feed not modified.")
+            return None
+
+        if self.feed_status != 200:
+            self.feed_error = "HTTP %d" % (self.feed_status,)
+            if self.verbose:
+                print ("    Download failed (HTTP %d).  Trying next feed." % (self.feed_status,))
+            return None
+
+        self.feed_etag          = response_headers.get('etag')
+        self.feed_last_modified = response_headers.get('last-modified')
+        return body
+
+    def cancel_fetch(self):
+        """Podcast.cancel_fetch() stops a feed retrieval that is running in
+        another thread, or keeps one from starting.  The podcast ends
+        up with an empty episode list and no cache changes.
+
+        """
+
+        self.fetch_cancelled = True
+
+    def get_episode_list(self):
+        """Podcast.get_episode_list() parses the podcast XML and boils it
+        down to an Episode for each enclosure, sorted by publish date
+        in self.episode_index, and newest first by URL in
+        self.episode_list.  If
+        the feed was not modified, or came back byte-for-byte the same
+        as last time, the parse is skipped and the episode list from
+        last time is reused.
+
+        """
+
+        #Leave the feed alone if it isn't due.
+        if not self.is_due():
+            if self.debug:
+                print ("    Not due until %s." % (time.ctime(self.poll_next_due),))
+            self.set_episodes([])
+            return
+        self.polled = True
+        
+        #Retrieve the feed.  A streaming parse is done as it comes in,
+        #so the parse time is taken out of the fetch time.
+        old_etag          = self.feed_etag
+        old_last_modified = self.feed_last_modified
+        started           = time.perf_counter()
+        stream            = None
+        if self.streaming:
+            stream   = EpisodeStream(self)
+            treetext = self.retrieve_feed_text(stream.feed)
+        else:
+            treetext = self.retrieve_feed_text()
+        if stream is None:
+            parse_seconds = 0.0
+            feed_size     = 0 if treetext is None else len(treetext)
+        else:
+            parse_seconds = stream.seconds
+            feed_size     = stream.size
+        if self.metrics is not None and not self.fetch_cancelled:
+            self.metrics.record("fetch", self.podcast_url, time.perf_counter() - started - parse_seconds, feed_size, self.feed_error)
+
+        #Determine if we got anything
+        if treetext is None:
+            if self.feed_status == 304 and self.cached_episodes_usable():
+                #Nothing changed.  Use what we had last time.
+                self.set_episodes(self.cached_episodes())
+            else:
+                #It's empty.  Say so.
+                self.set_episodes([])
+            return
+
+        #The validators can change even when the content does not.
+        if self.feed_etag != old_etag or self.feed_last_modified != old_last_modified:
+            self.feed_changed = True
+
+        if stream is None:
+            feed_hash = hashlib.sha256(treetext).hexdigest()
+        else:
+            feed_hash = stream.hexdigest()
+        if feed_hash == self.feed_hash and self.cached_episodes_usable():
+            if self.debug:
+                print ("    Feed is unchanged since the last fetch.")
+            self.set_episodes(self.cached_episodes())
+            return
+
+        #A streaming parse is mostly done already, so its time so far
+        #counts towards the parse.
+        started = time.perf_counter() - parse_seconds
+        try:
+            if stream is not None:
+                stream.close()
+            else:
+                #Figure out what we got.
+                tree = ET.fromstring(treetext)
+        
+                #Get channel name
+                self.podcast_name = tree.findall('channel')[0].findall('title')[0].text
+        
+                #Get the enclosures out of each and sort them into the index.
+                episodes = []
+                for channel in tree.findall('channel'):
+                    for item in channel.findall('item'):
+                        published = self.parse_pubdate(item.findtext('pubDate'))
+                        guid      = item.findtext('guid')
+                        duration  = item.findtext(self.itunes_duration)
+                        for enclosure in item.findall('enclosure'):
+                            episodes += [self.make_episode(enclosure.attrib, published, guid, duration)]
+                self.add_episodes(episodes)
+                self.feed_complete = True
+        except (ET.ParseError, IndexError) as error:
+            #A server that hands back an error page with a 200 is a
+            #failure like any other.
+            self.feed_error = "Not a feed (%s)" % (str(error) or type(error).__name__,)
+            if self.verbose:
+                print ("    %s.  Trying next feed." % (self.feed_error,))
+            if self.metrics is not None:
+                self.metrics.record("parse", self.podcast_url, time.perf_counter() - started, feed_size, self.feed_error)
+            self.set_episodes([])
+            return
+
+        if self.metrics is not None:
+            self.metrics.record("parse", self.podcast_url, time.perf_counter() - started, feed_size)
+
+        self.feed_episodes   = self.episode_index.newest_first()
+        self.episode_list    = [episode.url for episode in self.feed_episodes]
+        self.feed_hash       = feed_hash
+        self.feed_changed    = True
+        self.episodes_parsed = True
+
+    def set_episodes(self, episodes):
+        """Podcast.set_episodes() takes a list of Episodes, newest first,
+        puts them in self.episode_index with add_episodes(), and
+        builds self.episode_list from that.
+
+        """
+
+        self.add_episodes(episodes)
+        self.episode_list = [episode.url for episode in self.episode_index.newest_first()]
+
+    def add_episodes(self, episodes):
+        """Podcast.add_episodes() takes a list of Episodes in feed order, top
+        first.  If the podcast has an episode_index kept from an
+        earlier refresh, only the episodes that aren't in it are
+        inserted.  Otherwise a new one is made from them.
+
+        """
+
+        if self.episode_index is None:
+            self.episode_index = EpisodeIndex(episodes)
+        else:
+            self.episode_index.update(episodes)
+
+    def cached_episodes(self):
+        """Podcast.cached_episodes() returns the list of Episodes saved from
+        the last fetch.
+
+        """
+
+        return list(self.feed_episodes)
+
+    def make_episode(self, attributes, published, guid, duration):
+        """Podcast.make_episode() takes the attributes of an <enclosure>,
+        the publish time of its item, and the text of the item's
+        <guid> and <itunes:duration> (or None), and returns an
+        Episode.
+
+        """
+
+        return Episode(self.clean_url(attributes['url']), published, self.parse_length(attributes.get('length')), attributes.get('type'), self.parse_duration(duration), guid)
+
+    def parse_length(self, length):
+        """Podcast.parse_length() takes the text of an enclosure's length
+        attribute and returns it as a number of bytes, or None if it
+        is missing, can't be read, or is 0, which plenty of feeds put
+        there when they don't know.
+
+        """
+
+        try:
+            length = int(length.strip())
+        except (AttributeError, ValueError):
+            return None
+        if length <= 0:
+            return None
+        return length
+
+    def parse_duration(self, duration):
+        """Podcast.parse_duration() takes the text of an <itunes:duration>,
+        which may be seconds, MM:SS or HH:MM:SS, and returns it as a
+        number of seconds, or None if it is missing or can't be read.
+
+        """
+
+        if duration is None:
+            return None
+        seconds = 0
+        try:
+            for part in duration.strip().split(':'):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            return None
+        return int(seconds)
+
+    def parse_pubdate(self, pubdate):
+        """Podcast.parse_pubdate() takes the text of an RFC 822 pubDate and
+        returns it as a Unix time, or 0 if it is missing or can't be
+        read.
+
+        """
+
+        if pubdate is None:
+            return 0
+        pubdate = pubdate.strip()
+
+        match = self.pubdate_re.match(pubdate)
+        if match is not None:
+            day, month, year, hour, minute, second, utc, sign, zone_hours, zone_minutes = match.groups()
+            month = self.months.get(month.lower())
+            if month is not None and 1 <= int(day) <= 31 and int(hour) < 24 and int(minute) < 60 and int(second or 0) <= 60:
+                published = calendar.timegm((int(year), month, int(day), int(hour), int(minute), int(second or 0)))
+                if utc is None:
+                    offset = int(zone_hours) * 3600 + int(zone_minutes) * 60
+                    if sign == '+':
+                        published -= offset
+                    else:
+                        published += offset
+                return float(published)
+
+        try:
+            return email.utils.parsedate_to_datetime(pubdate).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return 0
+
+    def is_due(self, now=None):
+        """Podcast.is_due() returns True if the feed should be polled now,
+        either because its next poll time has come or because it has
+        never been polled.
+
+        """
+
+        if now is None:
+            now = self.clock.time()
+        return self.poll_next_due is None or self.poll_next_due <= now
+
+    def is_down(self):
+        """Podcast.is_down() returns True if the feed has failed
+        self.failure_threshold polls or more in a row.
+
+        """
+
+        return self.poll_failures >= self.failure_threshold
+
+    def schedule_next_poll(self, gaps, now=None):
+        """Podcast.schedule_next_poll() takes the gaps in seconds between
+        recent episodes, as returned by PodPlayerDB.publish_gaps(), and
+        works out self.poll_interval and self.poll_next_due from them
+        and from whether the last poll turned up anything new.  If
+        the last poll failed, the failure is counted, and the next
+        poll is put off by the failure backoff instead, leaving
+        self.poll_interval alone for when the feed comes back.
+
+        """
+
+        if now is None:
+            now = self.clock.time()
+
+        if self.feed_error is not None:
+            self.poll_failures  += 1
+            self.poll_last_error = self.feed_error
+            wait   = min(self.failure_max_wait, self.failure_min_wait * 2.0 ** (self.poll_failures - 1))
+            jitter = random.uniform(1.0 - self.poll_jitter, 1.0 + self.poll_jitter)
+            self.poll_next_due = now + wait * jitter
+            return
+
+        self.poll_failures   = 0
+        self.poll_last_error = None
+
+        if len(gaps) > 0:
+            gaps     = sorted(gaps)
+            interval = gaps[len(gaps) // 2] / self.poll_divisor
+        elif self.episodes_added > 0 or self.poll_interval is None:
+            interval = self.poll_min_interval
+        else:
+            interval = self.poll_interval * 2.0
+
+        interval = max(self.poll_min_interval, min(self.poll_max_interval, interval))
+        jitter   = random.uniform(1.0 - self.poll_jitter, 1.0 + self.poll_jitter)
+
+        self.poll_interval = interval
+        self.poll_next_due = now + interval * jitter
+
+    def clean_url(self, given_url):
+        """Podcast.clean_url() takes an enclosure URL and strips the query
+        off of it with self.urlre.
+
+        """
+
+        urlmatch = self.urlre.match(given_url)
+        if urlmatch:
+            return urlmatch.group(1)
+        return given_url
+
+    def cached_episodes_usable(self):
+        """Podcast.cached_episodes_usable() returns True if the episode list
+        saved from the last fetch can stand in for a fresh parse.  A
+        complete list always can.  A list cut short by a streaming
+        parse can for a front-loaded podcast, and for a back-loaded
+        one only if the last episode played is still on it.
+
+        """
+
+        if self.feed_episodes is None:
+            return False
+        if self.feed_complete or self.podcast_load_type == 'front':
+            return True
+        for episode in self.feed_episodes:
+            if episode.url == self.podcast_last_played:
+                return True
+        return False
+                            
+class Selection (object):
+    """Class Selection is simply a data structure, nothing else.  It
+    carries the URL of a selection, its Episode if known, and the
+    Podcast object that produced the selection.
+
+    """
+
+
+    def __init__(self, podcast=Podcast(), episode_url=None, episode=None, verbose=False, debug=False):
+        """Selection.__init__() pretty much just copies arguments to
+        like-named properties, and further transfers verbose and debug
+        flags into any included Podcast object.  self.media_path is
+        where the episode is once it has been downloaded.
+
+        """
+        
+        #TODO: Figure out better default logic for the podcast
+        #variable.  Actually, does it need to be defaulted?
+        
+        self.verbose     = verbose or debug
+        self.debug       = debug
+        self.podcast     = podcast
+        self.episode_url = episode_url
+        self.episode     = episode
+        self.media_path  = None
+
+        self.podcast.verbose = self.verbose
+        self.podcast.debug   = self.debug
+
+class PodPlayerDB(object):
+    """
+    Class PodPlayerDB abstracts the SQLite3 database.  The database is
+    kept in WAL mode, so that a player, a --list and an --add can all
+    have it open at once:  readers never wait for the writer, and a
+    second writer waits up to busy_timeout seconds for its turn
+    rather than failing with "database is locked".
+
+    Several listeners can share one database.  podcast_v1 has one row
+    per feed, and the feed cache, polling schedule, episodes and
+    media cache all go by feed, so a feed is fetched and its episodes
+    downloaded once no matter how many listeners subscribe to it.
+    Each listener's priority, load type and last play are kept in
+    subscription_v1.  The like-named columns of podcast_v1 date from
+    before there were listeners, and are no longer used.
+    """
+
+    #busy_timeout is how long in seconds to wait for another
+    #connection's write to finish.  statement_cache is how many
+    #prepared statements each connection keeps; the statements below
+    #are all constants, so each is only prepared once.
+    busy_timeout    = 30.0
+    statement_cache = 256
+
+    #metric_keep is how many timings are kept in metric_v1.  Older
+    #ones are thrown away as new ones come in.
+    metric_keep = 10000
+
+    #SQL statements used by PodPlayerDB are all set up here so as to
+    #keep them from cluttering up the methods.
+
+    #Schema upgrades, in order, as (columns, steps).  columns are
+    #(table, column, definition) to add to a table that doesn't have
+    #them yet, and steps are SQL statements run after that.  PRAGMA
+    #user_version is how many of these a database has had, so only
+    #the ones after that are run, and a database that is up to date
+    #is left alone.  New upgrades go on the end; one that has been
+    #released is never changed.
+    migrations = [
+        #1:  Everything since the last release before user_version was
+        #kept track of, whose database has nothing but podcast_v1 and
+        #its indices.  Its podcasts are carried over to the default
+        #listener, unless subscription_v1 already has anything in it.
+        ([], [
+            "CREATE TABLE IF NOT EXISTS podcast_v1 (podcast_id INTEGER PRIMARY KEY AUTOINCREMENT, podcast_priority INTEGER DEFAULT 10, podcast_load_type TEXT DEFAULT 'back', podcast_url TEXT, podcast_name TEXT, podcast_last_played TEXT)",
+            "CREATE INDEX IF NOT EXISTS podcast_v1_priority ON podcast_v1(podcast_priority)",
+            "CREATE INDEX IF NOT EXISTS podcast_v1_url ON podcast_v1(podcast_url)",
+            "CREATE TABLE IF NOT EXISTS feed_cache_v1 (podcast_url TEXT PRIMARY KEY, feed_etag TEXT, feed_last_modified TEXT, feed_hash TEXT, feed_episodes TEXT)",
+            "CREATE TABLE IF NOT EXISTS episode_v1 (episode_id INTEGER PRIMARY KEY AUTOINCREMENT, podcast_id INTEGER, episode_url TEXT, episode_seq INTEGER, episode_first_seen REAL, episode_published REAL DEFAULT 0, episode_length INTEGER, episode_type TEXT, episode_duration INTEGER, episode_guid TEXT)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS episode_v1_url ON episode_v1(podcast_id, episode_url)",
+            "CREATE INDEX IF NOT EXISTS episode_v1_seq ON episode_v1(podcast_id, episode_seq)",
+            "CREATE INDEX IF NOT EXISTS episode_v1_published ON episode_v1(podcast_id, episode_published, episode_seq)",
+            "CREATE TABLE IF NOT EXISTS poll_v1 (podcast_url TEXT PRIMARY KEY, poll_interval REAL, poll_next_due REAL, poll_failures INTEGER DEFAULT 0, poll_last_error TEXT)",
+            "CREATE TABLE IF NOT EXISTS media_v1 (media_url TEXT PRIMARY KEY, media_key TEXT, media_size INTEGER, media_last_access REAL)",
+            "CREATE INDEX IF NOT EXISTS media_v1_key ON media_v1(media_key)",
+            "CREATE INDEX IF NOT EXISTS media_v1_last_access ON media_v1(media_last_access)",
+            "CREATE TABLE IF NOT EXISTS metric_v1 (metric_id INTEGER PRIMARY KEY AUTOINCREMENT, metric_time REAL, metric_phase TEXT, podcast_url TEXT, metric_seconds REAL, metric_bytes INTEGER, metric_error TEXT)",
+            "CREATE INDEX IF NOT EXISTS metric_v1_phase ON metric_v1(metric_phase, metric_seconds)",
+            "CREATE TABLE IF NOT EXISTS subscription_v1 (listener_name TEXT, podcast_id INTEGER, podcast_priority INTEGER DEFAULT 10, podcast_load_type TEXT DEFAULT 'back', podcast_last_played TEXT, PRIMARY KEY (listener_name, podcast_id))",
+            "CREATE INDEX IF NOT EXISTS subscription_v1_podcast ON subscription_v1(podcast_id)",
+            "INSERT INTO subscription_v1 (listener_name, podcast_id, podcast_priority, podcast_load_type, podcast_last_played) SELECT 'default', podcast_id, podcast_priority, podcast_load_type, podcast_last_played FROM podcast_v1 WHERE NOT EXISTS (SELECT 0 FROM subscription_v1)"
+        ]),
+
+        #2:  Priorities have been kept in subscription_v1 since there
+        #have been listeners, so podcast_v1's index on them is only
+        #something more to write.
+        ([], [
+            "DROP INDEX IF EXISTS podcast_v1_priority"
+        ])
+    ]
+
+    #Drop database objects, if they exist.
+    destroy_steps = [
+        "DROP INDEX IF EXISTS subscription_v1_podcast",
+        "DROP TABLE IF EXISTS subscription_v1",
+        "DROP INDEX IF EXISTS metric_v1_phase",
+        "DROP TABLE IF EXISTS metric_v1",
+        "DROP INDEX IF EXISTS media_v1_last_access",
+        "DROP INDEX IF EXISTS media_v1_key",
+        "DROP TABLE IF EXISTS media_v1",
+        "DROP TABLE IF EXISTS poll_v1",
+        "DROP INDEX IF EXISTS episode_v1_seq",
+        "DROP INDEX IF EXISTS episode_v1_url",
+        "DROP TABLE IF EXISTS episode_v1",
+        "DROP TABLE IF EXISTS feed_cache_v1",
+        "DROP INDEX IF EXISTS podcast_v1_url",
+        "DROP INDEX IF EXISTS podcast_v1_priority",
+        "DROP TABLE IF EXISTS podcast_v1",
+        "PRAGMA user_version = 0"
+    ]
+
+    #Count number of instances of a given URL in a listener's subscriptions.
+    exists_podcast_select = "SELECT count(0) FROM subscription_v1 JOIN podcast_v1 ON podcast_v1.podcast_id = subscription_v1.podcast_id WHERE subscription_v1.listener_name = ? AND podcast_v1.podcast_url = ?"
+
+    #Insert a feed, with a name if there is one, as from an OPML
+    #import, unless another listener already has it.
+    add_podcast_insert = "INSERT INTO podcast_v1 (podcast_url, podcast_name) SELECT ?, ? WHERE NOT EXISTS (SELECT 0 FROM podcast_v1 WHERE podcast_url = ?)"
+
+    #Subscribe a listener to a feed by URL, with a type and priority.
+    add_subscription_insert = "INSERT OR IGNORE INTO subscription_v1 (listener_name, podcast_id, podcast_load_type, podcast_priority) SELECT ?, podcast_id, ?, ? FROM podcast_v1 WHERE podcast_url = ?"
+
+    #Retrieve every podcast URL a listener subscribes to.
+    podcast_urls_select = "SELECT podcast_v1.podcast_url FROM subscription_v1 JOIN podcast_v1 ON podcast_v1.podcast_id = subscription_v1.podcast_id WHERE subscription_v1.listener_name = ?"
+
+    #Unsubscribe a listener from a feed by URL.
+    remove_subscription_delete = "DELETE FROM subscription_v1 WHERE listener_name = ? AND podcast_id IN (SELECT podcast_id FROM podcast_v1 WHERE podcast_url = ?)"
+
+    #The rest of the removal only does anything once nobody subscribes
+    #to the feed.  The podcast itself has to go last.
+
+    #Remove the episodes of a podcast by URL.
+    remove_episodes_delete = "DELETE FROM episode_v1 WHERE podcast_id IN (SELECT podcast_id FROM podcast_v1 WHERE podcast_url = ? AND podcast_id NOT IN (SELECT podcast_id FROM subscription_v1))"
+
+    #Remove the cached validators for a podcast by URL.
+    remove_feed_cache_delete = "DELETE FROM feed_cache_v1 WHERE podcast_url IN (SELECT podcast_url FROM podcast_v1 WHERE podcast_url = ? AND podcast_id NOT IN (SELECT podcast_id FROM subscription_v1))"
+
+    #Remove the polling schedule for a podcast by URL.
+    remove_poll_delete = "DELETE FROM poll_v1 WHERE podcast_url IN (SELECT podcast_url FROM podcast_v1 WHERE podcast_url = ? AND podcast_id NOT IN (SELECT podcast_id FROM subscription_v1))"
+
+    #Remove a podcast by URL.
+    remove_podcast_delete = "DELETE FROM podcast_v1 WHERE podcast_url = ? AND podcast_id NOT IN (SELECT podcast_id FROM subscription_v1)"
+
+    #Store the polling schedule for a podcast.
+    update_poll_replace = "INSERT OR REPLACE INTO poll_v1 (podcast_url, poll_interval, poll_next_due, poll_failures, poll_last_error) values (?,?,?,?,?)"
+
+    #Move a podcast's next poll, but only if nobody else has since.
+    claim_poll_update = "UPDATE poll_v1 SET poll_next_due = ? WHERE podcast_url = ? AND poll_next_due IS ?"
+
+    #Claim a podcast that has never been polled, unless somebody
+    #already has.
+    claim_poll_insert = "INSERT OR IGNORE INTO poll_v1 (podcast_url, poll_next_due, poll_failures) values (?,?,0)"
+
+    #Retrieve the feeds whose last poll failed, those failing longest first.
+    failing_feeds_select = "SELECT podcast_url, poll_failures, poll_last_error, poll_next_due FROM poll_v1 WHERE poll_failures > 0 ORDER BY poll_failures DESC, podcast_url ASC"
+
+    #Find the earliest time any of a listener's podcasts is due to be
+    #polled.  Podcasts that have never been polled are due now.
+    next_poll_due_select = "SELECT min(coalesce(poll_v1.poll_next_due, 0)) FROM subscription_v1 JOIN podcast_v1 ON podcast_v1.podcast_id = subscription_v1.podcast_id LEFT JOIN poll_v1 ON poll_v1.podcast_url = podcast_v1.podcast_url WHERE subscription_v1.listener_name = ?"
+
+    #Retrieve the distinct times new episodes of a podcast were seen, newest first.
+    first_seen_select = "SELECT DISTINCT episode_first_seen FROM episode_v1 WHERE podcast_id = ? ORDER BY episode_first_seen DESC LIMIT ?"
+
+    #Look up a cached media file by the URL it came from.
+    find_media_select = "SELECT media_key, media_size FROM media_v1 WHERE media_url = ?"
+
+    #Record a cached media file.
+    add_media_replace = "INSERT OR REPLACE INTO media_v1 (media_url, media_key, media_size, media_last_access) values (?,?,?,?)"
+
+    #Mark a cached media file as just used.
+    touch_media_update = "UPDATE media_v1 SET media_last_access = ? WHERE media_url = ?"
+
+    #Forget a cached media file by URL.
+    remove_media_delete = "DELETE FROM media_v1 WHERE media_url = ?"
+
+    #Count the URLs that share a cached media file.
+    media_key_count_select = "SELECT count(0) FROM media_v1 WHERE media_key = ?"
+
+    #Add up the size of the media cache.  URLs that share a file only count it once.
+    media_total_select = "SELECT coalesce(sum(media_size), 0) FROM (SELECT media_key, max(media_size) AS media_size FROM media_v1 GROUP BY media_key)"
+
+    #Retrieve cached media files, least recently used first.
+    lru_media_select = "SELECT media_url, media_key, media_size FROM media_v1 ORDER BY media_last_access ASC"
+
+    #Record timings.
+    add_metric_insert = "INSERT INTO metric_v1 (metric_time, metric_phase, podcast_url, metric_seconds, metric_bytes, metric_error) values (?,?,?,?,?,?)"
+
+    #Throw away all but the newest metric_keep timings.
+    prune_metrics_delete = "DELETE FROM metric_v1 WHERE metric_id <= (SELECT max(metric_id) FROM metric_v1) - ?"
+
+    #Retrieve the phases timed, with how many times and how many failures.
+    metric_phases_select = "SELECT metric_phase, count(0), count(metric_error) FROM metric_v1 GROUP BY metric_phase ORDER BY metric_phase"
+
+    #Retrieve the timings of one phase, fastest first.
+    metric_seconds_select = "SELECT metric_seconds FROM metric_v1 WHERE metric_phase = ? ORDER BY metric_seconds ASC"
+
+    #Retrieve the feeds with the slowest average fetch and parse, with
+    #how many fetches, bytes fetched, failures and the latest failure
+    #reason.
+    slowest_feeds_select = "SELECT podcast_url, sum(metric_phase = 'fetch') AS fetches, sum(metric_seconds) / max(1, sum(metric_phase = 'fetch')) AS average, coalesce(sum(CASE WHEN metric_phase = 'fetch' THEN metric_bytes END), 0), count(metric_error), (SELECT metric_error FROM metric_v1 AS failed WHERE failed.podcast_url = metric_v1.podcast_url AND failed.metric_error IS NOT NULL ORDER BY failed.metric_id DESC LIMIT 1) FROM metric_v1 WHERE metric_phase IN ('fetch', 'parse') AND podcast_url IS NOT NULL GROUP BY podcast_url ORDER BY average DESC LIMIT ?"
+
+    #Store the validators, content hash and episode list from the last fetch.
+    update_feed_cache_replace = "INSERT OR REPLACE INTO feed_cache_v1 (podcast_url, feed_etag, feed_last_modified, feed_hash, feed_episodes) values (?,?,?,?,?)"
+
+    #Retrieve the episode list saved from the last fetch of a feed.
+    load_feed_cache_select = "SELECT feed_episodes FROM feed_cache_v1 WHERE podcast_url = ?"
+
+    #Find the highest sequence number handed out for a podcast's episodes.
+    max_episode_seq_select = "SELECT max(episode_seq) FROM episode_v1 WHERE podcast_id = ?"
+
+    #Retrieve all of the episode URLs already known for a podcast.
+    known_episodes_select = "SELECT episode_url FROM episode_v1 WHERE podcast_id = ?"
+
+    #Insert a newly seen episode.
+    add_episode_insert = "INSERT OR IGNORE INTO episode_v1 (podcast_id, episode_url, episode_seq, episode_first_seen, episode_published, episode_length, episode_type, episode_duration, episode_guid) values (?,?,?,?,?,?,?,?,?)"
+
+    #Retrieve an episode of a podcast by URL, in the order Episode() takes its arguments.
+    find_episode_select = "SELECT episode_url, episode_published, episode_length, episode_type, episode_duration, episode_guid FROM episode_v1 WHERE podcast_id = ? AND episode_url = ?"
+
+    #Episodes are in order by publish time, and then by the order they
+    #were first seen in.  Undated episodes have a publish time of 0.
+
+    #Find the newest episode of a podcast.
+    newest_episode_select = "SELECT episode_url FROM episode_v1 WHERE podcast_id = ? ORDER BY episode_published DESC, episode_seq DESC LIMIT 1"
+
+    #Find the episode after a given one, or the oldest if it isn't there.
+    next_episode_select = "SELECT episode_url FROM episode_v1 WHERE podcast_id = ? AND (episode_published, episode_seq) > (coalesce((SELECT episode_published FROM episode_v1 WHERE podcast_id = ? AND episode_url = ?), -1), coalesce((SELECT episode_seq FROM episode_v1 WHERE podcast_id = ? AND episode_url = ?), 0)) ORDER BY episode_published ASC, episode_seq ASC LIMIT 1"
+
+    #Count the episodes after a given one, or all of them if it isn't there.
+    count_unplayed_select = "SELECT count(0) FROM episode_v1 WHERE podcast_id = ? AND (episode_published, episode_seq) > (coalesce((SELECT episode_published FROM episode_v1 WHERE podcast_id = ? AND episode_url = ?), -1), coalesce((SELECT episode_seq FROM episode_v1 WHERE podcast_id = ? AND episode_url = ?), 0))"
+
+    #Retrieve the distinct publish times of a podcast's dated episodes, newest first.
+    published_select = "SELECT DISTINCT episode_published FROM episode_v1 WHERE podcast_id = ? AND episode_published > 0 ORDER BY episode_published DESC LIMIT ?"
+
+    #Update the podcast_last_played column for a given listener and podcast.
+    update_last_played_update = "UPDATE subscription_v1 SET podcast_last_played = ? WHERE listener_name = ? AND podcast_id IN (SELECT podcast_id FROM podcast_v1 WHERE podcast_url = ?)"
+
+    #Update the podcast_name column for a given podcast
+    update_name_update = "UPDATE podcast_v1 SET podcast_name = ? WHERE podcast_url =?"
+
+    #Retrieve a list of a listener's podcasts in order by priority
+    scan_podcasts_select = "SELECT podcast_v1.podcast_id, subscription_v1.podcast_priority, subscription_v1.podcast_load_type, podcast_v1.podcast_url, podcast_v1.podcast_name, subscription_v1.podcast_last_played, feed_cache_v1.feed_etag, feed_cache_v1.feed_last_modified, feed_cache_v1.feed_hash, poll_v1.poll_interval, poll_v1.poll_next_due, poll_v1.poll_failures, poll_v1.poll_last_error FROM subscription_v1 JOIN podcast_v1 ON podcast_v1.podcast_id = subscription_v1.podcast_id LEFT JOIN feed_cache_v1 ON feed_cache_v1.podcast_url = podcast_v1.podcast_url LEFT JOIN poll_v1 ON poll_v1.podcast_url = podcast_v1.podcast_url WHERE subscription_v1.listener_name = ? ORDER BY subscription_v1.podcast_priority ASC, podcast_v1.podcast_id ASC"
+    
+    def __init__(self, dbpath, listener="default", clock=time, verbose=False, debug=False):
+        """PodPlayerDB.__init__(), in addition to copying the arguments to the
+        properties, also instantiates a database connection, puts the
+        database in WAL mode, and calls migrate() to set up the
+        database or bring it up to date.  listener is the name of the listener whose
+        subscriptions are used.  clock is what times written to the
+        database come from, anything with a time() like the time
+        module's, and is passed on to the Podcasts it makes.
+
+        """
+        self.verbose  = verbose or debug
+        self.debug    = debug
+
+        self.dbpath   = dbpath
+        self.listener = listener
+        self.clock    = clock
+        self.dbi      = sqlite3.connect(self.dbpath, timeout=self.busy_timeout, cached_statements=self.statement_cache)
+        self.depth    = 0
+
+        #WAL only has to be synced at checkpoints to be safe against a
+        #crash, so synchronous=NORMAL saves an fsync per commit.
+        self.dbi.execute("PRAGMA journal_mode=WAL")
+        self.dbi.execute("PRAGMA synchronous=NORMAL")
+
+        self.migrate()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """PodPlayerDB.transaction() is a context manager that groups every
+        write made inside it into a single commit, or rolls them all
+        back if an exception gets out.  Transactions can be nested;
+        only the outermost one commits.
+
+        """
+
+        self.depth += 1
+        try:
+            yield self
+        except:
+            self.depth -= 1
+            if self.depth == 0:
+                self.dbi.rollback()
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.dbi.commit()
+
+    def commit(self):
+        """PodPlayerDB.commit() commits, unless a transaction() is open, in
+        which case the commit is left to it.
+
+        """
+
+        if self.depth == 0:
+            self.dbi.commit()
+
+    def migrate(self):
+        """PodPlayerDB.migrate() brings the database up to date by running
+        whichever of self.migrations it hasn't had yet, in order.  Each
+        one is run in a transaction of its own, along with the update
+        to user_version, so an upgrade that fails leaves the database
+        as it was after the last one that worked.  A database that is
+        already up to date costs one read of user_version.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= len(self.migrations):
+            return
+
+        while True:
+            #BEGIN IMMEDIATE takes the write lock before user_version is
+            #read again, so two players started on the same old
+            #database at once can't both run the same upgrade.
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("PRAGMA user_version")
+                version = cursor.fetchone()[0]
+                if version >= len(self.migrations):
+                    self.dbi.rollback()
+                    return
+                columns, steps = self.migrations[version]
+                self.add_columns(columns)
+                self.run_steps(steps)
+                cursor.execute("PRAGMA user_version = %d" % (version + 1,))
+            except:
+                self.dbi.rollback()
+                raise
+            self.dbi.commit()
+            if self.verbose:
+                print ("Upgraded %s to schema version %d." % (self.dbpath, version + 1))
+
+    def add_columns(self, columns):
+        """PodPlayerDB.add_columns() takes a list of (table, column,
+        definition) and adds each column that its table doesn't have
+        yet.  Tables that don't exist yet are left alone.
+
+        """
+
+        cursor = self.dbi.cursor()
+        for table, column, definition in columns:
+            cursor.execute("PRAGMA table_info(%s)" % (table,))
+            existing = [result[1] for result in cursor.fetchall()]
+            if len(existing) > 0 and column not in existing:
+                cursor.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, definition))
+
+    def destroy(self):
+        """PodPlayerDB.destroy() will drop all database objects by running the
+        steps in self.destroy_steps.
+
+        """
+
+        self.run_steps(self.destroy_steps)
+        self.commit()
+        
+    def run_steps(self, steps):
+        """PodPlayerDB.run_steps() is used by migrate() and destroy()
+        to execute a single SQL step in a str or a group of SQL
+        statements in a list.
+
+        """
+
+        if type(steps) is str:
+            steps = [steps]
+        cursor = self.dbi.cursor()
+        for step in steps:
+            cursor.execute(step)
+
+    def exists_podcast(self, podcast_url):
+        """PodPlayerDB.exists_podcast() takes a podcast URL and returns True
+        if the listener subscribes to it, and False if not.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.exists_podcast_select, (self.listener, podcast_url))
+        result = cursor.fetchone()
+        if result[0] == 0:
+            return False
+        return True
+
+    def add_podcast(self, podcast_url, podcast_priority, podcast_type):
+        """PodPlayerDB.add_podcast() subscribes the listener to a podcast.
+        The podcast_name and podcast_last_played columns will be left
+        null.
+
+        """
+        
+        self.add_podcast_list([(podcast_url, podcast_type, podcast_priority, None)])
+
+    def remove_podcast(self, podcast_url):
+        """PodPlayerDB.remove_podcasts() takes a podcast URL and unsubscribes
+        the listener from it.
+
+        """
+
+        self.remove_podcast_list([podcast_url])
+        
+    def podcast_urls(self):
+        """PodPlayerDB.podcast_urls() returns a set of the URLs of every
+        podcast the listener subscribes to.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.podcast_urls_select, (self.listener,))
+        return set([result[0] for result in cursor])
+
+    def add_podcast_list(self, podcast_list):
+        """PodPlayerDB.add_podcast_list() takes a list of (url, load type,
+        priority, name) tuples and subscribes the listener to them all
+        in a single transaction, adding the feeds no other listener
+        has.  It doesn't check for duplicates.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.executemany(self.add_podcast_insert, [(podcast_url, podcast_name, podcast_url) for podcast_url, podcast_type, podcast_priority, podcast_name in podcast_list])
+        cursor.executemany(self.add_subscription_insert, [(self.listener, podcast_type, podcast_priority, podcast_url) for podcast_url, podcast_type, podcast_priority, podcast_name in podcast_list])
+        self.commit()
+
+    def remove_podcast_list(self, url_list):
+        """PodPlayerDB.remove_podcast_list() takes a list of podcast URLs and
+        unsubscribes the listener from them in a single transaction.
+        Feeds that nobody subscribes to any more are removed, along
+        with their episodes, feed caches and polling schedules.
+
+        """
+
+        parameters = [(podcast_url,) for podcast_url in url_list]
+        cursor = self.dbi.cursor()
+        cursor.executemany(self.remove_subscription_delete, [(self.listener, podcast_url) for podcast_url in url_list])
+        cursor.executemany(self.remove_episodes_delete, parameters)
+        cursor.executemany(self.remove_feed_cache_delete, parameters)
+        cursor.executemany(self.remove_poll_delete, parameters)
+        cursor.executemany(self.remove_podcast_delete, parameters)
+        self.commit()
+
+    def add_new_podcast_list(self, podcast_list, outfile=None):
+        """PodPlayerDB.add_new_podcast_list() takes a list of (url, load
+        type, priority, name) tuples and adds the ones the listener
+        doesn't subscribe to yet with add_podcast_list(), warning about
+        the rest on outfile, or the console if none is given.  The
+        existing URLs are read once.
+
+        """
+
+        existing = self.podcast_urls()
+        adding   = []
+        for podcast in podcast_list:
+            if podcast[0] in existing:
+                print("Warning:  Skipping %s becasue it is already in the database." % (podcast[0],), file=outfile)
+            else:
+                existing.add(podcast[0])
+                adding += [podcast]
+        self.add_podcast_list(adding)
+
+    def remove_known_podcast_list(self, url_list, outfile=None):
+        """PodPlayerDB.remove_known_podcast_list() takes a list of podcast
+        URLs and removes the ones the listener subscribes to with
+        remove_podcast_list(), warning about the rest on outfile, or
+        the console if none is given.  The existing URLs are read
+        once.
+
+        """
+
+        existing = self.podcast_urls()
+        removing = []
+        for podcast_url in url_list:
+            if podcast_url in existing:
+                existing.remove(podcast_url)
+                removing += [podcast_url]
+            else:
+                print("Warning:  Skipping %s becasue it is not in the database." % (podcast_url,), file=outfile)
+        self.remove_podcast_list(removing)
+
+    def pretty_list(self, outfile=None):
+        """PodPlayerDB.pretty_list() presents a table of the listener's
+        podcasts on outfile, or the console if none is given, along
+        with how many episodes of each are waiting to be played.
+
+        """
+
+        print ("%-3s %-5s %-4s %-30s %s" % ("Pri","Type","New","Name","URL"), file=outfile)
+        print ("=" * 80, file=outfile)
+        for entry in list(self.scan_podcasts()):
+            print ("%3d %-5s %4d %-30s %s" % (entry.podcast_priority, entry.podcast_load_type, self.count_unplayed(entry), entry.podcast_name, entry.podcast_url), file=outfile)
+
+    def update_last_played(self, podcast_url, episode_url):
+        """PodPlayerDB.update_last_played takes a podcast URL and an episode
+        URL and puts the episode URL on the listener's subscription to
+        the podcast referenced by the podcast URL.
+
+        """
+        cursor = self.dbi.cursor()
+        cursor.execute(self.update_last_played_update, (episode_url, self.listener, podcast_url))
+        self.commit()
+
+    def update_name(self, podcast_url, podcast_name):
+        """PodPlayerDB.update_name takes the podcast URL and the podcast name,
+        and puts the name on the record associated with that URL.
+
+        """
+        cursor = self.dbi.cursor()
+        cursor.execute(self.update_name_update, (podcast_name, podcast_url))
+        self.commit()
+
+    def update_feed_cache(self, podcast):
+        """PodPlayerDB.update_feed_cache() takes a Podcast object and saves
+        its ETag, Last-Modified, content hash and parsed Episodes,
+        so that the next fetch can be made conditional.
+
+        """
+
+        if podcast.feed_episodes is None:
+            feed_episodes = None
+        else:
+            feed_episodes = json.dumps({"complete": podcast.feed_complete, "items": [episode.to_cache() for episode in podcast.feed_episodes]})
+        cursor = self.dbi.cursor()
+        cursor.execute(self.update_feed_cache_replace, (podcast.podcast_url, podcast.feed_etag, podcast.feed_last_modified, podcast.feed_hash, feed_episodes))
+        self.commit()
+        
+    def merge_episodes(self, podcast):
+        """PodPlayerDB.merge_episodes() takes a Podcast object and adds any
+        episodes in its episode_index that are not in the database
+        yet, along with their publish times and enclosure details.  The index is walked from
+        oldest to newest, and new episodes are numbered upward from the
+        highest number already handed out.  Nothing is done if the
+        episodes came from the cache and the podcast already has
+        episodes.
+
+        """
+
+        podcast.episodes_added = 0
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.max_episode_seq_select, (podcast.podcast_id,))
+        max_seq = cursor.fetchone()[0]
+        if max_seq is not None and not podcast.episodes_parsed:
+            return
+        if max_seq is None:
+            max_seq = 0
+
+        cursor.execute(self.known_episodes_select, (podcast.podcast_id,))
+        known = set([result[0] for result in cursor])
+
+        now   = self.clock.time()
+        added = []
+        for episode in podcast.episode_index.episodes:
+            if episode.url not in known:
+                known.add(episode.url)
+                max_seq += 1
+                added += [(podcast.podcast_id, episode.url, max_seq, now, episode.published, episode.length, episode.type, episode.duration, episode.guid)]
+
+        if len(added) > 0:
+            if self.debug:
+                print ("    %d new episodes." % (len(added),))
+            cursor.executemany(self.add_episode_insert, added)
+            self.commit()
+        podcast.episodes_added = len(added)
+
+    def publish_gaps(self, podcast_id, count=10):
+        """PodPlayerDB.publish_gaps() takes a podcast ID and returns a list
+        of the gaps in seconds between its most recent episodes, up to
+        count of them.  Publish times are used if at least two
+        episodes are dated.  Otherwise it goes by the times new
+        episodes were first seen, leaving out the earliest, because
+        that is when the podcast was subscribed to, with its whole
+        back catalog, not when anything was published.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.published_select, (podcast_id, count + 1))
+        seen = [result[0] for result in cursor]
+        if len(seen) < 2:
+            cursor.execute(self.first_seen_select, (podcast_id, count + 1))
+            seen = [result[0] for result in cursor]
+            if len(seen) < count + 1:
+                #We got all the way back to the subscription.
+                seen = seen[:-1]
+        return [seen[index] - seen[index + 1] for index in range(len(seen) - 1)]
+
+    def update_poll(self, podcast):
+        """PodPlayerDB.update_poll() takes a Podcast object that has just been
+        polled, schedules its next poll with Podcast.schedule_next_poll()
+        and saves the schedule.
+
+        """
+
+        podcast.schedule_next_poll(self.publish_gaps(podcast.podcast_id))
+        if self.verbose and podcast.poll_failures > 0:
+            print ("    %d failures in a row.  Trying again at %s." % (podcast.poll_failures, time.ctime(podcast.poll_next_due)))
+        elif self.debug:
+            print ("    Next poll at %s." % (time.ctime(podcast.poll_next_due),))
+        cursor = self.dbi.cursor()
+        cursor.execute(self.update_poll_replace, (podcast.podcast_url, podcast.poll_interval, podcast.poll_next_due, podcast.poll_failures, podcast.poll_last_error))
+        self.commit()
+
+    def claim_poll(self, podcast, until):
+        """PodPlayerDB.claim_poll() takes a Podcast that is due and a time,
+        and moves its next poll to that time, so that no other player
+        sharing the database polls it in the meantime.  It returns
+        True if it did, and False if another player got there first.
+        The Podcast itself is left alone.
+
+        """
+
+        cursor = self.dbi.cursor()
+        if podcast.poll_next_due is None:
+            cursor.execute(self.claim_poll_insert, (podcast.podcast_url, until))
+            if cursor.rowcount == 1:
+                self.commit()
+                return True
+        cursor.execute(self.claim_poll_update, (until, podcast.podcast_url, podcast.poll_next_due))
+        self.commit()
+        return cursor.rowcount == 1
+
+    def release_poll(self, podcast, until):
+        """PodPlayerDB.release_poll() takes a Podcast claimed with
+        claim_poll() and the time it was claimed until, and puts its
+        next poll back the way it was, so that a feed that ended up
+        not being fetched is due again right away.  Nothing is done if
+        the podcast has been polled since.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.claim_poll_update, (podcast.poll_next_due, podcast.podcast_url, until))
+        self.commit()
+
+    def failing_feeds(self):
+        """PodPlayerDB.failing_feeds() returns a list of (URL, failures in a
+        row, last failure, next try) tuples for the feeds whose last
+        poll failed.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.failing_feeds_select)
+        return cursor.fetchall()
+
+    def next_poll_due(self):
+        """PodPlayerDB.next_poll_due() returns the earliest time any of the
+        listener's podcasts is due to be polled, or None if there are
+        no podcasts.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.next_poll_due_select, (self.listener,))
+        return cursor.fetchone()[0]
+
+    def newest_episode(self, podcast_id):
+        """PodPlayerDB.newest_episode() takes a podcast ID and returns the
+        URL of its newest episode, or None if it has none.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.newest_episode_select, (podcast_id,))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        return result[0]
+
+    def next_episode(self, podcast_id, episode_url):
+        """PodPlayerDB.next_episode() takes a podcast ID and an episode URL
+        and returns the URL of the episode after that one.  If the
+        episode URL is not known, it returns the oldest episode.  If
+        there is nothing after it, it returns None.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.next_episode_select, (podcast_id, podcast_id, episode_url, podcast_id, episode_url))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        return result[0]
+
+    def count_unplayed(self, podcast):
+        """PodPlayerDB.count_unplayed() takes a Podcast object and returns
+        how many of its known episodes would still be played.  For a
+        front-loaded podcast that is at most one.
+
+        """
+
+        if podcast.podcast_load_type == 'front':
+            newest = self.newest_episode(podcast.podcast_id)
+            if newest is None or newest == podcast.podcast_last_played:
+                return 0
+            return 1
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.count_unplayed_select, (podcast.podcast_id, podcast.podcast_id, podcast.podcast_last_played, podcast.podcast_id, podcast.podcast_last_played))
+        return cursor.fetchone()[0]
+
+    def find_media(self, media_url):
+        """PodPlayerDB.find_media() takes a media URL and returns the key and
+        size of its cached file, or None if it isn't cached.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.find_media_select, (media_url,))
+        return cursor.fetchone()
+
+    def add_media(self, media_url, media_key, media_size):
+        """PodPlayerDB.add_media() records that the content from a media URL
+        is cached under a key, and how big it is.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.add_media_replace, (media_url, media_key, media_size, self.clock.time()))
+        self.commit()
+
+    def touch_media(self, media_url):
+        """PodPlayerDB.touch_media() marks the cached file for a media URL as
+        just used.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.touch_media_update, (self.clock.time(), media_url))
+        self.commit()
+
+    def remove_media(self, media_url):
+        """PodPlayerDB.remove_media() forgets the cached file for a media URL
+        and returns how many other URLs still share that file.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.find_media_select, (media_url,))
+        result = cursor.fetchone()
+        cursor.execute(self.remove_media_delete, (media_url,))
+        self.commit()
+        if result is None:
+            return 0
+        cursor.execute(self.media_key_count_select, (result[0],))
+        return cursor.fetchone()[0]
+
+    def media_total(self):
+        """PodPlayerDB.media_total() returns the total size in bytes of the
+        media cache.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.media_total_select)
+        return cursor.fetchone()[0]
+
+    def scan_media(self):
+        """PodPlayerDB.scan_media() yields (url, key, size) for each cached
+        media file, least recently used first.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.lru_media_select)
+        for result in cursor:
+            yield result
+
+    def add_metrics(self, records):
+        """PodPlayerDB.add_metrics() takes a list of records from
+        Metrics.drain() and stores them in a single transaction,
+        throwing away all but the newest self.metric_keep.
+
+        """
+
+        if len(records) == 0:
+            return
+        cursor = self.dbi.cursor()
+        cursor.executemany(self.add_metric_insert, records)
+        cursor.execute(self.prune_metrics_delete, (self.metric_keep,))
+        self.commit()
+
+    def phase_timings(self):
+        """PodPlayerDB.phase_timings() yields (phase, count, failures,
+        seconds) for each phase timed, where seconds is a list of
+        every timing of that phase, fastest first.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.metric_phases_select)
+        for phase, count, failures in cursor.fetchall():
+            cursor.execute(self.metric_seconds_select, (phase,))
+            yield phase, count, failures, [result[0] for result in cursor.fetchall()]
+
+    def slowest_feeds(self, count=10):
+        """PodPlayerDB.slowest_feeds() returns a list of up to count (URL,
+        fetches, average seconds, bytes fetched, failures, latest failure)
+        tuples for the feeds whose fetch and parse take the longest on
+        average.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.slowest_feeds_select, (count,))
+        return cursor.fetchall()
+
+    def find_episode(self, podcast_id, episode_url):
+        """PodPlayerDB.find_episode() takes a podcast ID and an episode URL
+        and returns the Episode, or None if it isn't there.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.find_episode_select, (podcast_id, episode_url))
+        result = cursor.fetchone()
+        if result is None:
+            return None
+        return Episode(*result)
+
+    def load_feed_episodes(self, text):
+        """PodPlayerDB.load_feed_episodes() takes the feed_episodes column of
+        feed_cache_v1, as written by update_feed_cache(), and returns
+        the list of Episodes in it, along with whether the list is
+        complete.
+
+        """
+
+        cached = json.loads(text)
+        return [Episode(*item) for item in cached["items"]], cached["complete"]
+
+    def load_feed_cache(self, podcast):
+        """PodPlayerDB.load_feed_cache() takes a Podcast from
+        scan_podcasts() and fills in the list of Episodes saved from
+        its last fetch, and whether that list is complete.  Nothing
+        is changed if there is no saved list.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.load_feed_cache_select, (podcast.podcast_url,))
+        result = cursor.fetchone()
+        if result is not None and result[0] is not None:
+            podcast.feed_episodes, podcast.feed_complete = self.load_feed_episodes(result[0])
+
+    def scan_podcasts(self):
+        """PodPlayerDB.scan_podcasts retrieves from the database a list of
+        the listener's podcasts, sorted in order by priority.  It
+        yields each as a Podcast object.  The episode lists saved
+        from the last fetches are left out, since only the podcasts
+        that get fetched need them; load_feed_cache() fills them in.
+
+        """
+
+        cursor = self.dbi.cursor()
+        cursor.execute(self.scan_podcasts_select, (self.listener,))
+        for result in cursor:
+            #0 podcast_id
+            #1 podcast_priority
+            #2 podcast_load_type
+            #3 podcast_url
+            #4 podcast_name
+            #5 podcast_last_played
+            #6 feed_etag
+            #7 feed_last_modified
+            #8 feed_hash
+            #9 poll_interval
+            #10 poll_next_due
+            #11 poll_failures
+            #12 poll_last_error
+            yield Podcast(podcast_id=result[0], podcast_priority=result[1], podcast_load_type=result[2], podcast_url=result[3], podcast_name=result[4], podcast_last_played=result[5], feed_etag=result[6], feed_last_modified=result[7], feed_hash=result[8], poll_interval=result[9], poll_next_due=result[10], poll_failures=result[11], poll_last_error=result[12], database=self, clock=self.clock, verbose=self.verbose, debug=self.debug)  
+        
+class MediaCache(object):
+    """Class MediaCache keeps downloaded episodes in a directory, named by
+    the SHA-256 of their content, up to a budget in bytes.  The index
+    of what is there lives in the media_v1 table.  When the budget
+    is exceeded, the least recently used files go first, but a file
+    that is pinned, such as the one playing, is never removed.
+
+    """
+
+    #partial_age is how long in seconds an unfinished download is kept
+    #for, in case the episode is tried again.
+    partial_age = 7 * 86400.0
+
+    def __init__(self, directory, budget, verbose=False, debug=False):
+        """MediaCache.__init__() copies its arguments to like-named
+        properties, makes the directory if it isn't there, and clears
+        out old unfinished downloads.
+
+        """
+
+        self.verbose   = verbose or debug
+        self.debug     = debug
+
+        self.directory = directory
+        self.budget    = budget
+        self.lock      = threading.Lock()
+        self.pinned    = {}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.clean_partials()
+
+    def media_path(self, media_key, media_url):
+        """MediaCache.media_path() takes a key and the URL it came from, and
+        returns the path to the file.  The extension is kept from the
+        URL so that the player has a hint about the format.
+
+        """
+
+        extension = os.path.splitext(urllib.parse.urlsplit(media_url).path)[1]
+        if not re.match("^\\.[A-Za-z0-9]{1,5}$", extension):
+            extension = ""
+        return os.path.join(self.directory, media_key + extension)
+
+    def pin(self, media_path):
+        """MediaCache.pin() keeps a file from being evicted until it is
+        unpinned as many times as it was pinned.
+
+        """
+
+        with self.lock:
+            self.pinned[media_path] = self.pinned.get(media_path, 0) + 1
+
+    def unpin(self, media_path):
+        """MediaCache.unpin() undoes one pin().
+
+        """
+
+        with self.lock:
+            count = self.pinned.get(media_path, 0) - 1
+            if count > 0:
+                self.pinned[media_path] = count
+            else:
+                self.pinned.pop(media_path, None)
+
+    def lookup(self, database, media_url):
+        """MediaCache.lookup() takes a PodPlayerDB and a media URL, and returns
+        the path of the cached file for it, or None.  A hit counts as
+        a use.  An index entry whose file has gone missing is dropped.
+
+        """
+
+        result = database.find_media(media_url)
+        if result is None:
+            return None
+        media_path = self.media_path(result[0], media_url)
+        if not os.path.exists(media_path) or os.path.getsize(media_path) != result[1]:
+            database.remove_media(media_url)
+            return None
+        database.touch_media(media_url)
+        return media_path
+
+    def fetch(self, database, http, media_url, media_size=None, progress=None, segments=1):
+        """MediaCache.fetch() takes a PodPlayerDB, an HttpClient, a media
+        URL and optionally its size from the feed, and returns the
+        path to the content, downloading it only if it isn't cached.
+        If the size is known, room is made for it before the download
+        starts.  The file comes back pinned, so the caller has to
+        unpin() it when done.  Download errors are raised.  progress
+        and segments are passed on to HttpClient.download().
+
+        A download that fails partway is left where it is, so that the
+        next fetch of the same URL carries on from there.
+
+        """
+
+        media_path = self.lookup(database, media_url)
+        if media_path is not None:
+            if self.verbose:
+                print ("Playing %s from the cache." % (media_url,))
+            self.pin(media_path)
+            return media_path
+
+        if media_size is not None:
+            self.evict(database, media_size)
+
+        partial_path = os.path.join(self.directory, ".partial-" + hashlib.sha256(media_url.encode('utf-8')).hexdigest())
+        http.download(media_url, partial_path, progress=progress, segments=segments, expected_size=media_size)
+
+        digest = hashlib.sha256()
+        with open(partial_path, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1048576), b''):
+                digest.update(chunk)
+        media_key  = digest.hexdigest()
+        media_path = self.media_path(media_key, media_url)
+        media_size = os.path.getsize(partial_path)
+        os.replace(partial_path, media_path)
+
+        self.pin(media_path)
+        with database.transaction():
+            database.add_media(media_url, media_key, media_size)
+            self.evict(database)
+        return media_path
+
+    def clean_partials(self):
+        """MediaCache.clean_partials() removes what is left of downloads
+        that were last touched more than self.partial_age seconds ago,
+        since they are probably never going to be finished.
+
+        """
+
+        cutoff = time.time() - self.partial_age
+        for name in os.listdir(self.directory):
+            if not name.startswith(".partial-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    if self.debug:
+                        print ("    Removing %s." % (path,))
+                    os.remove(path)
+            except OSError:
+                #Another player finished or removed it first.
+                pass
+
+    def evict(self, database, room=0):
+        """MediaCache.evict() takes a PodPlayerDB and removes least recently
+        used files until the cache fits the budget with room bytes to
+        spare, skipping any that are pinned.
+
+        """
+
+        total = database.media_total() + room
+        if total <= self.budget:
+            return
+
+        with self.lock:
+            pinned = set(self.pinned)
+        with database.transaction():
+            for media_url, media_key, media_size in list(database.scan_media()):
+                if total <= self.budget:
+                    break
+                media_path = self.media_path(media_key, media_url)
+                if media_path in pinned:
+                    continue
+                if database.remove_media(media_url) == 0:
+                    if self.debug:
+                        print ("    Evicting %s." % (media_path,))
+                    if os.path.exists(media_path):
+                        os.remove(media_path)
+                    total -= media_size
+
+class PlayQueue(object):
+    """Class PlayQueue is the order everything will be played in.  Each
+    podcast's unplayed episodes are already in order in the database,
+    so each podcast only puts its head, the episode it would play
+    next, on a heap keyed on priority, then podcast ID.  The top of
+    the heap is what plays next, and merging the podcasts k ways from
+    there gives the plays after it.
+
+    Podcasts of the same priority go by podcast ID, the same as
+    before there was a queue, rather than by publish time.  A
+    front-loaded podcast's head is always its newest episode, so it
+    would lose every tie to a back-loaded podcast's backlog.
+
+    A podcast's head only changes when its feed is refreshed or one
+    of its episodes is played, so only that podcast's entry is
+    replaced.  The old entry is marked dead and left in the heap
+    until it comes to the top.
+
+    """
+
+    def __init__(self, verbose=False, debug=False):
+        """PlayQueue.__init__() sets up an empty queue.  self.heap holds
+        [key, Podcast, Episode, live] entries, self.entries maps each
+        podcast ID to its live entry, and self.podcasts maps each
+        podcast ID to the Podcast its head was worked out for, whether
+        it has one or not.
+
+        """
+
+        self.verbose  = verbose or debug
+        self.debug    = debug
+
+        self.heap     = []
+        self.entries  = {}
+        self.podcasts = {}
+        self.counter  = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, podcast, episode):
+        """PlayQueue.update() takes a Podcast and its head Episode, or None
+        if it has nothing to play, and puts it in place of the
+        podcast's old head.
+
+        """
+
+        self.remove(podcast.podcast_id)
+        self.podcasts[podcast.podcast_id] = podcast
+        if episode is None:
+            return
+        #The counter keeps keys unique, so entries never get compared
+        #past their keys.
+        self.counter += 1
+        entry = [(podcast.podcast_priority, podcast.podcast_id, self.counter), podcast, episode, True]
+        self.entries[podcast.podcast_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def remove(self, podcast_id):
+        """PlayQueue.remove() takes a podcast ID and takes the podcast out of
+        the queue.
+
+        """
+
+        self.podcasts.pop(podcast_id, None)
+        entry = self.entries.pop(podcast_id, None)
+        if entry is not None:
+            entry[3] = False
+
+    def peek(self, held=None):
+        """PlayQueue.peek() returns the (Podcast, Episode) to play next, or
+        None if there is nothing to play.  held is an optional set of
+        episode URLs to pass over, which is only looked at if the top
+        of the queue is one of them.
+
+        """
+
+        while len(self.heap) > 0 and not self.heap[0][3]:
+            heapq.heappop(self.heap)
+        if len(self.heap) == 0:
+            return None
+        if not held or self.heap[0][2].url not in held:
+            return self.heap[0][1], self.heap[0][2]
+        entries = [entry for entry in self.heap if entry[3] and entry[2].url not in held]
+        if len(entries) == 0:
+            return None
+        entry = min(entries, key=lambda entry: entry[0])
+        return entry[1], entry[2]
+
+    def sync(self, podcasts):
+        """PlayQueue.sync() takes the list of Podcasts from
+        PodPlayerDB.scan_podcasts(), with their database set, and brings
+        the queue up to date with it.  Heads are only worked out again
+        for podcasts that are new, or whose priority, load type, last
+        play or next poll has changed, the last of which means that
+        something else polled the feed.  Podcasts that are gone are
+        removed.
+
+        """
+
+        current = set()
+        for podcast in podcasts:
+            current.add(podcast.podcast_id)
+            known = self.podcasts.get(podcast.podcast_id)
+            if known is None or known.podcast_priority != podcast.podcast_priority or known.podcast_load_type != podcast.podcast_load_type or known.podcast_last_played != podcast.podcast_last_played or known.poll_next_due != podcast.poll_next_due:
+                self.update(podcast, podcast.database_choice())
+            else:
+                #Keep the newer Podcast, for its feed state.
+                self.podcasts[podcast.podcast_id] = podcast
+                entry = self.entries.get(podcast.podcast_id)
+                if entry is not None:
+                    entry[1] = podcast
+        for podcast_id in list(self.podcasts):
+            if podcast_id not in current:
+                self.remove(podcast_id)
+
+    def upcoming(self, database, count):
+        """PlayQueue.upcoming() takes a PodPlayerDB and a count, and returns
+        a list of the next count (Podcast, Episode) pairs to be
+        played, assuming nothing new comes in.  The queue itself is
+        left alone.
+
+        """
+
+        heap = [list(entry) for entry in self.heap if entry[3]]
+        heapq.heapify(heap)
+        counter = self.counter
+        plays   = []
+        while len(heap) > 0 and len(plays) < count:
+            key, podcast, episode, live = heapq.heappop(heap)
+            plays += [(podcast, episode)]
+
+            #A front-loaded podcast only ever plays its newest episode.
+            if podcast.podcast_load_type == 'front':
+                continue
+            episode_url = database.next_episode(podcast.podcast_id, episode.url)
+            if episode_url is None:
+                continue
+            following = database.find_episode(podcast.podcast_id, episode_url)
+            counter += 1
+            heapq.heappush(heap, [(podcast.podcast_priority, podcast.podcast_id, counter), podcast, following, True])
+        return plays
+
+    def print_upcoming(self, database, count, outfile=None):
+        """PlayQueue.print_upcoming() takes a PodPlayerDB and a count,
+        brings the queue up to date with the database, and presents a
+        table of the next count plays from upcoming() on outfile, or
+        the console if none is given.
+
+        """
+
+        self.sync(list(database.scan_podcasts()))
+
+        print ("%-3s %-3s %-16s %-30s %s" % ("#","Pri","Published","Podcast","Episode"), file=outfile)
+        print ("=" * 80, file=outfile)
+        for number, (podcast, episode) in enumerate(self.upcoming(database, count), 1):
+            if episode.published:
+                published = time.strftime("%Y-%m-%d %H:%M", time.localtime(episode.published))
+            else:
+                published = "-"
+            print ("%3d %3d %-16s %-30s %s" % (number, podcast.podcast_priority, published, (podcast.podcast_name or podcast.podcast_url)[:30], episode.url), file=outfile)
+
+class PodPlayer(object):
+    """Class PodPlayer is the glue class for this program.
+
+    """
+
+    #min_poll_wait is the shortest time in seconds to sleep when there
+    #is nothing to play, so that a feed that keeps failing can't
+    #turn the wait into a busy loop.
+    min_poll_wait = 60.0
+
+    #An episode that can't be downloaded isn't counted as played.  It
+    #is held back for download_min_wait seconds, doubling with each
+    #failure in a row up to download_max_wait, while the rest of the
+    #queue plays, and then comes up again.
+    download_min_wait = 60.0
+    download_max_wait = 3600.0
+
+    #player_command is the media player, which is run with the path to
+    #play on the end.
+    player_command = ["/usr/bin/mpv"]
+
+    #assumed_byte_rate is how many bytes a second of audio is taken to
+    #be when the feed doesn't give both the size and the duration.
+    #16000 is 128 kbit/s, which is about as high as podcasts go.
+    assumed_byte_rate = 16000
+
+    def __init__(self, dbpath, jobs=1, streaming=False, prefetch=False,
+                 timeout=5, cachedir="/dev/shm/podplayer", cachesize=512 * 1048576,
+                 profile=None, readahead_bytes=None, readahead_seconds=None,
+                 listener="default", segments=4, clock=time, verbose=False, debug=False):
+        """PodPlayer.__init__ takes a database path, the number of feeds
+        to fetch at once, whether to stream-parse feeds, whether to
+        download ahead when playing continuously, the network timeout,
+        the media cache directory and its size in bytes, a file to
+        write a profile of the first selection cycle to, how much of
+        an episode to download before starting to play it, in bytes
+        or in seconds, the name of the listener whose subscriptions
+        to use, how many pieces to download an episode in at once, the
+        clock to go by, anything with a time() like the time module's,
+        and optional feedback flags.  If neither read-ahead is
+        given, episodes are downloaded in full before they play.  It
+        instantiates a PodPlayerDB object, an
+        HttpClient, a MediaCache and a Metrics.
+
+        """
+        self.verbose  = verbose or debug
+        self.debug    = debug
+
+        self.jobs      = jobs
+        self.streaming = streaming
+        self.prefetch  = prefetch
+        self.dbpath    = dbpath
+        self.listener  = listener
+        self.clock     = clock
+        self.database  = PodPlayerDB(dbpath=self.dbpath, listener=self.listener, clock=self.clock, verbose=self.verbose, debug=self.debug)
+        self.http      = HttpClient(timeout=timeout, verbose=self.verbose, debug=self.debug)
+        self.cache     = MediaCache(directory=cachedir, budget=cachesize, verbose=self.verbose, debug=self.debug)
+        self.metrics   = Metrics(clock=self.clock)
+        self.profile   = profile
+        self.queue     = PlayQueue(verbose=self.verbose, debug=self.debug)
+
+        #self.indexes keeps each podcast's EpisodeIndex, by podcast ID,
+        #from one refresh to the next, so that a refresh only has to
+        #insert what is new.  A podcast's index is taken out while its
+        #feed is being fetched, so only one thread has it at a time.
+        self.indexes   = {}
+
+        self.readahead_bytes   = readahead_bytes
+        self.readahead_seconds = readahead_seconds
+        self.segments          = segments
+
+        #Playback state, for podplayerd.  Other threads may call
+        #stop_playback(), request_episode() and wake(), and read
+        #self.now_playing, self.playing_since and self.waiting_until.
+        #self.held maps the URL of each episode whose download failed
+        #to (failures in a row, time to try again); it is guarded by
+        #self.lock too, since the Prefetcher downloads.  self.skipped
+        #is set when stop_playback() cuts play_file() short.
+        self.lock           = threading.Lock()
+        self.held           = {}
+        self.wakeup         = threading.Event()
+        self.process        = None
+        self.skipped        = False
+        self.requested      = None
+        self.now_playing    = None
+        self.playing_since  = None
+        self.waiting_until  = None
+
+    def add_podcasts(self, url_list, podcast_priority, podcast_type, outfile=None):
+        """PodPlyer.add_podcasts() takes a list of URLs, a priority and a
+        podcast type, and inserts all of the listed URLs with that
+        priority and load type into the database.  Before insertion,
+        it checks to see if a podcast is already there, and prints a
+        warning if it is, rather than inserting it.  Warnings go to
+        outfile, or the console if none is given.
+
+        """
+
+        self.add_podcast_list([(podcast_url, podcast_type, podcast_priority, None) for podcast_url in url_list], outfile)
+
+    def add_podcast_list(self, podcast_list, outfile=None):
+        """PodPlayer.add_podcast_list() takes a list of (url, load type,
+        priority, name) tuples and inserts the ones that aren't in the
+        database yet, warning about the rest on outfile.  The existing
+        URLs are read once, and the inserts all go in one transaction.
+
+        """
+
+        self.database.add_new_podcast_list(podcast_list, outfile)
+
+    def remove_podcasts(self, url_list, outfile=None):
+        """PodPlayer.remove_podcasts() takes a list of URLs and removes from
+        the database any podcasts represented by those URLs.  The
+        existing URLs are read once, and the deletes all go in one
+        transaction.  Warnings go to outfile, or the console if none
+        is given.
+
+        """
+
+        self.database.remove_known_podcast_list(url_list, outfile)
+
+    def import_opml(self, path_list, podcast_priority, podcast_type):
+        """PodPlayer.import_opml() takes a list of OPML file paths, and a
+        default priority and load type, and adds every feed outline in
+        them.  An outline's podplayerPriority and podplayerLoadType
+        attributes, as written by export_opml(), override the defaults.
+
+        """
+
+        podcast_list = []
+        for path in path_list:
+            tree = ET.parse(path)
+            for outline in tree.iter('outline'):
+                podcast_url = outline.get('xmlUrl')
+                if podcast_url is None:
+                    #A folder, not a feed.
+                    continue
+                priority = outline.get('podplayerPriority')
+                if priority is None:
+                    priority = podcast_priority
+                else:
+                    priority = int(priority)
+                load_type = outline.get('podplayerLoadType', podcast_type)
+                if load_type not in ('front', 'back', None):
+                    raise ImNotDoingThat("%s has a load type of %s." % (podcast_url, load_type))
+                name = outline.get('title', outline.get('text'))
+                if name == podcast_url:
+                    #export_opml() had no name to give it.
+                    name = None
+                podcast_list += [(podcast_url, load_type, priority, name)]
+        self.add_podcast_list(podcast_list)
+
+    def export_opml(self, outfile):
+        """PodPlayer.export_opml() writes every podcast to the given file
+        object as an OPML document, with priority and load type in
+        podplayerPriority and podplayerLoadType attributes.
+
+        """
+
+        opml = ET.Element('opml', version='2.0')
+        head = ET.SubElement(opml, 'head')
+        ET.SubElement(head, 'title').text = "PodPlayer subscriptions"
+        body = ET.SubElement(opml, 'body')
+        for podcast in list(self.database.scan_podcasts()):
+            outline = ET.SubElement(body, 'outline', type='rss', xmlUrl=podcast.podcast_url)
+            if podcast.podcast_name is not None:
+                outline.set('text', podcast.podcast_name)
+                outline.set('title', podcast.podcast_name)
+            else:
+                outline.set('text', podcast.podcast_url)
+            outline.set('podplayerPriority', str(podcast.podcast_priority))
+            if podcast.podcast_load_type is not None:
+                outline.set('podplayerLoadType', podcast.podcast_load_type)
+        ET.indent(opml)
+        outfile.write(ET.tostring(opml, encoding='unicode', xml_declaration=True))
+        outfile.write("\n")
+
+    def pretty_list(self, outfile=None):
+        """PodPlayer.pretty_list() queries the database for all podcasts and
+        presents a table of them on outfile, or the console if none is
+        given, along with how many episodes of each are waiting to be
+        played.  This only looks at the database, never at the feeds.
+
+        """
+
+        self.database.pretty_list(outfile)
+
+    def print_stats(self, count=10):
+        """PodPlayer.print_stats() presents a table of how long each phase
+        of the recent selection cycles took, at the median and the
+        95th percentile, then the count slowest feeds to fetch and
+        parse, with their latest failure, if any, and then the feeds
+        that are failing now and when each will be tried again.
+
+        """
+
+        print ("%-10s %7s %7s %10s %10s %10s" % ("Phase","Count","Failed","p50","p95","Max"))
+        print ("=" * 80)
+        for phase, total, failures, seconds in self.database.phase_timings():
+            print ("%-10s %7d %7d %10.3f %10.3f %10.3f" % (phase, total, failures, self.percentile(seconds, 50), self.percentile(seconds, 95), seconds[-1]))
+        print ()
+        print ("%-8s %7s %7s %10s %s" % ("Avg","Fetches","Failed","KiB","URL"))
+        print ("=" * 80)
+        for podcast_url, fetches, average, size, failures, error in self.database.slowest_feeds(count):
+            print ("%8.3f %7d %7d %10d %s" % (average, fetches, failures, size // 1024, podcast_url))
+            if error is not None:
+                print ("%34s Last failure: %s" % ("", error))
+
+        failing = self.database.failing_feeds()
+        if len(failing) > 0:
+            print ()
+            print ("%-8s %-16s %s" % ("Failures","Next try","URL"))
+            print ("=" * 80)
+            for podcast_url, failures, error, next_due in failing:
+                print ("%8d %-16s %s" % (failures, time.strftime("%Y-%m-%d %H:%M", time.localtime(next_due)), podcast_url))
+                print ("%25s %s" % ("", error))
+
+    def percentile(self, values, percent):
+        """PodPlayer.percentile() takes a sorted list of numbers and a
+        percentage, and returns the nearest-rank percentile.
+
+        """
+
+        if len(values) == 0:
+            return 0.0
+        rank = max(1, -(-len(values) * percent // 100))
+        return values[int(rank) - 1]
+
+    def make_selection(self, database=None, played=None):
+        """PodPlayer.make_selection() brings the PlayQueue up to date with
+        the podcasts returned by PodPlayerDB.scan_podcasts(), has
+        refresh_feeds() fetch the feeds that are due, and returns a
+        Selection object for the top of the queue, or None if there
+        is nothing to play.  Priority comes first, and among podcasts
+        of the same priority, podcast ID.
+
+        Any podcast whose feed validators changed along the way gets
+        them saved so the next pass can make a conditional fetch, and
+        any podcast that was polled gets its next poll scheduled.
+        Podcasts that aren't due are not fetched, but can still be
+        selected from the episodes already in the database.
+
+        The optional arguments are there for the download-ahead
+        pipeline.  database stands in for self.database, since a
+        database connection can't be shared between threads.  played
+        is a Selection to treat as already played.  Either one gets a
+        PlayQueue of its own rather than self.queue.
+
+        The whole cycle is timed into self.metrics, which is then
+        saved to the database.  If self.profile is set, the cycle is
+        run by profile_selection() instead.
+
+        """
+        
+        if database is None:
+            database = self.database
+
+        if self.profile is not None and database is self.database:
+            return self.profile_selection(played)
+
+        started = time.perf_counter()
+
+        #The whole list is pulled up front so that the cursor is not
+        #still open while we write feed caches back.
+        podcasts = []
+        for podcast in list(database.scan_podcasts()):
+            podcast.streaming = self.streaming
+            podcast.http      = self.http
+            podcast.metrics   = self.metrics
+            if played is not None and podcast.podcast_url == played.podcast.podcast_url:
+                podcast.podcast_last_played = played.episode_url
+            podcasts += [podcast]
+
+        if database is self.database and played is None:
+            queue = self.queue
+        else:
+            queue = PlayQueue(verbose=self.verbose, debug=self.debug)
+        queue.sync(podcasts)
+        self.refresh_feeds(podcasts, database, queue)
+
+        selection = None
+        top       = queue.peek(self.held_episodes())
+        if top is not None:
+            selection = Selection(podcast=top[0], episode_url=top[1].url, episode=top[1], verbose=self.verbose, debug=self.debug)
+
+        if selection is None:
+            self.metrics.record("select", None, time.perf_counter() - started)
+        else:
+            self.metrics.record("select", selection.podcast.podcast_url, time.perf_counter() - started)
+        database.add_metrics(self.metrics.drain())
+        return selection
+
+    def profile_selection(self, played=None):
+        """PodPlayer.profile_selection() runs one make_selection() under
+        cProfile and writes the statistics to the file named by
+        self.profile, for reading with pstats.  self.profile is then
+        cleared, so only the one cycle is captured.
+
+        """
+
+        profile, self.profile = self.profile, None
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.make_selection, None, played)
+        finally:
+            profiler.dump_stats(profile)
+            if self.verbose:
+                print ("Wrote profile of one selection cycle to %s." % (profile,))
+
+    def save_podcast_state(self, podcast, database):
+        """PodPlayer.save_podcast_state() takes a Podcast object that has
+        just been through Podcast.make_selection() and the PodPlayerDB
+        it came from, and saves its feed cache if that changed and its
+        polling schedule if it was polled.  The writes are timed into
+        self.metrics.
+
+        """
+
+        started = time.perf_counter()
+        if podcast.feed_changed:
+            database.update_feed_cache(podcast)
+        if podcast.polled:
+            database.update_poll(podcast)
+        if podcast.feed_changed or podcast.polled:
+            self.metrics.record("commit", podcast.podcast_url, time.perf_counter() - started)
+
+    def refresh_feeds(self, podcasts, database, queue):
+        """PodPlayer.refresh_feeds() takes the list of Podcast objects in
+        priority order, the PodPlayerDB they came from and their
+        PlayQueue, and fetches the feeds of the ones that are due,
+        merging new episodes into the database and putting new heads
+        on the queue.  Once the top of the queue has a better priority
+        than any podcast left, there is no point fetching the rest.
+
+        If self.jobs is more than one, up to that many feeds are
+        fetched at a time on a thread pool.  Results are still
+        examined strictly in priority order, and the fetches that
+        turn out not to be needed are cancelled.
+
+        """
+
+        #Forget the indexes of podcasts that are gone.
+        current = set([podcast.podcast_id for podcast in podcasts])
+        with self.lock:
+            for podcast_id in [podcast_id for podcast_id in self.indexes if podcast_id not in current]:
+                del self.indexes[podcast_id]
+
+        due   = []
+        until = self.clock.time() + Podcast.poll_claim_wait
+        for podcast in podcasts:
+            if not podcast.is_due():
+                continue
+            #Claiming the feed keeps any other player sharing the
+            #database from fetching it too.  If one got there first,
+            #its poll is as good as ours.
+            if not database.claim_poll(podcast, until):
+                if self.debug:
+                    print ("%s is being polled by another player." % (podcast.podcast_url,))
+                continue
+            #A feed that is down only gets this one probe.
+            if podcast.is_down() and self.verbose:
+                print ("Probing %s, down since %d failures (%s)." % (podcast.podcast_url, podcast.poll_failures, podcast.poll_last_error))
+            #Only the feeds that get fetched need the episode list
+            #saved last time, and it has to be read on this thread.
+            database.load_feed_cache(podcast)
+            podcast.episode_index = self.take_index(podcast)
+            due += [podcast]
+
+        #Design note: Only the fetch and parse happen on the pool.  The
+        #database connection belongs to this thread, so the merge and
+        #the cache writes stay here.
+        executor = None
+        if self.jobs > 1 and len(due) > 1:
+            executor = ThreadPoolExecutor(max_workers=self.jobs)
+            futures  = [executor.submit(podcast.get_episode_list) for podcast in due]
+        try:
+            held = self.held_episodes()
+            for index, podcast in enumerate(due):
+                top = queue.peek(held)
+                if top is not None and top[0].podcast_priority < podcast.podcast_priority:
+                    if executor is not None:
+                        for future, loser in zip(futures[index:], due[index:]):
+                            future.cancel()
+                            loser.cancel_fetch()
+                    break
+                if executor is not None:
+                    futures[index].result()
+                self.refresh_podcast(podcast, database, queue)
+                self.keep_index(podcast)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            #Feeds that turned out not to be needed are due again.
+            for podcast in due:
+                if not podcast.polled or podcast.fetch_cancelled:
+                    database.release_poll(podcast, until)
+
+    def take_index(self, podcast):
+        """PodPlayer.take_index() takes a Podcast that is about to be
+        refreshed and returns the EpisodeIndex kept for it, or None if
+        there isn't one.  It is no longer kept until keep_index() puts
+        it back.
+
+        """
+
+        with self.lock:
+            return self.indexes.pop(podcast.podcast_id, None)
+
+    def keep_index(self, podcast):
+        """PodPlayer.keep_index() takes a Podcast that has been refreshed
+        and keeps its EpisodeIndex for the next refresh.
+
+        """
+
+        if podcast.episode_index is not None:
+            with self.lock:
+                self.indexes[podcast.podcast_id] = podcast.episode_index
+
+    def refresh_podcast(self, podcast, database, queue):
+        """PodPlayer.refresh_podcast() takes a Podcast, the PodPlayerDB it
+        came from and its PlayQueue, has Podcast.make_selection() fetch
+        and merge the feed, saves the podcast's feed and polling
+        state, and puts its new head on the queue.
+
+        """
+
+        with database.transaction():
+            selection = podcast.make_selection()
+            self.save_podcast_state(podcast, database)
+        if selection is None:
+            queue.update(podcast, None)
+        else:
+            queue.update(podcast, selection.episode)
+
+    def print_queue(self, count, outfile=None):
+        """PodPlayer.print_queue() presents a table of the next count
+        episodes to be played on outfile, or the console if none is
+        given, going by what the database already has.  It never
+        touches the network.
+
+        """
+
+        self.queue.print_upcoming(self.database, count, outfile)
+
+    def launch_player(self, selection):
+        """PodPlayer.launch_player() takes a Selection object.  It then
+        gets the content, from the media cache if it is there, and
+        calls mpv to play it.  If the download fails, nothing is
+        played.  It returns True if the episode was played, as
+        play_selection() has it, and False if not.
+
+        """
+
+        #Design note: Yes, I could have given the URL to mpv and
+        #it would play.  The problem with doing this is that if you
+        #put it on pause for a long time, the server may time out and
+        #close the connection and it won't restart.  Also, some
+        #servers balk at seeks.  By grabbing it into a file first, you
+        #avoid that.
+
+        #Design note: The media cache defaults to /dev/shm/podplayer
+        #because it puts the files into a RAMdisk and therefore puts
+        #no needless wear on the physical hardware.
+
+        if self.readahead_bytes is not None or self.readahead_seconds is not None:
+            if self.cache.lookup(self.database, selection.episode_url) is None:
+                return self.play_progressive(selection)
+
+        if not self.download_episode(selection):
+            return False
+        try:
+            return self.play_selection(selection)
+        finally:
+            self.release_episode(selection)
+
+    def download_episode(self, selection, database=None, progress=None):
+        """PodPlayer.download_episode() takes a Selection object and gets
+        the content into the media cache, downloading it with
+        self.http if it isn't there already.  The path ends up in
+        selection.media_path, pinned until release_episode() is
+        called.  It returns True if that worked and False if not, in
+        which case the episode is held back with hold_episode().
+        database stands in for self.database when called from another
+        thread, and progress is passed on to MediaCache.fetch().  The
+        download is timed into self.metrics.
+
+        """
+
+        if database is None:
+            database = self.database
+
+        started = time.perf_counter()
+        try:
+            media_size = None
+            if selection.episode is not None:
+                media_size = selection.episode.length
+            #Playing as it downloads needs the file in order, so that
+            #is done in one piece.
+            segments = self.segments if progress is None else 1
+            selection.media_path = self.cache.fetch(database, self.http, selection.episode_url, media_size, progress, segments)
+        except (FetchError, OSError, http.client.HTTPException) as error:
+            print ("Warning:  Could not download %s (%s)." % (selection.episode_url, error))
+            self.metrics.record("download", selection.podcast.podcast_url, time.perf_counter() - started, 0, str(error) or type(error).__name__)
+            database.add_metrics(self.metrics.drain())
+            self.hold_episode(selection)
+            return False
+        with self.lock:
+            self.held.pop(selection.episode_url, None)
+        self.metrics.record("download", selection.podcast.podcast_url, time.perf_counter() - started, os.path.getsize(selection.media_path))
+        database.add_metrics(self.metrics.drain())
+        if self.verbose:
+            print ("Have %s at %s." % (selection.episode_url, selection.media_path))
+        return True
+
+    def hold_episode(self, selection):
+        """PodPlayer.hold_episode() takes a Selection object that could not
+        be downloaded or played and keeps make_selection() from choosing it again
+        until self.download_min_wait seconds from now, doubled for
+        each failure in a row before this one, up to
+        self.download_max_wait.
+
+        """
+
+        with self.lock:
+            failures = self.held.get(selection.episode_url, (0, None))[0] + 1
+            wait     = min(self.download_max_wait, self.download_min_wait * 2.0 ** (failures - 1))
+            until    = self.clock.time() + wait
+            self.held[selection.episode_url] = (failures, until)
+        if self.verbose:
+            print ("    Trying %s again at %s." % (selection.episode_url, time.ctime(until)))
+
+    def held_episodes(self, now=None):
+        """PodPlayer.held_episodes() returns the set of URLs of episodes
+        that hold_episode() is still holding back.
+
+        """
+
+        if now is None:
+            now = self.clock.time()
+        with self.lock:
+            return set([url for url, (failures, until) in self.held.items() if until > now])
+
+    def readahead_threshold(self, selection):
+        """PodPlayer.readahead_threshold() takes a Selection object and
+        returns how many bytes of it have to be downloaded before it
+        starts to play.  A read-ahead in seconds is turned into bytes
+        with the size and duration from the feed, if it gives both,
+        and self.assumed_byte_rate if not.
+
+        """
+
+        if self.readahead_seconds is None:
+            return self.readahead_bytes
+
+        episode   = selection.episode
+        byte_rate = self.assumed_byte_rate
+        if episode is not None and episode.length and episode.duration:
+            byte_rate = episode.length / episode.duration
+        return int(self.readahead_seconds * byte_rate)
+
+    def play_progressive(self, selection):
+        """PodPlayer.play_progressive() takes a Selection object that is not
+        in the media cache, and downloads it into the cache on a
+        ProgressiveDownload while it plays.  Playback starts once
+        readahead_threshold() bytes are on disk.  mpv reads from a
+        named pipe that the ProgressiveDownload feeds from the file,
+        never past what has been written, so a slow download makes
+        mpv wait rather than reach a premature end.  If the download
+        is done before the threshold is reached, the file is played
+        as usual.  It returns True only if the download finished and
+        the player exited cleanly, or was skipped with stop_playback().
+        A player that is quit before the download is done has not
+        played the episode, which is held back with hold_episode().
+
+        """
+
+        #Design note: The download still goes into a file, so a long
+        #pause is no problem:  the connection to the server is not
+        #held open by the player.  mpv can seek back through what it
+        #has read, but not ahead of it, until the next time the
+        #episode is played from the cache.
+
+        threshold = self.readahead_threshold(selection)
+        download  = ProgressiveDownload(podplayer=self, selection=selection, verbose=self.verbose, debug=self.debug)
+        download.start()
+        download.wait_for(threshold)
+        with download.condition:
+            finished = download.done
+        if finished:
+            download.join()
+            download.close()
+            if not download.result:
+                return False
+            try:
+                return self.play_selection(selection)
+            finally:
+                self.release_episode(selection)
+
+        if self.verbose:
+            print ("Playing %s while it downloads." % (selection.episode_url,))
+        pipe_path = os.path.join(self.cache.directory, ".pipe-%d-%d" % (os.getpid(), threading.get_ident()))
+        os.mkfifo(pipe_path)
+        feeder = threading.Thread(target=download.feed, args=(pipe_path,), daemon=True)
+        feeder.start()
+        try:
+            played = self.play_selection(selection, pipe_path)
+        finally:
+            download.stop()
+            #If mpv never opened the pipe, the feeder is still waiting
+            #for it to.  Opening it here lets the feeder go.
+            os.close(os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK))
+            feeder.join()
+            os.remove(pipe_path)
+            download.abandon()
+
+        #mpv can only get to the end of the pipe once the download is
+        #done, so a clean exit before then means it was quit partway.
+        with self.lock:
+            skipped = self.skipped
+        with download.condition:
+            complete = download.done and bool(download.result)
+        if played and not complete and not skipped:
+            print ("Warning:  %s was stopped before it finished downloading." % (selection.episode_url,))
+            self.hold_episode(selection)
+            return False
+        return played
+
+    def play_selection(self, selection, media_path=None):
+        """PodPlayer.play_selection() takes a downloaded Selection object and
+        plays it with play_file(), keeping it in self.now_playing while
+        it plays.  media_path stands in for selection.media_path.  It
+        returns True if the episode was played.  If the player fails,
+        the episode is held back with hold_episode(), so that the rest
+        of the queue plays rather than the same episode over again.
+
+        """
+
+        if media_path is None:
+            media_path = selection.media_path
+
+        with self.lock:
+            self.now_playing   = selection
+            self.playing_since = self.clock.time()
+        try:
+            played = self.play_file(media_path)
+        finally:
+            with self.lock:
+                self.now_playing   = None
+                self.playing_since = None
+        if not played:
+            print ("Warning:  The player failed on %s." % (selection.episode_url,))
+            self.hold_episode(selection)
+        return played
+
+    def play_file(self, media_path):
+        """PodPlayer.play_file() takes a file path and calls mpv to play it.
+        The process is kept in self.process so that stop_playback()
+        can cut it short.  It returns True if mpv exited cleanly or was
+        stopped by stop_playback(), and False if it failed.
+
+        """
+
+        #TODO:  Make the path to the media player configurable.
+
+        process = Popen(self.player_command + [media_path])
+        with self.lock:
+            self.process = process
+            self.skipped = False
+        try:
+            process.wait()
+        finally:
+            with self.lock:
+                self.process = None
+                skipped      = self.skipped
+        return process.returncode == 0 or skipped
+
+    def stop_playback(self):
+        """PodPlayer.stop_playback() stops whatever play_file() is playing,
+        which then returns as though the episode had finished.  It
+        returns the Selection that was playing, or None if nothing
+        was.
+
+        """
+
+        with self.lock:
+            if self.process is None:
+                return None
+            self.skipped = True
+            self.process.terminate()
+            return self.now_playing
+
+    def request_episode(self, url):
+        """PodPlayer.request_episode() takes the URL of a podcast or of an
+        episode and has it played next, cutting short anything that is
+        playing.  A podcast URL plays whatever make_selection() would
+        choose from that podcast.
+
+        """
+
+        with self.lock:
+            self.requested = url
+        self.stop_playback()
+        self.wake()
+
+    def wake(self):
+        """PodPlayer.wake() cuts short wait_for_next_poll(), so that the
+        podcasts are checked right away.
+
+        """
+
+        self.wakeup.set()
+
+    def requested_selection(self):
+        """PodPlayer.requested_selection() returns a Selection for the URL
+        given to request_episode(), if there is one, and forgets it.
+        A podcast URL has its feed fetched whether or not it is due.
+        Any other URL is taken to be an episode, and played as is.
+
+        """
+
+        with self.lock:
+            url, self.requested = self.requested, None
+        if url is None:
+            return None
+
+        for podcast in list(self.database.scan_podcasts()):
+            if podcast.podcast_url == url:
+                podcast.poll_next_due = None
+                podcast.http          = self.http
+                podcast.metrics       = self.metrics
+                self.database.load_feed_cache(podcast)
+                podcast.episode_index = self.take_index(podcast)
+                with self.database.transaction():
+                    selection = podcast.make_selection()
+                    self.save_podcast_state(podcast, self.database)
+                self.keep_index(podcast)
+                if selection is None:
+                    print ("Nothing new to play from %s." % (url,))
+                return selection
+
+        return Selection(podcast=Podcast(), episode_url=url, verbose=self.verbose, debug=self.debug)
+
+    def release_episode(self, selection):
+        """PodPlayer.release_episode() takes a Selection object whose content
+        is no longer needed and lets the media cache evict it.
+
+        """
+
+        if selection.media_path is not None:
+            self.cache.unpin(selection.media_path)
+
+    def update_last_played(self, selection):
+        """PodPlayer.update_last_played() takes a selection object and updates
+        the record for the podcast in the database with the selected
+        podcast.  It does this by calling
+        PodPlayerDB.update_last_played() with the relevant properties
+        extracted.
+
+        """
+
+        self.database.update_last_played(selection.podcast.podcast_url, selection.episode_url)
+
+    def update_podcast_name(self, podcast):
+        """PodPlayer.update_podcast_name() takes a podcast object and updates
+        the database record for it with the podcast name.  It does
+        this by calling PodPlayerDB.update_podcast_name() with the
+        relevant properties extracted.
+
+        """
+        self.database.update_name(podcast.podcast_url, podcast.podcast_name)
+        
+    def play_one(self):
+        """PodPlayer.play_one() steps through the podcast selection process
+        and then, if successful, starts playback and, if the episode
+        could be downloaded, updates the database to indicate that the
+        playback happened.  It returns True if it was able to find
+        something to play, and False if not.  Anything asked for with
+        request_episode() comes first.
+
+        """
+        selection = self.requested_selection()
+        if selection is None:
+            selection = self.make_selection()
+        if selection is not None:
+            self.update_podcast_name(selection.podcast)
+            if self.launch_player(selection):
+                self.update_last_played(selection)
+            return True
+        return False
+
+    def play_continuous(self):
+        """PodPlayer.play_continuous() starts an infinite loop.  It will call
+        self.play_one() and if it was able to find something to play,
+        it will immediately launch another one on completion.  If it
+        did not find anything to play, it will sleep until the next
+        podcast is due to be polled.
+
+        If self.prefetch is set, play_pipelined() is used instead.
 
         """
 
-        if self.verbose:
-            if self.podcast_name is None:
-                usename = self.podcast_url
-            else:
-                usename = self.podcast_name
-            print ("Checking %s for new content." % (usename,))
-        if self.episode_list is None:
-            self.get_episode_list()
-
-        if len(self.episode_list) == 0:
-            return None
-
-        if self.debug:
-            for episode in self.episode_list:
-                print("   ", episode)
-            print (self.podcast_last_played)
-        
-        if self.podcast_last_played == self.episode_list[0]:
-            if self.debug:
-                print("I select none of these becasue the most recent episode has been played.")
-            return None
-        
-        if self.podcast_load_type == 'front':
-            episode_url = self.episode_list[0]
-            if self.debug:
-                print("I select %s, which is the newest episode." % (episode_url,))
-        else:
-            if self.podcast_last_played in self.episode_list:
-                #There has to be a better way to do this.  I hate
-                #using loop flags, but this works for now.
-                done = False
-                for episode in self.episode_list:
-                    if episode == self.podcast_last_played:
-                        done = True
-                    elif not done:
-                        episode_url = episode
-            else:
-                episode_url = self.episode_list[-1]
+        if self.prefetch:
+            return self.play_pipelined()
 
-        if episode_url is None:
-            return None
-        else:
-            return Selection(podcast=self, episode_url=episode_url, verbose=self.verbose, debug=self.debug)
+        while True:
+            if not self.play_one():
+                self.wait_for_next_poll()
 
-    def retrieve_feed_text(self):
-        """Podcast.retrieve_feed_text() retrieves the XML from the podcast
-        feed and returns it.
+    def wait_for_next_poll(self):
+        """PodPlayer.wait_for_next_poll() sleeps until the earliest time any
+        podcast is due to be polled or any held episode can be tried
+        again, but for at least self.min_poll_wait seconds, unless
+        wake() is called first.
 
         """
 
-        #Welp, urllib stopped working for one of my subscriptions.
-        #Fuck it.  We'll just use wget.
-        
-        #TODO:  Make the timeout configurable.
-        #try:
-        #    context = ssl.create_default_context()
-        #    context.set_alpn_protocols(['spdy/3', 'spdy/2', 'spdy/1', 'http/1.1'])
-        #    
-        #    with urllib.request.urlopen(self.podcast_url, None, 5, context=context) as infile:
-        #        return infile.read()
-
+        now = self.clock.time()
+        due = self.database.next_poll_due()
+        if due is None:
+            due = now + Podcast.poll_min_interval
+        with self.lock:
+            retries = [until for failures, until in self.held.values() if until > now]
+        if len(retries) > 0:
+            due = min(due, min(retries))
+        due = max(due, now + self.min_poll_wait)
+        print ("Waiting until %s." % (time.ctime(due),))
+        self.waiting_until = due
         try:
-            call(["/usr/bin/wget", "--timeout=5", "-O", "/dev/shm/podplayer.xml", self.podcast_url])
-            with open("/dev/shm/podplayer.xml", 'r') as infile:
-                return infile.read()
-        except:
-            if self.verbose:
-                print ("    Download failed.  Trying next feed.")
-                return None
-        
-        
-    def get_episode_list(self):
-        """Podcast.get_episode_list() parses the podcast XML and boils it
-        down to just the enclosure URLs.
+            self.wakeup.wait(due - now)
+        finally:
+            self.wakeup.clear()
+            self.waiting_until = None
+
+    def play_pipelined(self):
+        """PodPlayer.play_pipelined() is the download-ahead version of
+        play_continuous().  While one episode plays, a Prefetcher works
+        out what would be played next if this one were finished, and
+        downloads it.  When playback ends, the podcasts ahead of the
+        prefetched one by priority are checked again, in case one of
+        them has put out something new in the meantime.  If none has,
+        the prefetched episode starts right away.
 
         """
 
-        #TODO: Insert a sort step here.  We are relying on the podcast
-        #generator to produce a feed in reverse-chronological order,
-        #and that might not be a valid assumption.
-        
-        #Retrieve the feed.
-        treetext = self.retrieve_feed_text()
+        selection = None
+        while True:
+            if selection is None:
+                selection = self.requested_selection()
+                if selection is None:
+                    selection = self.make_selection()
+                if selection is None:
+                    self.wait_for_next_poll()
+                    continue
+                if not self.download_episode(selection):
+                    selection = None
+                    continue
 
-        #Determine if we got anything
-        if treetext is None:
-            #It's empty.  Say so.
-            self.episode_list = []
-        else:
-            #Figure out what we got.
-            tree = ET.fromstring(treetext)
-        
-            #Get channel name
-            self.podcast_name = tree.findall('channel')[0].findall('title')[0].text
+            self.update_podcast_name(selection.podcast)
+            prefetcher = Prefetcher(podplayer=self, played=selection, verbose=self.verbose, debug=self.debug)
+            prefetcher.start()
+            try:
+                played = self.play_selection(selection)
+            finally:
+                self.release_episode(selection)
+            if played:
+                self.update_last_played(selection)
+            prefetcher.join()
+
+            selection = prefetcher.selection
+            requested = self.requested_selection()
+            if requested is not None:
+                if selection is not None:
+                    self.release_episode(selection)
+                selection = requested
+                if not self.download_episode(selection):
+                    selection = None
+                continue
+            if selection is None:
+                continue
+
+            better = self.make_selection()
+            if better is None or better.episode_url == selection.episode_url:
+                if self.verbose:
+                    print ("Playing prefetched %s." % (selection.episode_url,))
+            else:
+                if self.verbose:
+                    print ("Dropping prefetched %s for %s." % (selection.episode_url, better.episode_url))
+                self.release_episode(selection)
+                selection = better
+                if not self.download_episode(selection):
+                    selection = None
         
-            #Get the enclosures out of each and put them on a list.
-            self.episode_list = []
-            for channel in tree.findall('channel'):
-                for item in channel.findall('item'):
-                    for enclosure in item.findall('enclosure'):
-                        given_url = enclosure.attrib['url']
-                        urlmatch = self.urlre.match(given_url)
-                        if urlmatch:
-                            episode_url = urlmatch.group(1)
-                        else:
-                            episode_url = given_url
-                        self.episode_list += [episode_url]
-                            
-class Selection (object):
-    """Class Selection is simply a data structure, nothing else.  It
-    carries the URL of a selection, and the Podcast object that
-    produced the selection.
+            
+class Prefetcher(threading.Thread):
+    """Class Prefetcher is the background half of
+    PodPlayer.play_pipelined().  It is a thread that makes the next
+    selection, as though the episode now playing were finished, and
+    downloads it into the media cache.
 
     """
 
-
-    def __init__(self, podcast=Podcast(), episode_url=None, verbose=False, debug=False):
-        """Selection.__init__() pretty much just copies arguments to
-        like-named properties, and further transfers verbose and debug
-        flags into any included Podcast object.
+    def __init__(self, podplayer, played, verbose=False, debug=False):
+        """Prefetcher.__init__() copies its arguments to like-named
+        properties.  The choice, if any, ends up in self.selection.
 
         """
-        
-        #TODO: Figure out better default logic for the podcast
-        #variable.  Actually, does it need to be defaulted?
-        
-        self.verbose     = verbose or debug
-        self.debug       = debug
-        self.podcast     = podcast
-        self.episode_url = episode_url
-
-        self.podcast.verbose = self.verbose
-        self.podcast.debug   = self.debug
-
-class PodPlayerDB(object):
-    """
-    Class PodPlayerDB abstracts the SQLite3 database.  
-    """
 
-    #SQL statements used by PodPlayerDB are all set up here so as to
-    #keep them from cluttering up the methods.
+        threading.Thread.__init__(self, daemon=True)
 
-    #Create database objects, unless they already exist.
-    init_if_needed_steps = [
-        "CREATE TABLE IF NOT EXISTS podcast_v1 (podcast_id INTEGER PRIMARY KEY AUTOINCREMENT, podcast_priority INTEGER DEFAULT 10, podcast_load_type TEXT DEFAULT 'back', podcast_url TEXT, podcast_name TEXT, podcast_last_played TEXT)",
-        "CREATE INDEX IF NOT EXISTS podcast_v1_priority ON podcast_v1(podcast_priority)",
-        "CREATE INDEX IF NOT EXISTS podcast_v1_url ON podcast_v1(podcast_url)"
-    ]
+        self.verbose    = verbose or debug
+        self.debug      = debug
 
-    #Drop database objects, if they exist.
-    destroy_steps = [
-        "DROP INDEX IF EXISTS podcast_v1_url",
-        "DROP INDEX IF EXISTS podcast_v1_priority",
-        "DROP TABLE IF EXISTS podcast_v1"
-    ]
+        self.podplayer  = podplayer
+        self.played     = played
+        self.selection  = None
 
-    #Count number of instances of a given URL in the podcast_url column.
-    exists_podcast_select = "SELECT count(0) FROM podcast_v1 WHERE podcast_url = ?"
+    def run(self):
+        """Prefetcher.run() opens a database connection of its own, makes the
+        selection and downloads it.
 
-    #Insert a podcast.  Don't insert a name at this time, just a url, type and priority.
-    add_podcast_insert = "INSERT INTO podcast_v1 (podcast_url, podcast_load_type, podcast_priority) values (?,?,?)" 
+        """
 
-    #Remove a podcast by URL.
-    remove_podcast_delete = "DELETE FROM podcast_v1 WHERE podcast_url = ?"
+        database = PodPlayerDB(dbpath=self.podplayer.dbpath, listener=self.podplayer.listener, clock=self.podplayer.clock, verbose=self.verbose, debug=self.debug)
+        try:
+            selection = self.podplayer.make_selection(database=database, played=self.played)
+            if selection is not None:
+                #The connection dies with this thread, so don't let the
+                #Podcast hang onto it.
+                selection.podcast.database = None
+                if not self.podplayer.download_episode(selection, database):
+                    selection = None
+            self.selection = selection
+        finally:
+            database.dbi.close()
 
-    #Update the podcast_last_played column for a given podcast.
-    update_last_played_update = "UPDATE podcast_v1 SET podcast_last_played = ? WHERE podcast_URL =?"
+class ProgressiveDownload(threading.Thread):
+    """Class ProgressiveDownload is the background half of
+    PodPlayer.play_progressive().  It is a thread that downloads a
+    selection into the media cache and keeps track of how much of the
+    file is on disk, so that feed() can hand the file to the player
+    as it grows, without ever getting ahead of the download.
 
-    #Update the podcast_name column for a given podcast
-    update_name_update = "UPDATE podcast_v1 SET podcast_name = ? WHERE podcast_url =?"
+    """
 
-    #Retrieve a list of podcasts in order by priority
-    scan_podcasts_select = "SELECT podcast_id, podcast_priority, podcast_load_type, podcast_url, podcast_name, podcast_last_played FROM podcast_v1 ORDER BY podcast_priority ASC"
-    
-    def __init__(self, dbpath, verbose=False, debug=False):
-        """PodPlayerDB.__init__(), in addition to copying the arguments to the
-        properties, also instantiates a database connection, and calls
-        init_if_needed() to set up the database.
+    def __init__(self, podplayer, selection, verbose=False, debug=False):
+        """ProgressiveDownload.__init__() copies its arguments to like-named
+        properties.  Whether the download worked ends up in
+        self.result.
 
         """
-        self.verbose  = verbose or debug
-        self.debug    = debug
 
-        self.dbpath   = dbpath
-        self.dbi      = sqlite3.connect(self.dbpath)
+        threading.Thread.__init__(self, daemon=True)
 
-        self.init_if_needed()
+        self.verbose   = verbose or debug
+        self.debug     = debug
 
-    def init_if_needed(self):
-        """PodPlayerDB.init_if_needed runs the steps in
-        self.init_if_needed_steps to create the table and indices
-        required, but only if they do not already exist.
+        self.podplayer = podplayer
+        self.selection = selection
+        self.result    = None
 
-        """
-        self.run_steps(self.init_if_needed_steps)
-        self.dbi.commit()
+        #self.written, self.done, self.stopped and self.abandoned are
+        #guarded by self.condition.  self.media_file is a descriptor
+        #open on the file being downloaded, which stays good after the
+        #file is renamed into the cache.
+        self.condition  = threading.Condition()
+        self.media_file = None
+        self.written    = 0
+        self.done       = False
+        self.stopped    = False
+        self.abandoned  = False
 
-    def destroy(self):
-        """PodPlayerDB.destroy() will drop all database objects by running the
-        steps in self.destroy_steps.
+    def run(self):
+        """ProgressiveDownload.run() opens a database connection of its own
+        and downloads the selection.  If the player has already given
+        up on it by the time it is done, the file is unpinned.
 
         """
 
-        self.run_steps(self.destroy_steps)
-        self.dbi.commit()
-        
-    def run_steps(self, steps):
-        """PodPlayerDB.run_steps() is used by init_if_needed() and destroy()
-        to execute a single SQL step in a str or a group of SQL
-        statements in a list.
+        database = PodPlayerDB(dbpath=self.podplayer.dbpath, listener=self.podplayer.listener, clock=self.podplayer.clock, verbose=self.verbose, debug=self.debug)
+        try:
+            self.result = self.podplayer.download_episode(self.selection, database, self.progress)
+        finally:
+            database.dbi.close()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+                abandoned = self.abandoned
+            if abandoned:
+                self.close()
+                if self.result:
+                    self.podplayer.release_episode(self.selection)
+
+    def progress(self, media_path, written):
+        """ProgressiveDownload.progress() is called by HttpClient.download()
+        with the path and the number of bytes written so far.
 
         """
 
-        if type(steps) is str:
-            steps = [steps]
-        cursor = self.dbi.cursor()
-        for step in steps:
-            cursor.execute(step)
+        if self.media_file is None:
+            self.media_file = os.open(media_path, os.O_RDONLY)
+        with self.condition:
+            self.written = written
+            self.condition.notify_all()
 
-    def exists_podcast(self, podcast_url):
-        """PodPlayerDB.exists_podcast() takes a podcast URL and returns True
-        if it is in the database, and False if not.
+    def wait_for(self, position):
+        """ProgressiveDownload.wait_for() waits until at least position
+        bytes, and at least one, are on disk, the download is done, or
+        stop() is called, and returns how many bytes are on disk.
 
         """
 
-        cursor = self.dbi.cursor()
-        cursor.execute(self.exists_podcast_select, (podcast_url,))
-        result = cursor.fetchone()
-        if result[0] == 0:
-            return False
-        return True
+        with self.condition:
+            while self.written < max(position, 1) and not self.done and not self.stopped:
+                self.condition.wait()
+            return self.written
 
-    def add_podcast(self, podcast_url, podcast_priority, podcast_type):
-        """PodPlayerDB.add_podcast() inserts a podcast into the database.  The
-        podcast_name and podcast_last_played columns will be left
-        null.
+    def feed(self, pipe_path):
+        """ProgressiveDownload.feed() takes the path of a named pipe, and
+        copies the file into it as it is downloaded, until the
+        download is done or stop() is called.  It never reads past
+        what has been written.
 
         """
-        
-        cursor = self.dbi.cursor()
-        cursor.execute(self.add_podcast_insert, (podcast_url, podcast_type, podcast_priority))
-        self.dbi.commit()
 
-    def remove_podcast(self, podcast_url):
-        """PodPlayerDB.remove_podcasts() takes a podcast URL and removes the
-        corresponding record from the database.
+        position = 0
+        try:
+            with open(pipe_path, 'wb', buffering=0) as outfile:
+                while True:
+                    written = self.wait_for(position + 1)
+                    if written <= position or self.stopped:
+                        break
+                    count = min(written - position, HttpClient.chunk_size)
+                    chunk = os.pread(self.media_file, count, position)
+                    if not chunk:
+                        break
+                    outfile.write(chunk)
+                    position += len(chunk)
+        except BrokenPipeError:
+            #mpv is gone, finished or skipped.
+            pass
+
+    def stop(self):
+        """ProgressiveDownload.stop() makes feed() give up.
 
         """
 
-        cursor = self.dbi.cursor()
-        cursor.execute(self.remove_podcast_delete, (podcast_url,))
-        self.dbi.commit()
-        
-    def update_last_played(self, podcast_url, episode_url):
-        """PodPlayerDB.update_last_played takes a podcast URL and an episode
-        URL and puts the episode URL on the record for the podcast
-        referenced by the podcast URL.
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def abandon(self):
+        """ProgressiveDownload.abandon() is called when the player is done
+        with the selection.  If the download has finished, the file is
+        unpinned now; if not, that happens when it finishes, so a
+        skipped episode doesn't hold up the next one.
 
         """
-        cursor = self.dbi.cursor()
-        cursor.execute(self.update_last_played_update, (episode_url, podcast_url))
-        self.dbi.commit()
 
-    def update_name(self, podcast_url, podcast_name):
-        """PodPlayerDB.update_name takes the podcast URL and the podcast name,
-        and puts the name on the record associated with that URL.
+        with self.condition:
+            self.abandoned = True
+            done           = self.done
+        if done:
+            self.close()
+            if self.result:
+                self.podplayer.release_episode(self.selection)
 
-        """
-        cursor = self.dbi.cursor()
-        cursor.execute(self.update_name_update, (podcast_name, podcast_url))
-        self.dbi.commit()
-        
-    def scan_podcasts(self):
-        """PodPlayerDB.scan_podcasts retrieves from the database a list of
-        podcasts, sorted in order by priority.  It yields each as a
-        Podcast object.
+    def close(self):
+        """ProgressiveDownload.close() closes the descriptor that feed()
+        reads the file through.
 
         """
 
-        cursor = self.dbi.cursor()
-        cursor.execute(self.scan_podcasts_select)
-        for result in cursor:
-            #0 podcast_id
-            #1 podcast_priority
-            #2 podcast_load_type
-            #3 podcast_url
-            #4 podcast_name
-            #5 podcast_last_played
-            yield Podcast(podcast_id=result[0], podcast_priority=result[1], podcast_load_type=result[2], podcast_url=result[3], podcast_name=result[4], podcast_last_played=result[5], verbose=self.verbose, debug=self.debug)  
-        
-class PodPlayer(object):
-    """Class PodPlayer is the glue class for this program.
+        if self.media_file is not None:
+            os.close(self.media_file)
+            self.media_file = None
+
+class PlayerThread(threading.Thread):
+    """Class PlayerThread runs PodPlayer.play_continuous() for
+    PodPlayerDaemon.  The PodPlayer is made in the thread itself,
+    since its database connection can only be used by the thread that
+    opened it.
 
     """
 
-    def __init__(self, dbpath, verbose=False, debug=False):
-        """PodPlayer.__init__ takes a database path and optional feedback
-        flags, and instantiates a PodPlayerDB object.
+    def __init__(self, options, verbose=False, debug=False):
+        """PlayerThread.__init__() takes a dict of arguments for PodPlayer.
+        Once the thread is running, its PodPlayer is in self.podplayer
+        and self.ready is set.
 
         """
-        self.verbose  = verbose or debug
-        self.debug    = debug
 
-        self.dbpath   = dbpath
-        self.database = PodPlayerDB(dbpath=self.dbpath, verbose=self.verbose, debug=self.debug)
+        threading.Thread.__init__(self, daemon=True)
 
-    def add_podcasts(self, url_list, podcast_priority, podcast_type):
-        """PodPlyer.add_podcasts() takes a list of URLs, a priority and a
-        podcast type, and inserts all of the listed URLs with that
-        priority and load type into the database.  Before insertion,
-        it checks to see if a podcast is already there, and prints a
-        warning if it is, rather than inserting it.
+        self.verbose   = verbose or debug
+        self.debug     = debug
+
+        self.options   = options
+        self.podplayer = None
+        self.ready     = threading.Event()
+
+    def run(self):
+        """PlayerThread.run() makes the PodPlayer and plays forever.
 
         """
 
-        for podcast_url in url_list:
-            if self.database.exists_podcast(podcast_url):
-                print("Warning:  Skipping %s becasue it is already in the database." % (podcast_url,))
-            else:
-                self.database.add_podcast(podcast_url=podcast_url, podcast_priority=podcast_priority, podcast_type=podcast_type)
+        self.podplayer = PodPlayer(verbose=self.verbose, debug=self.debug, **self.options)
+        self.ready.set()
+        self.podplayer.play_continuous()
 
-    def remove_podcasts(self, url_list):
-        """PodPlayer.remove_podcasts() takes a list of URLs and removes from
-        the database any podcasts represented by those URLs.
+class PodPlayerDaemon(object):
+    """Class PodPlayerDaemon is podplayerd.  It plays continuously on a
+    PlayerThread, keeping its database connection, HTTP connections
+    and media cache warm between episodes, and takes commands on a
+    Unix-domain socket.  Each connection carries one request, a JSON
+    object on one line with a "command" of add, remove, list, queue,
+    skip, play-now or status, and gets back one JSON object on one
+    line with "ok", "output" to show the user, and for status, the
+    details.  add, remove, list and queue go straight to a
+    PodPlayerDB of the daemon's own.
+
+    """
+
+    def __init__(self, socket_path, options, verbose=False, debug=False):
+        """PodPlayerDaemon.__init__() takes the path of the socket to listen
+        on and a dict of arguments for PodPlayer.
 
         """
 
-        for podcast_url in url_list:
-            if self.database.exists_podcast(podcast_url):
-                self.database.remove_podcast(podcast_url)
-            else:
-                print("Warning:  Skipping %s becasue it is not in the database." % (podcast_url,))
+        self.verbose     = verbose or debug
+        self.debug       = debug
 
-    def pretty_list(self):
-        """PodPlayer.pretty_list() queries the database for all podcasts and
-        presents a table of them on the console.
+        self.socket_path = socket_path
+        self.options     = options
+        self.database    = None
+        self.queue       = None
+        self.player      = None
+
+    def serve(self):
+        """PodPlayerDaemon.serve() starts the PlayerThread and answers
+        requests on the socket until interrupted.  A socket left
+        behind by a daemon that has died is replaced, but a live one
+        is left alone.
 
         """
 
-        print ("%-3s %-5s %-30s %s" % ("Pri","Type","Name","URL"))
-        print ("=" * 80)
-        for entry in self.database.scan_podcasts():
-            print ("%3d %-5s %-30s %s" % (entry.podcast_priority, entry.podcast_load_type, entry.podcast_name, entry.podcast_url))
+        if PodPlayerClient(self.socket_path).available():
+            raise ImNotDoingThat("Another podplayerd is already listening on %s." % (self.socket_path,))
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
 
-    def make_selection(self):
-        """PodPlayer.make_selection() loops over the yield of Podcast objects
-        returned by PodPlayerDB.scan_podcasts() and calls
-        Podcast.make_selection on each until it finds one that returns
-        a result.  If all of them return None, then it will also
-        return None, otherwise it will return a Selection object
-        representing its choice and the Podcast that produced that
-        choice.
+        #add, remove, list and queue only need the database, so they
+        #are answered here in the main thread, on a connection of its
+        #own.  Playback has a whole PodPlayer of its own.
+        self.database = PodPlayerDB(dbpath=self.options["dbpath"], listener=self.options.get("listener", "default"), verbose=self.verbose, debug=self.debug)
+        self.queue    = PlayQueue(verbose=self.verbose, debug=self.debug)
+        self.player   = PlayerThread(self.options, verbose=self.verbose, debug=self.debug)
+        self.player.start()
+        self.player.ready.wait()
 
-        """
-        
-        selection = None
-        for podcast in self.database.scan_podcasts():
-            selection = podcast.make_selection()
-            if selection is not None:
-                return selection
+        daemon = self
 
-    def launch_player(self, selection):
-        """PodPlayer.launch_player() takes a Selection object.  It then calls
-        external programs, first wget to retrieve the content, then
-        mpv to play it.
+        class Handler (socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    #Someone checking whether we're here.
+                    return
+                try:
+                    response = daemon.handle(json.loads(line))
+                except (ValueError, KeyError, TypeError) as error:
+                    response = {"ok": False, "output": "Bad request (%s).\n" % (error,)}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
 
-        """
+        server = socketserver.UnixStreamServer(self.socket_path, Handler)
+        if self.verbose:
+            print ("Listening on %s." % (self.socket_path,))
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(self.socket_path)
+            self.player.podplayer.stop_playback()
+            self.database.dbi.close()
 
-        #TODO:  Make the path where the downloaded file goes into a configurable.
+    def handle(self, request):
+        """PodPlayerDaemon.handle() takes a request as a dict and returns the
+        response as a dict.
 
-        #TODO:  Make the path to the fetcher configurable.
+        """
 
-        #TODO:  Make the path to the media player configurable.
-        
-        #Design note: Yes, I could have given the URL to mpv and
-        #it would play.  The problem with doing this is that if you
-        #put it on pause for a long time, the server may time out and
-        #close the connection and it won't restart.  Also, some
-        #servers balk at seeks.  By grabbing it into a file first, you
-        #avoid that.
+        command   = request["command"]
+        podplayer = self.player.podplayer
+        output    = io.StringIO()
+        response  = {"ok": True}
 
-        #Design note: The path given of /dev/shm/podplayer.mp3 was
-        #chosen because it puts the file into a RAMdisk and therefore
-        #puts no needless wear on the physical hardware.
+        if command == "add":
+            self.database.add_new_podcast_list([(podcast_url, request.get("type"), request.get("priority", 10), None) for podcast_url in request["urls"]], output)
+            podplayer.wake()
+        elif command == "remove":
+            self.database.remove_known_podcast_list(request["urls"], output)
+        elif command == "list":
+            self.database.pretty_list(output)
+        elif command == "queue":
+            self.queue.print_upcoming(self.database, request.get("count", 10), output)
+        elif command == "skip":
+            selection = podplayer.stop_playback()
+            if selection is None:
+                print ("Nothing is playing.", file=output)
+            else:
+                print ("Skipped %s." % (selection.episode_url,), file=output)
+        elif command == "play-now":
+            podplayer.request_episode(request["url"])
+            print ("Playing %s next." % (request["url"],), file=output)
+        elif command == "status":
+            with podplayer.lock:
+                selection = podplayer.now_playing
+                since     = podplayer.playing_since
+                requested = podplayer.requested
+            waiting = podplayer.waiting_until
+            response["playing"]       = None
+            response["podcast"]       = None
+            response["since"]         = since
+            response["waiting_until"] = waiting
+            response["requested"]     = requested
+            if selection is not None:
+                response["playing"] = selection.episode_url
+                response["podcast"] = selection.podcast.podcast_name or selection.podcast.podcast_url
+                print ("Playing %s" % (selection.episode_url,), file=output)
+                if response["podcast"] is None:
+                    print ("   since %s." % (time.ctime(since),), file=output)
+                else:
+                    print ("   from %s since %s." % (response["podcast"], time.ctime(since)), file=output)
+            elif waiting is not None:
+                print ("Nothing to play.  Waiting until %s." % (time.ctime(waiting),), file=output)
+            else:
+                print ("Checking for something to play.", file=output)
+            if requested is not None:
+                print ("Up next by request:  %s" % (requested,), file=output)
+        else:
+            response["ok"] = False
+            print ("Unknown command %s." % (command,), file=output)
 
-        #Design note: Yes, I could have used urllib to get the
-        #content.  Can't think of a reason to go to the effort,
-        #though, given that we're just going to write the content to a
-        #file unchanged.
+        response["output"] = output.getvalue()
+        return response
 
-        call(["/usr/bin/wget", "--timeout=5", "-O", "/dev/shm/podplayer.mp3", selection.episode_url])
-        call(["/usr/bin/mpv", "/dev/shm/podplayer.mp3"])
+class PodPlayerClient(object):
+    """Class PodPlayerClient sends requests to a PodPlayerDaemon over its
+    socket.  This is what the command line verbs use when podplayerd
+    is running, so they don't have to open the database themselves.
 
-    def update_last_played(self, selection):
-        """PodPlayer.update_last_played() takes a selection object and updates
-        the record for the podcast in the database with the selected
-        podcast.  It does this by calling
-        PodPlayerDB.update_last_played() with the relevant properties
-        extracted.
+    """
+
+    def __init__(self, socket_path, timeout=10):
+        """PodPlayerClient.__init__() copies its arguments to like-named
+        properties.
 
         """
 
-        self.database.update_last_played(selection.podcast.podcast_url, selection.episode_url)
+        self.socket_path = socket_path
+        self.timeout     = timeout
 
-    def update_podcast_name(self, podcast):
-        """PodPlayer.update_podcast_name() takes a podcast object and updates
-        the database record for it with the podcast name.  It does
-        this by calling PodPlayerDB.update_podcast_name() with the
-        relevant properties extracted.
+    def available(self):
+        """PodPlayerClient.available() returns True if a daemon is listening
+        on the socket.
 
         """
-        self.database.update_name(podcast.podcast_url, podcast.podcast_name)
-        
-    def play_one(self):
-        """PodPlayer.play_one() steps through the podcast selection process
-        and then, if successful, starts playback and updates the
-        database to indicate that the playback happened.  It returns
-        True if it was able to find something to play, and False if
-        not.
 
-        """
-        selection = self.make_selection()
-        if selection is not None:
-            self.update_podcast_name(selection.podcast)
-            self.launch_player(selection)
-            self.update_last_played(selection)
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            connection.close()
             return True
-        return False
+        except OSError:
+            return False
 
-    def play_continuous(self):
-        """PodPlayer.play_continuous() starts an infinite loop.  It will call
-        self.play_one() and if it was able to find something to play,
-        it will immediately launch another one on completion.  If it
-        did not find anything to play, it will sleep until the quarter
-        hour.
+    def request(self, command, **arguments):
+        """PodPlayerClient.request() sends a command, with any other
+        arguments as fields of the request, and returns the response
+        as a dict.
 
         """
 
-        #TODO: Make the sleep time a configurable.  Also make it
-        #configurable if it is a point on the clock versus a set
-        #interval.
-        while True:
-            if not self.play_one():
-                print ("Waiting until next quarter-hour.")
-                time.sleep(900.0 - time.time() % 900.0)
-        
-            
+        request = dict(arguments)
+        request["command"] = command
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps(request).encode('utf-8') + b"\n")
+            with connection.makefile('rb') as infile:
+                return json.loads(infile.readline())
+
 def main():
     parser=argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose",    help="Verbose output",                action="store_true")
@@ -525,6 +3998,25 @@ def main():
     parser.add_argument("-l", "--list",       help="List podcasts",                 action="store_true")
     parser.add_argument("-P", "--play",       help="Play podcast",                  action="store_true")
     parser.add_argument("-c", "--continuous", help="Play podcasts continuously",    action="store_true")
+    parser.add_argument("-j", "--jobs",       help="Feeds to fetch at once",        type=int, default=1)
+    parser.add_argument("-s", "--stream",     help="Stream-parse feeds",            action="store_true")
+    parser.add_argument("-T", "--timeout",    help="Network timeout in seconds",    type=float, default=5.0)
+    parser.add_argument("-C", "--cachedir",   help="Path to media cache", type=str, default="/dev/shm/podplayer")
+    parser.add_argument("-S", "--cachesize",  help="Media cache size in MiB",       type=int, default=512)
+    parser.add_argument("-i", "--import-opml", help="Import podcasts from OPML",   action="store_true")
+    parser.add_argument("-e", "--export-opml", help="Export podcasts to OPML",     action="store_true")
+    parser.add_argument("-A", "--ahead",      help="Download next while playing",   action="store_true")
+    parser.add_argument("-m", "--stats",      help="Show timing statistics",        action="store_true")
+    parser.add_argument("-F", "--profile",    help="Profile one selection to a file", type=str, default=None)
+    parser.add_argument("-Z", "--daemon",     help="Run as podplayerd",             action="store_true")
+    parser.add_argument("-U", "--socket",     help="Path to podplayerd socket",     type=str, default=None)
+    parser.add_argument("-k", "--skip",       help="Skip what podplayerd is playing", action="store_true")
+    parser.add_argument("-N", "--play-now",   help="Have podplayerd play a URL now", action="store_true")
+    parser.add_argument("-I", "--status",     help="Show what podplayerd is doing", action="store_true")
+    parser.add_argument("-q", "--queue",      help="Show the next QUEUE plays",     type=int, default=None)
+    parser.add_argument("-L", "--listener",   help="Listener whose podcasts to use", type=str, default="default")
+    parser.add_argument("-B", "--buffer",     help="Start playing after this many MiB, or seconds with an s", type=str, default=None)
+    parser.add_argument("-G", "--segments",   help="Pieces to download an episode in at once", type=int, default=4)
     parser.add_argument("arguments",          help="Arguments if appropriate",      type=str, nargs="*")
     args = parser.parse_args()
 
@@ -533,6 +4025,8 @@ def main():
 
     if args.add and args.remove:
         raise ImNotDoingThat("--add and --remove are mutually exclusive.")
+    if args.import_opml and (args.add or args.remove):
+        raise ImNotDoingThat("--import-opml can't be combined with --add or --remove.")
 
     if debug:
         print ("verbose",   args.verbose)
@@ -545,19 +4039,128 @@ def main():
         print ("list",      args.list)
         print ("play",      args.play)
         print ("continuous",args.continuous)
+        print ("jobs",      args.jobs)
+        print ("stream",    args.stream)
+        print ("ahead",     args.ahead)
+        print ("timeout",   args.timeout)
+        print ("cachedir",  args.cachedir)
+        print ("cachesize", args.cachesize)
+        print ("import",    args.import_opml)
+        print ("export",    args.export_opml)
+        print ("stats",     args.stats)
+        print ("profile",   args.profile)
+        print ("daemon",    args.daemon)
+        print ("socket",    args.socket)
+        print ("skip",      args.skip)
+        print ("play_now",  args.play_now)
+        print ("status",    args.status)
+        print ("queue",     args.queue)
+        print ("buffer",    args.buffer)
+        print ("listener",  args.listener)
+        print ("segments",  args.segments)
         print ("arguments", args.arguments)
     
-    podplayer  = PodPlayer(dbpath=args.dbpath, verbose=verbose, debug=debug)
+    readahead_bytes   = None
+    readahead_seconds = None
+    if args.buffer is not None:
+        try:
+            if args.buffer.endswith("s"):
+                readahead_seconds = float(args.buffer[:-1])
+            else:
+                readahead_bytes = int(float(args.buffer) * 1048576)
+        except ValueError:
+            raise ImNotDoingThat("--buffer takes a number of MiB, or of seconds followed by s.")
+
+    options = {
+        "dbpath":            args.dbpath,
+        "jobs":              args.jobs,
+        "streaming":         args.stream,
+        "prefetch":          args.ahead,
+        "timeout":           args.timeout,
+        "cachedir":          args.cachedir,
+        "cachesize":         args.cachesize * 1048576,
+        "profile":           args.profile,
+        "readahead_bytes":   readahead_bytes,
+        "readahead_seconds": readahead_seconds,
+        "listener":          args.listener,
+        "segments":          max(1, args.segments)
+    }
+    socket_path = args.socket
+    if socket_path is None:
+        #Each listener sharing a database gets a podplayerd of their own.
+        if args.listener == "default":
+            socket_path = os.path.splitext(args.dbpath)[0] + ".sock"
+        else:
+            socket_path = os.path.splitext(args.dbpath)[0] + "-" + args.listener + ".sock"
+
+    if args.daemon:
+        PodPlayerDaemon(socket_path=socket_path, options=options, verbose=verbose, debug=debug).serve()
+        return
+
+    #If podplayerd is running, the verbs it knows about go to it, and
+    #this process never opens the database.  Playing here as well
+    #would just have two players talking over each other.
+    client       = PodPlayerClient(socket_path)
+    daemon_up    = client.available()
+    daemon_verbs = args.add or args.remove or args.list or args.queue is not None or args.skip or args.status or args.play_now
+    local_verbs  = args.import_opml or args.export_opml or args.stats or args.play or args.continuous
+    if daemon_up and (args.play or args.continuous or not (daemon_verbs or local_verbs)):
+        raise ImNotDoingThat("podplayerd is already playing.  Use --play-now or --skip.")
+    if args.play_now and len(args.arguments) != 1:
+        raise ImNotDoingThat("--play-now takes one podcast or episode URL.")
+
+    podplayer = None
+    if local_verbs or not daemon_verbs or (not daemon_up and (args.add or args.remove or args.list or args.queue is not None)):
+        podplayer = PodPlayer(verbose=verbose, debug=debug, **options)
     verb_found = False
     
     if args.add:
-        podplayer.add_podcasts(args.arguments, args.priority, args.type)
+        if daemon_up:
+            sys.stdout.write(client.request("add", urls=args.arguments, priority=args.priority, type=args.type)["output"])
+        else:
+            podplayer.add_podcasts(args.arguments, args.priority, args.type)
         verb_found = True
     if args.remove:
-        podplayer.remove_podcasts(args.arguments)
+        if daemon_up:
+            sys.stdout.write(client.request("remove", urls=args.arguments)["output"])
+        else:
+            podplayer.remove_podcasts(args.arguments)
+        verb_found = True
+    if args.import_opml:
+        podplayer.import_opml(args.arguments, args.priority, args.type)
+        verb_found = True
+    if args.export_opml:
+        if len(args.arguments) == 0:
+            podplayer.export_opml(sys.stdout)
+        else:
+            with open(args.arguments[0], 'w') as outfile:
+                podplayer.export_opml(outfile)
         verb_found = True
     if args.list:
-        podplayer.pretty_list()
+        if daemon_up:
+            sys.stdout.write(client.request("list")["output"])
+        else:
+            podplayer.pretty_list()
+        verb_found = True
+    if args.queue is not None:
+        if daemon_up:
+            sys.stdout.write(client.request("queue", count=args.queue)["output"])
+        else:
+            podplayer.print_queue(args.queue)
+        verb_found = True
+    if args.stats:
+        podplayer.print_stats()
+        verb_found = True
+    if args.skip or args.play_now or args.status:
+        if not daemon_up:
+            print ("No podplayerd is listening on %s." % (socket_path,))
+        else:
+            if args.play_now:
+                sys.stdout.write(client.request("play-now", url=args.arguments[0])["output"])
+            if args.skip:
+                sys.stdout.write(client.request("skip")["output"])
+            if args.status:
+                sys.stdout.write(client.request("status")["output"])
         verb_found = True
     if args.play:
         podplayer.play_one()
@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+
+import podplayer
+import podbench
+
+class VirtualClock (object):
+    """Class VirtualClock is the clock the PodPlayer in a replay goes by.
+    time() returns the virtual time, which only moves when advance()
+    is called.  Timings are still taken with the real
+    time.perf_counter().
+
+    """
+
+    def __init__(self, now):
+        """VirtualClock.__init__() takes the virtual time to start at.
+
+        """
+
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        """VirtualClock.advance() moves the virtual time forward.
+
+        """
+
+        self.now += max(0.0, seconds)
+
+class ReplayFeed (object):
+    """Class ReplayFeed holds the items of one recorded feed, and rebuilds
+    the feed as it would have looked at a given time:  only the items
+    published by then, newest first.  Items without a pubDate are
+    always there.  Several snapshots of the same feed can be added,
+    so that items that have since dropped off the end of it are kept.
+
+    """
+
+    #marker stands in for the items while the rest of the feed is
+    #turned back into text.
+    marker = "podsim-items"
+
+    def __init__(self, url, priority=10, load_type='back', name=None):
+        """ReplayFeed.__init__() copies its arguments to like-named
+        properties.  The feed has no items until add_snapshot() is
+        called.
+
+        """
+
+        self.url       = url
+        self.priority  = priority
+        self.load_type = load_type
+        self.name      = name
+        self.head      = None
+        self.tail      = None
+        self.items     = {}
+        self.ordered   = []
+        self.visible   = None
+
+    def add_snapshot(self, text):
+        """ReplayFeed.add_snapshot() takes the text of a feed and adds the
+        items it hasn't seen yet.  The channel around them comes from
+        the latest snapshot.
+
+        """
+
+        tree    = ET.fromstring(text.encode('utf-8'))
+        channel = tree.find('channel')
+        parser  = podplayer.Podcast()
+        for item in channel.findall('item'):
+            key = item.findtext('guid')
+            if key is None:
+                enclosure = item.find('enclosure')
+                key = ET.tostring(item) if enclosure is None else enclosure.get('url')
+            if key not in self.items:
+                self.items[key] = (parser.parse_pubdate(item.findtext('pubDate')), ET.tostring(item, encoding='unicode'))
+            channel.remove(item)
+        if self.name is None:
+            self.name = channel.findtext('title')
+
+        ET.SubElement(channel, self.marker)
+        self.head, self.tail = ET.tostring(tree, encoding='unicode').split("<%s />" % (self.marker,))
+
+        #Newest first, the way feeds usually are.  Undated items go on
+        #the end.
+        self.ordered = sorted(self.items.values(), key=lambda item: -item[0] if item[0] else float('inf'))
+        self.visible = None
+
+    def first_published(self):
+        """ReplayFeed.first_published() returns the publish time of the
+        oldest dated item, or None if none are dated.
+
+        """
+
+        dated = [published for published, text in self.ordered if published]
+        if len(dated) == 0:
+            return None
+        return min(dated)
+
+    def last_published(self):
+        """ReplayFeed.last_published() returns the publish time of the
+        newest dated item, or None if none are dated.
+
+        """
+
+        dated = [published for published, text in self.ordered if published]
+        if len(dated) == 0:
+            return None
+        return max(dated)
+
+    def build(self, now):
+        """ReplayFeed.build() returns the feed as bytes as of the given
+        time, or None if it hasn't changed since the last call.
+
+        """
+
+        items = [text for published, text in self.ordered if not published or published <= now]
+        if self.visible == len(items):
+            return None
+        self.visible = len(items)
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n' + self.head + "".join(items) + self.tail).encode('utf-8')
+
+class Simulator (object):
+    """Class Simulator replays recorded feeds against a PodPlayer on a
+    VirtualClock.  The feeds are served from a podbench.FeedServer,
+    each item turning up when its pubDate comes around, and a
+    listener plays for a number of hours a day, the way
+    play_continuous() would, except that nothing is downloaded and
+    playing an episode just moves the clock on by its duration.
+
+    """
+
+    #default_duration is how long an episode is taken to be, in
+    #seconds, when the feed doesn't say.
+    default_duration = 1800.0
+
+    def __init__(self, feeds, weeks=4.0, hours=2.0, jobs=1, streaming=False, seed=0, verbose=False):
+        """Simulator.__init__() copies its arguments to like-named
+        properties.  feeds is a list of ReplayFeeds, weeks is how long
+        to replay, ending at the newest item, and hours is how long
+        the listener listens each day.  seed seeds the polling
+        jitter, so that runs can be compared.
+
+        """
+
+        self.verbose   = verbose
+
+        self.feeds     = feeds
+        self.weeks     = weeks
+        self.hours     = hours
+        self.jobs      = jobs
+        self.streaming = streaming
+        self.seed      = seed
+
+    def episode_seconds(self, selection):
+        """Simulator.episode_seconds() takes a Selection and returns how long
+        it plays for.
+
+        """
+
+        episode = selection.episode
+        if episode is not None and episode.duration:
+            return float(episode.duration)
+        if episode is not None and episode.length:
+            return episode.length / podplayer.PodPlayer.assumed_byte_rate
+        return self.default_duration
+
+    def refresh(self, server, now):
+        """Simulator.refresh() updates the feeds on the server to the given
+        time.
+
+        """
+
+        for number, feed in enumerate(self.feeds):
+            body = feed.build(now)
+            if body is not None:
+                server.add_feed("/feed-%d.xml" % (number,), body)
+
+    def backlog(self, player):
+        """Simulator.backlog() returns how many episodes are waiting to be
+        played, as --list would count them.
+
+        """
+
+        return sum([player.database.count_unplayed(podcast) for podcast in list(player.database.scan_podcasts())])
+
+    def run(self):
+        """Simulator.run() runs the replay and returns a report as a dict.
+
+        """
+
+        if len(self.feeds) == 0:
+            raise podplayer.ImNotDoingThat("There are no feeds to replay.")
+        end   = max([feed.last_published() or 0 for feed in self.feeds])
+        start = end - self.weeks * 7 * 86400
+        days  = int(self.weeks * 7 + 0.5)
+
+        random.seed(self.seed)
+        clock     = VirtualClock(start)
+
+        server    = podbench.FeedServer()
+        base_url  = server.start()
+        directory = tempfile.mkdtemp(prefix="podsim-")
+        started   = time.perf_counter()
+        try:
+            self.refresh(server, clock.now)
+            player = podplayer.PodPlayer(dbpath=os.path.join(directory, "podsim.db"), jobs=self.jobs, streaming=self.streaming, cachedir=os.path.join(directory, "media"), clock=clock)
+            player.add_podcast_list([(base_url + "/feed-%d.xml" % (number,), feed.load_type, feed.priority, feed.name) for number, feed in enumerate(self.feeds)])
+
+            latencies = []
+            daily     = []
+            plays     = 0
+            for day in range(days):
+                day_start  = start + day * 86400
+                day_end    = day_start + self.hours * 3600
+                requests   = server.requests
+                sent       = server.bytes
+                day_plays  = 0
+                if clock.now < day_start:
+                    clock.advance(day_start - clock.now)
+
+                while clock.now < day_end:
+                    self.refresh(server, clock.now)
+                    before    = time.perf_counter()
+                    selection = player.make_selection()
+                    latencies += [time.perf_counter() - before]
+                    if selection is None:
+                        #What wait_for_next_poll() would do.
+                        due = player.database.next_poll_due()
+                        if due is None:
+                            due = clock.now + podplayer.Podcast.poll_min_interval
+                        clock.advance(max(due, clock.now + player.min_poll_wait) - clock.now)
+                        continue
+                    clock.advance(self.episode_seconds(selection))
+                    player.update_last_played(selection)
+                    day_plays += 1
+
+                plays += day_plays
+                daily += [{
+                    "day":      day + 1,
+                    "plays":    day_plays,
+                    "fetches":  server.requests - requests,
+                    "bytes":    server.bytes - sent,
+                    "backlog":  self.backlog(player)
+                }]
+                if self.verbose:
+                    entry = daily[-1]
+                    print ("Day %3d  %4d plays  %5d fetches  %10d bytes  %5d waiting" % (entry["day"], entry["plays"], entry["fetches"], entry["bytes"], entry["backlog"]), file=sys.stderr)
+
+            phases = {}
+            for phase, total, failures, seconds in player.database.phase_timings():
+                phases[phase] = {
+                    "count":    total,
+                    "failed":   failures,
+                    "p50_s":    player.percentile(seconds, 50),
+                    "p95_s":    player.percentile(seconds, 95)
+                }
+            player.database.dbi.close()
+            player.http.close()
+        finally:
+            server.stop()
+            shutil.rmtree(directory)
+
+        latencies.sort()
+        return {
+            "feeds":          len(self.feeds),
+            "start":          start,
+            "end":            clock.now,
+            "weeks":          self.weeks,
+            "hours_per_day":  self.hours,
+            "jobs":           self.jobs,
+            "streaming":      self.streaming,
+            "seed":           self.seed,
+            "wall_s":         time.perf_counter() - started,
+            "plays":          plays,
+            "fetches":        sum([entry["fetches"] for entry in daily]),
+            "bytes":          sum([entry["bytes"] for entry in daily]),
+            "backlog_start":  daily[0]["backlog"] if len(daily) > 0 else 0,
+            "backlog_end":    daily[-1]["backlog"] if len(daily) > 0 else 0,
+            "selections":     {
+                "count":    len(latencies),
+                "p50_s":    player.percentile(latencies, 50),
+                "p95_s":    player.percentile(latencies, 95),
+                "max_s":    latencies[-1] if len(latencies) > 0 else None
+            },
+            "phases":         phases,
+            "days":           daily
+        }
+
+def record(urls, database, priority, load_type, timeout):
+    """record() fetches the given feed URLs, or if there are none, every
+    podcast in the database given, and returns a snapshot of them as
+    a dict that can be saved as JSON.
+
+    """
+
+    subscriptions = []
+    for url in urls:
+        subscriptions += [(url, priority, load_type)]
+    if len(urls) == 0 and database is not None:
+        for podcast in list(database.scan_podcasts()):
+            subscriptions += [(podcast.podcast_url, podcast.podcast_priority, podcast.podcast_load_type)]
+
+    http  = podplayer.HttpClient(timeout=timeout)
+    feeds = []
+    for url, priority, load_type in subscriptions:
+        try:
+            status, headers, body = http.fetch(url)
+        except (podplayer.FetchError, OSError) as error:
+            print ("Warning:  Could not fetch %s (%s)." % (url, error), file=sys.stderr)
+            continue
+        if status != 200:
+            print ("Warning:  Could not fetch %s (HTTP %d)." % (url, status), file=sys.stderr)
+            continue
+        feeds += [{
+            "url":        url,
+            "priority":   priority,
+            "load_type":  load_type,
+            "fetched":    time.time(),
+            "feed":       body.decode('utf-8', 'replace')
+        }]
+    http.close()
+    return {"recorded": time.time(), "feeds": feeds}
+
+def load(paths):
+    """load() takes a list of snapshot files and returns a list of
+    ReplayFeeds, with the snapshots of each URL merged, oldest first.
+
+    """
+
+    feeds = {}
+    for path in paths:
+        with open(path) as infile:
+            snapshot = json.load(infile)
+        for entry in sorted(snapshot["feeds"], key=lambda entry: entry["fetched"]):
+            feed = feeds.get(entry["url"])
+            if feed is None:
+                feed = feeds[entry["url"]] = ReplayFeed(entry["url"], entry["priority"], entry["load_type"])
+            feed.add_snapshot(entry["feed"])
+    return list(feeds.values())
+
+def main():
+    parser=argparse.ArgumentParser(description="Replay recorded feeds against PodPlayer on a virtual clock.")
+    parser.add_argument("-v", "--verbose",    help="Print each day as it goes",     action="store_true")
+    parser.add_argument("-r", "--record",     help="Record snapshots instead",      action="store_true")
+    parser.add_argument("-d", "--dbpath",     help="Database to record from",       type=str, default=None)
+    parser.add_argument("-L", "--listener",   help="Listener to record from",       type=str, default="default")
+    parser.add_argument("-p", "--priority",   help="Priority of feeds recorded",    type=int, default=10)
+    parser.add_argument("-t", "--type",       help="Load type of feeds recorded",   type=str, choices=['front','back'], default='back')
+    parser.add_argument("-T", "--timeout",    help="Network timeout in seconds",    type=float, default=30.0)
+    parser.add_argument("-w", "--weeks",      help="Weeks to replay",               type=float, default=4.0)
+    parser.add_argument("-H", "--hours",      help="Hours of listening a day",      type=float, default=2.0)
+    parser.add_argument("-j", "--jobs",       help="Feeds to fetch at once",        type=int, default=1)
+    parser.add_argument("-s", "--stream",     help="Stream-parse feeds",            action="store_true")
+    parser.add_argument("-S", "--seed",       help="Seed for polling jitter",       type=int, default=0)
+    parser.add_argument("-o", "--output",     help="Where to write the JSON",       type=str, default=None)
+    parser.add_argument("arguments",          help="Feed URLs to record, or snapshots to replay", type=str, nargs="*")
+    args = parser.parse_args()
+
+    if args.record:
+        database = None
+        if args.dbpath is not None:
+            database = podplayer.PodPlayerDB(dbpath=args.dbpath, listener=args.listener)
+        report = record(args.arguments, database, args.priority, args.type, args.timeout)
+    else:
+        if len(args.arguments) == 0:
+            raise podplayer.ImNotDoingThat("Give one or more snapshots to replay.")
+        simulator = Simulator(load(args.arguments), weeks=args.weeks, hours=args.hours, jobs=args.jobs, streaming=args.stream, seed=args.seed, verbose=args.verbose)
+        report    = simulator.run()
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print ()
+    else:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+
+if __name__ == "__main__":
+    main()
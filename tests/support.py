@@ -0,0 +1,191 @@
+"""Feeds and a local HTTP server for the tests to fetch from."""
+
+import email.utils
+import hashlib
+import http.server
+import re
+import sqlite3
+import threading
+import time
+
+
+#PodPlayerDB.init_if_needed_steps from the last release before schema
+#versions were kept:  the whole of a database from then.
+legacy_steps = [
+    "CREATE TABLE IF NOT EXISTS podcast_v1 (podcast_id INTEGER PRIMARY KEY AUTOINCREMENT, podcast_priority INTEGER DEFAULT 10, podcast_load_type TEXT DEFAULT 'back', podcast_url TEXT, podcast_name TEXT, podcast_last_played TEXT)",
+    "CREATE INDEX IF NOT EXISTS podcast_v1_priority ON podcast_v1(podcast_priority)",
+    "CREATE INDEX IF NOT EXISTS podcast_v1_url ON podcast_v1(podcast_url)"
+]
+
+
+def legacy_podcast(number):
+    """The podcast_v1 row make_legacy_database() writes for number,
+    from podcast_url on."""
+    return ("http://feeds.example.com/legacy-%d.xml" % (number,), ('back', 'front', 'random')[number % 3], number % 20,
+            "Legacy %d" % (number,), "http://media.example.com/%d/1.mp3" % (number,) if number % 4 else None)
+
+
+def make_legacy_database(dbpath, podcasts):
+    """Makes a database at dbpath with legacy_steps, the way the last
+    release before schema versions did, holding podcasts podcasts."""
+    connection = sqlite3.connect(dbpath)
+    for step in legacy_steps:
+        connection.execute(step)
+    connection.executemany("INSERT INTO podcast_v1 (podcast_url, podcast_load_type, podcast_priority, podcast_name, podcast_last_played) VALUES (?, ?, ?, ?, ?)",
+                           [legacy_podcast(number) for number in range(1, podcasts + 1)])
+    connection.commit()
+    connection.close()
+
+
+class FeedGenerator (object):
+    """Makes RSS feeds of numbered items, newest first, an hour apart,
+    with an enclosure each under base_url.
+
+    """
+
+    def __init__(self, title="Test", base_url="http://media.example.com", start=1700000000):
+        self.title    = title
+        self.base_url = base_url
+        self.start    = start
+
+    def enclosure_path(self, number):
+        return "/%s/episode-%d.mp3" % (self.title.lower(), number)
+
+    def enclosure_url(self, number):
+        return self.base_url + self.enclosure_path(number)
+
+    def make_feed(self, items, length=1000000):
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel><title>%s</title>' % (self.title,)]
+        for number in range(items, 0, -1):
+            parts += ['<item><title>Episode %d</title><pubDate>%s</pubDate><guid>%s-%d</guid>'
+                      '<enclosure url="%s" length="%d" type="audio/mpeg"/></item>'
+                      % (number, email.utils.formatdate(self.start - (items - number) * 3600, usegmt=True),
+                         self.title, number, self.enclosure_url(number), length)]
+        parts += ['</channel></rss>\n']
+        return "".join(parts).encode('utf-8')
+
+
+class Resource (object):
+    """One thing FeedServer serves, and how badly.
+
+    body is what is served.  etag and last_modified are sent as
+    validators and honoured in If-None-Match, If-Modified-Since and
+    If-Range; etag defaults to a hash of the body.  If ranges is set,
+    Range requests get a 206.  drop_at is a byte offset of the body
+    at which the connection is cut, once.  short cuts the body that
+    many bytes short of the Content-Length sent, every time.  delay is
+    how long to sleep before each chunk of chunk_size bytes.
+
+    """
+
+    def __init__(self, body, etag=None, last_modified=None, ranges=False, drop_at=None, short=0, delay=0, chunk_size=65536):
+        self.body          = body
+        self.etag          = etag or '"%s"' % (hashlib.sha256(body).hexdigest()[:16],)
+        self.last_modified = last_modified
+        self.ranges        = ranges
+        self.drop_at       = drop_at
+        self.short         = short
+        self.delay         = delay
+        self.chunk_size    = chunk_size
+
+
+class FeedServer (object):
+    """A local HTTP server for Resources.  Every request is kept in
+    self.log as (path, headers), and self.sent counts body bytes.
+
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.log       = []
+        self.sent      = 0
+        self.lock      = threading.Lock()
+        self.server    = None
+
+    def add(self, path, body, **options):
+        resource = Resource(body, **options)
+        with self.lock:
+            self.resources[path] = resource
+        return resource
+
+    def requests(self, path=None):
+        with self.lock:
+            return [headers for logged, headers in self.log if path is None or logged == path]
+
+    def start(self):
+        feedserver = self
+
+        class Handler (http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                with feedserver.lock:
+                    feedserver.log += [(path, dict(self.headers.items()))]
+                    resource = feedserver.resources.get(path)
+                if resource is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                if self.headers.get("If-None-Match") == resource.etag or (resource.last_modified is not None and self.headers.get("If-Modified-Since") == resource.last_modified):
+                    self.send_response(304)
+                    self.send_header("ETag", resource.etag)
+                    self.end_headers()
+                    return
+
+                body   = resource.body
+                status = 200
+                first  = 0
+                match  = re.match("^bytes=([0-9]+)-([0-9]*)$", self.headers.get("Range", ""))
+                if_range = self.headers.get("If-Range")
+                if resource.ranges and match is not None and (if_range is None or if_range in (resource.etag, resource.last_modified)):
+                    first  = int(match.group(1))
+                    last   = int(match.group(2)) if match.group(2) else len(body) - 1
+                    last   = min(last, len(body) - 1)
+                    status = 206
+                    body   = body[first:last + 1]
+
+                self.send_response(status)
+                self.send_header("ETag", resource.etag)
+                if resource.last_modified is not None:
+                    self.send_header("Last-Modified", resource.last_modified)
+                if resource.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", "bytes %d-%d/%d" % (first, first + len(body) - 1, len(resource.body)))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                end = len(body) - resource.short
+                with feedserver.lock:
+                    if resource.drop_at is not None and first <= resource.drop_at < first + len(body):
+                        end = resource.drop_at - first
+                        resource.drop_at = None
+                position = 0
+                while position < end:
+                    if resource.delay:
+                        time.sleep(resource.delay)
+                    chunk = body[position:min(end, position + resource.chunk_size)]
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+                    position += len(chunk)
+                    with feedserver.lock:
+                        feedserver.sent += len(chunk)
+                if end < len(body):
+                    self.close_connection = True
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.base_url = "http://127.0.0.1:%d" % (self.server.server_address[1],)
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,156 @@
+"""Tests for podplayerd's socket protocol, and the command line falling
+back to the database when podplayerd isn't running."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(socket_path, options):
+    podplayer.PodPlayerDaemon(socket_path=socket_path, options=options).serve()
+
+
+class DaemonTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory   = tempfile.mkdtemp(prefix="podtest-")
+        self.dbpath      = os.path.join(self.directory, "test.db")
+        self.socket_path = os.path.join(self.directory, "test.sock")
+        self.options     = {"dbpath": self.dbpath, "cachedir": os.path.join(self.directory, "media"), "listener": "default"}
+        self.server      = support.FeedServer()
+        base_url         = self.server.start()
+        self.generator   = support.FeedGenerator(base_url=base_url)
+        self.feed_url    = base_url + "/feed.xml"
+        self.other_url   = base_url + "/other.xml"
+        self.daemon      = None
+
+        #Give the database a podcast with episodes, already polled, so
+        #the daemon has a queue and its player doesn't fetch anything.
+        #The episodes themselves aren't served, so nothing plays.
+        self.server.add("/feed.xml", self.generator.make_feed(5))
+        player = podplayer.PodPlayer(**self.options)
+        player.add_podcasts([self.feed_url], 10, 'back')
+        player.make_selection()
+        player.http.close()
+        player.database.dbi.close()
+        self.client = podplayer.PodPlayerClient(self.socket_path)
+
+    def tearDown(self):
+        if self.daemon is not None:
+            self.daemon.terminate()
+            self.daemon.join()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def start_daemon(self):
+        self.daemon = multiprocessing.Process(target=serve, args=(self.socket_path, self.options))
+        self.daemon.start()
+        deadline = time.time() + 10
+        while not self.client.available():
+            self.assertLess(time.time(), deadline, "podplayerd didn't start")
+            time.sleep(0.05)
+
+    def send(self, line):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(10)
+            connection.connect(self.socket_path)
+            connection.sendall(line)
+            with connection.makefile('rb') as infile:
+                return json.loads(infile.readline())
+
+    def command_line(self, *arguments):
+        result = subprocess.run([sys.executable, os.path.join(HERE, "podplayer.py"), "-d", self.dbpath, "-C", self.options["cachedir"], "-U", self.socket_path] + list(arguments),
+                                cwd=self.directory, capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_add_list_remove(self):
+        self.start_daemon()
+        response = self.client.request("add", urls=[self.other_url, self.feed_url], priority=5, type='front')
+        self.assertTrue(response["ok"])
+        self.assertIn("Skipping %s" % (self.feed_url,), response["output"])
+
+        response = self.client.request("list")
+        self.assertTrue(response["ok"])
+        lines = response["output"].splitlines()[2:]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("  5 front"))
+        self.assertTrue(lines[0].endswith(self.other_url))
+        self.assertTrue(lines[1].startswith(" 10 back     5"))
+
+        response = self.client.request("remove", urls=[self.other_url, self.other_url])
+        self.assertTrue(response["ok"])
+        self.assertIn("Skipping %s" % (self.other_url,), response["output"])
+        database = podplayer.PodPlayerDB(dbpath=self.dbpath)
+        self.assertEqual(database.podcast_urls(), set([self.feed_url]))
+        database.dbi.close()
+
+    def test_queue(self):
+        self.start_daemon()
+        response = self.client.request("queue", count=3)
+        self.assertTrue(response["ok"])
+        lines = response["output"].splitlines()[2:]
+        self.assertEqual([line.split()[-1] for line in lines], [self.generator.enclosure_url(number) for number in (1, 2, 3)])
+
+    def test_error_replies(self):
+        self.start_daemon()
+        response = self.client.request("shuffle")
+        self.assertFalse(response["ok"])
+        self.assertEqual(response["output"], "Unknown command shuffle.\n")
+        response = self.client.request("add")
+        self.assertFalse(response["ok"])
+        self.assertTrue(response["output"].startswith("Bad request"))
+        response = self.send(b"this is not JSON\n")
+        self.assertFalse(response["ok"])
+        self.assertTrue(response["output"].startswith("Bad request"))
+        #None of that stopped it answering.
+        self.assertTrue(self.client.request("list")["ok"])
+
+    def test_second_daemon_is_refused(self):
+        self.start_daemon()
+        with self.assertRaises(podplayer.ImNotDoingThat):
+            podplayer.PodPlayerDaemon(socket_path=self.socket_path, options=self.options).serve()
+
+    def test_command_line_goes_to_daemon(self):
+        self.start_daemon()
+        self.command_line("-a", self.other_url)
+        self.assertEqual(self.client.request("list")["output"], self.command_line("-l"))
+        self.assertIn(self.other_url, self.command_line("-l"))
+
+    def test_command_line_falls_back_without_daemon(self):
+        self.assertFalse(self.client.available())
+        self.command_line("-a", "-p", "5", self.other_url)
+        listing = self.command_line("-l")
+        self.assertIn(self.other_url, listing)
+        self.assertEqual(len(listing.splitlines()), 4)
+        self.assertIn("No podplayerd is listening", self.command_line("-I"))
+
+    def test_command_line_falls_back_past_dead_socket(self):
+        #A socket file left behind by a daemon that died.
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.close()
+        self.assertFalse(self.client.available())
+        self.assertIn(self.feed_url, self.command_line("-l"))
+
+        #And a new daemon takes its place.
+        self.start_daemon()
+        self.assertTrue(self.client.request("list")["ok"])
+
+
+if __name__ == "__main__":
+    unittest.main()
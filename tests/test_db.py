@@ -0,0 +1,238 @@
+"""Tests for PodPlayerDB transactions, migrations and concurrent access."""
+
+import os
+import shutil
+import sqlite3
+import multiprocessing
+import tempfile
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+class TransactionTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.dbpath    = os.path.join(self.directory, "test.db")
+        self.database  = podplayer.PodPlayerDB(dbpath=self.dbpath)
+        #A second connection only sees what has been committed.
+        self.observer  = sqlite3.connect(self.dbpath)
+
+    def tearDown(self):
+        self.observer.close()
+        self.database.dbi.close()
+        shutil.rmtree(self.directory)
+
+    def committed_urls(self):
+        return sorted([row[0] for row in self.observer.execute("SELECT podcast_url FROM podcast_v1")])
+
+    def test_rollback_writes_nothing(self):
+        with self.assertRaises(RuntimeError):
+            with self.database.transaction():
+                self.database.add_podcast("http://feeds.example.com/a.xml", 10, 'back')
+                self.database.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+                raise RuntimeError("abandon")
+        self.assertEqual(self.committed_urls(), [])
+        self.assertEqual(self.database.podcast_urls(), set())
+        self.assertEqual(self.database.depth, 0)
+
+    def test_commit_writes_everything(self):
+        with self.database.transaction():
+            self.database.add_podcast("http://feeds.example.com/a.xml", 10, 'back')
+            self.database.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+        self.assertEqual(self.committed_urls(), ["http://feeds.example.com/a.xml", "http://feeds.example.com/b.xml"])
+
+    def test_inner_transaction_does_not_commit(self):
+        with self.database.transaction():
+            with self.database.transaction():
+                self.database.add_podcast("http://feeds.example.com/a.xml", 10, 'back')
+            self.assertEqual(self.committed_urls(), [])
+            self.database.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+        self.assertEqual(self.committed_urls(), ["http://feeds.example.com/a.xml", "http://feeds.example.com/b.xml"])
+
+    def test_failure_in_inner_transaction_rolls_back_outer(self):
+        with self.assertRaises(RuntimeError):
+            with self.database.transaction():
+                self.database.add_podcast("http://feeds.example.com/a.xml", 10, 'back')
+                with self.database.transaction():
+                    self.database.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+                    raise RuntimeError("abandon")
+        self.assertEqual(self.committed_urls(), [])
+        self.assertEqual(self.database.depth, 0)
+
+
+class QuickDB (podplayer.PodPlayerDB):
+    """Gives up on a lock right away, so that waiting for one shows up
+    as "database is locked" instead of as a slow test."""
+
+    busy_timeout = 0.1
+
+
+class ContentionTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.dbpath    = os.path.join(self.directory, "test.db")
+        self.writer    = QuickDB(dbpath=self.dbpath)
+        self.reader    = QuickDB(dbpath=self.dbpath)
+        self.writer.add_podcast("http://feeds.example.com/a.xml", 10, 'back')
+
+    def tearDown(self):
+        self.reader.dbi.close()
+        self.writer.dbi.close()
+        shutil.rmtree(self.directory)
+
+    def test_read_during_write_transaction(self):
+        with self.writer.transaction():
+            self.writer.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+            #The writer holds the write lock, and the reader still gets
+            #the last committed state.
+            self.assertEqual(self.reader.podcast_urls(), set(["http://feeds.example.com/a.xml"]))
+            self.assertEqual(len(list(self.reader.scan_podcasts())), 1)
+        self.assertEqual(len(self.reader.podcast_urls()), 2)
+
+    def test_write_during_read_transaction(self):
+        self.reader.dbi.execute("BEGIN")
+        self.assertEqual(self.reader.podcast_urls(), set(["http://feeds.example.com/a.xml"]))
+        #A reader partway through doesn't keep the writer from
+        #committing, and keeps seeing what it started with.
+        with self.writer.transaction():
+            self.writer.add_podcast("http://feeds.example.com/b.xml", 10, 'back')
+        self.assertEqual(len(self.reader.podcast_urls()), 1)
+        self.reader.dbi.commit()
+        self.assertEqual(len(self.reader.podcast_urls()), 2)
+
+
+class SpyDB (podplayer.PodPlayerDB):
+    """Keeps a list of every migration step run, on any instance."""
+
+    steps_run = []
+
+    def run_steps(self, steps):
+        SpyDB.steps_run += [steps]
+        podplayer.PodPlayerDB.run_steps(self, steps)
+
+
+class MigrationTest (unittest.TestCase):
+
+    podcasts = 5000
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.dbpath    = os.path.join(self.directory, "legacy.db")
+        support.make_legacy_database(self.dbpath, self.podcasts)
+        SpyDB.steps_run = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def user_version(self):
+        connection = sqlite3.connect(self.dbpath)
+        try:
+            return connection.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_upgrade_carries_subscriptions_over(self):
+        self.assertEqual(self.user_version(), 0)
+        database = SpyDB(dbpath=self.dbpath)
+        #One pass, one run of each upgrade.
+        self.assertEqual(SpyDB.steps_run, [steps for columns, steps in podplayer.PodPlayerDB.migrations])
+        self.assertEqual(self.user_version(), 2)
+        rows = database.dbi.execute("SELECT podcast_url, s.podcast_load_type, s.podcast_priority, podcast_name, s.podcast_last_played "
+                                    "FROM subscription_v1 s JOIN podcast_v1 USING (podcast_id) WHERE listener_name = 'default' ORDER BY podcast_id").fetchall()
+        self.assertEqual(rows, [support.legacy_podcast(number) for number in range(1, self.podcasts + 1)])
+        self.assertEqual(database.dbi.execute("SELECT count(0) FROM subscription_v1").fetchone()[0], self.podcasts)
+        self.assertEqual(len(database.podcast_urls()), self.podcasts)
+        database.dbi.close()
+
+    def test_reopening_runs_no_migration(self):
+        SpyDB(dbpath=self.dbpath).dbi.close()
+        SpyDB.steps_run = []
+        SpyDB(dbpath=self.dbpath).dbi.close()
+        self.assertEqual(SpyDB.steps_run, [])
+        self.assertEqual(self.user_version(), 2)
+
+    def test_failing_step_rolls_back_to_previous_version(self):
+        class FailingDB (podplayer.PodPlayerDB):
+            migrations = podplayer.PodPlayerDB.migrations[:1] + [
+                ([("podcast_v1", "podcast_extra", "TEXT")], [
+                    "DROP INDEX IF EXISTS podcast_v1_priority",
+                    "THIS IS NOT SQL"
+                ])
+            ]
+        with self.assertRaises(sqlite3.OperationalError):
+            FailingDB(dbpath=self.dbpath)
+        self.assertEqual(self.user_version(), 1)
+        connection = sqlite3.connect(self.dbpath)
+        try:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(podcast_v1)")]
+            indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+            subscriptions = connection.execute("SELECT count(0) FROM subscription_v1").fetchone()[0]
+        finally:
+            connection.close()
+        self.assertNotIn("podcast_extra", columns)
+        self.assertIn("podcast_v1_priority", indexes)
+        self.assertEqual(subscriptions, self.podcasts)
+
+        #The real upgrade picks up from there.
+        podplayer.PodPlayerDB(dbpath=self.dbpath).dbi.close()
+        self.assertEqual(self.user_version(), 2)
+
+
+def selection_cycle(dbpath, listener, cachedir, barrier):
+    player = podplayer.PodPlayer(dbpath=dbpath, listener=listener, cachedir=cachedir)
+    barrier.wait()
+    player.make_selection()
+    player.http.close()
+    player.database.dbi.close()
+
+
+class PollClaimTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.dbpath    = os.path.join(self.directory, "test.db")
+        self.server    = support.FeedServer()
+        base_url       = self.server.start()
+        generator      = support.FeedGenerator()
+        self.urls      = []
+        for number in range(5):
+            self.server.add("/feed-%d.xml" % (number,), generator.make_feed(50))
+            self.urls += ["%s/feed-%d.xml" % (base_url, number)]
+        self.cachedir  = os.path.join(self.directory, "media")
+        self.listeners = ["alice", "bob"]
+        for listener in self.listeners:
+            player = podplayer.PodPlayer(dbpath=self.dbpath, listener=listener, cachedir=self.cachedir)
+            player.add_podcasts(self.urls, 10, 'back')
+            player.http.close()
+            player.database.dbi.close()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_shared_feeds_are_fetched_once(self):
+        barrier   = multiprocessing.Barrier(len(self.listeners))
+        processes = [multiprocessing.Process(target=selection_cycle, args=(self.dbpath, listener, self.cachedir, barrier)) for listener in self.listeners]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.server.requests()), len(self.urls))
+
+    def test_unneeded_feeds_are_released(self):
+        database = podplayer.PodPlayerDB(dbpath=self.dbpath, listener="alice")
+        podcast  = list(database.scan_podcasts())[0]
+        self.assertTrue(database.claim_poll(podcast, 2000000000.0))
+        self.assertFalse(database.claim_poll(podcast, 2000000000.0))
+        database.release_poll(podcast, 2000000000.0)
+        self.assertTrue(list(database.scan_podcasts())[0].is_due())
+        database.dbi.close()
+
+if __name__ == "__main__":
+    unittest.main()
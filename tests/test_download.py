@@ -0,0 +1,131 @@
+"""Tests for HttpClient.download() against a local HTTP server."""
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+class SmallSegments (podplayer.HttpClient):
+    """Splits downloads of a few hundred KiB, instead of a few tens
+    of MiB, into pieces."""
+
+    segment_size = 65536
+
+
+class Interrupted (Exception):
+    pass
+
+
+class StopAtDrop (SmallSegments):
+    """Stops the download at the first piece that drops, as though the
+    player had been killed, leaving what it got for a later
+    download() to pick up."""
+
+    def receive(self, key, connection, response, media_path, written, progress=None):
+        received = SmallSegments.receive(self, key, connection, response, media_path, written, progress)
+        if received - written < int(response.getheader('Content-Length')):
+            raise Interrupted()
+        return received
+
+
+class DownloadTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory  = tempfile.mkdtemp(prefix="podtest-")
+        self.media_path = os.path.join(self.directory, "episode.mp3")
+        self.server     = support.FeedServer()
+        self.url        = self.server.start() + "/episode.mp3"
+        self.body       = random.Random(1).randbytes(400000)
+        self.clients    = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def client(self, factory=SmallSegments):
+        client = factory()
+        self.clients += [client]
+        return client
+
+    def ranges_asked(self):
+        return [headers.get("Range") for headers in self.server.requests("/episode.mp3")]
+
+    def downloaded(self):
+        with open(self.media_path, 'rb') as infile:
+            return infile.read()
+
+    def left_over(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_segments_are_joined(self):
+        resource = self.server.add("/episode.mp3", self.body, ranges=True)
+        self.assertEqual(self.client().download(self.url, self.media_path, segments=4), len(self.body))
+        self.assertEqual(self.downloaded(), self.body)
+        self.assertEqual(sorted(self.ranges_asked()), ["bytes=0-0", "bytes=0-99999", "bytes=100000-199999", "bytes=200000-299999", "bytes=300000-399999"])
+        self.assertEqual([headers.get("If-Range") for headers in self.server.requests("/episode.mp3")[1:]], [resource.etag] * 4)
+        self.assertEqual(self.left_over(), ["episode.mp3"])
+
+    def test_dropped_segment_is_picked_up_where_it_stopped(self):
+        self.server.add("/episode.mp3", self.body, ranges=True, drop_at=250000)
+        self.assertEqual(self.client().download(self.url, self.media_path, segments=4), len(self.body))
+        self.assertEqual(self.downloaded(), self.body)
+        self.assertIn("bytes=250000-299999", self.ranges_asked())
+        self.assertEqual(self.left_over(), ["episode.mp3"])
+
+    def test_later_download_resumes_from_state(self):
+        self.server.add("/episode.mp3", self.body, ranges=True, drop_at=250000)
+        with self.assertRaises(Interrupted):
+            self.client(StopAtDrop).download(self.url, self.media_path, segments=4)
+        with open(self.media_path + ".json") as infile:
+            state = json.load(infile)
+        self.assertEqual(state["ranges"], [[0, 99999], [100000, 199999], [200000, 299999], [300000, 399999]])
+        self.assertEqual(os.path.getsize(self.media_path + ".2"), 50000)
+
+        asked = len(self.ranges_asked())
+        self.assertEqual(self.client().download(self.url, self.media_path, segments=4), len(self.body))
+        self.assertEqual(self.downloaded(), self.body)
+        #No new probe, and only the rest of the piece that dropped.
+        self.assertEqual(self.ranges_asked()[asked:], ["bytes=250000-299999"])
+        self.assertEqual(self.left_over(), ["episode.mp3"])
+
+    def test_changed_file_starts_over(self):
+        self.server.add("/episode.mp3", self.body, ranges=True, drop_at=250000)
+        with self.assertRaises(Interrupted):
+            self.client(StopAtDrop).download(self.url, self.media_path, segments=4)
+
+        #The episode is replaced between one piece and the next.
+        changed = random.Random(2).randbytes(300000)
+        self.server.add("/episode.mp3", changed, ranges=True)
+        with self.assertRaises(podplayer.MediaChanged):
+            self.client().download(self.url, self.media_path, segments=4)
+        self.assertEqual(self.left_over(), [])
+
+        self.assertEqual(self.client().download(self.url, self.media_path, segments=4), len(changed))
+        self.assertEqual(self.downloaded(), changed)
+
+    def test_short_body_is_rejected(self):
+        self.server.add("/episode.mp3", self.body, short=1000)
+        with self.assertRaises(podplayer.FetchError):
+            self.client().download(self.url, self.media_path, segments=4)
+        self.assertEqual(self.left_over(), [])
+
+    def test_short_segments_are_rejected(self):
+        self.server.add("/episode.mp3", self.body, ranges=True, short=1000)
+        with self.assertRaises(podplayer.FetchError):
+            self.client().download(self.url, self.media_path, segments=4)
+        #Nothing was joined, and what did come is kept for next time.
+        self.assertIn("episode.mp3.json", self.left_over())
+        self.assertLess(os.path.getsize(self.media_path), 100000)
+
+
+if __name__ == "__main__":
+    unittest.main()
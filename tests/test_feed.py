@@ -0,0 +1,101 @@
+"""Tests for fetching and parsing feeds, and reusing what was parsed."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+class ConditionalFetchTest (unittest.TestCase):
+
+    def setUp(self):
+        self.server    = support.FeedServer()
+        self.base_url  = self.server.start()
+        self.generator = support.FeedGenerator(base_url=self.base_url)
+        self.body      = self.generator.make_feed(20)
+        self.url       = self.base_url + "/feed.xml"
+        self.http      = podplayer.HttpClient()
+
+    def tearDown(self):
+        self.http.close()
+        self.server.stop()
+
+    def podcast(self, previous=None):
+        podcast = podplayer.Podcast(podcast_url=self.url, podcast_load_type='back', http=self.http)
+        if previous is not None:
+            podcast.feed_etag          = previous.feed_etag
+            podcast.feed_last_modified = previous.feed_last_modified
+            podcast.feed_hash          = previous.feed_hash
+            podcast.feed_episodes      = previous.feed_episodes
+            podcast.feed_complete      = previous.feed_complete
+        return podcast
+
+    def test_not_modified_reuses_episodes(self):
+        self.server.add("/feed.xml", self.body, etag='"one"', last_modified="Tue, 14 Nov 2023 22:13:20 GMT")
+        first = self.podcast()
+        first.get_episode_list()
+        self.assertTrue(first.episodes_parsed)
+        self.assertEqual(len(first.episode_list), 20)
+
+        second = self.podcast(first)
+        second.get_episode_list()
+        headers = self.server.requests("/feed.xml")[-1]
+        self.assertEqual(headers.get("If-None-Match"), '"one"')
+        self.assertEqual(headers.get("If-Modified-Since"), "Tue, 14 Nov 2023 22:13:20 GMT")
+        self.assertEqual(second.feed_status, 304)
+        self.assertFalse(second.episodes_parsed)
+        self.assertEqual(second.episode_list, first.episode_list)
+
+    def test_unchanged_body_reuses_episodes(self):
+        self.server.add("/feed.xml", self.body, etag='"one"')
+        first = self.podcast()
+        first.get_episode_list()
+
+        #The server hands out a new ETag for the same bytes.
+        self.server.add("/feed.xml", self.body, etag='"two"')
+        second = self.podcast(first)
+        second.get_episode_list()
+        self.assertEqual(second.feed_status, 200)
+        self.assertFalse(second.episodes_parsed)
+        self.assertTrue(second.feed_changed)
+        self.assertEqual(second.feed_etag, '"two"')
+        self.assertEqual(second.episode_list, first.episode_list)
+
+    def test_changed_body_is_parsed(self):
+        self.server.add("/feed.xml", self.body, etag='"one"')
+        first = self.podcast()
+        first.get_episode_list()
+
+        self.server.add("/feed.xml", self.generator.make_feed(21), etag='"two"')
+        second = self.podcast(first)
+        second.get_episode_list()
+        self.assertTrue(second.episodes_parsed)
+        self.assertEqual(len(second.episode_list), 21)
+
+    def test_validators_survive_the_database(self):
+        self.server.add("/feed.xml", self.body, etag='"one"')
+        directory = tempfile.mkdtemp(prefix="podtest-")
+        try:
+            player = podplayer.PodPlayer(dbpath=os.path.join(directory, "test.db"), cachedir=os.path.join(directory, "media"))
+            player.add_podcasts([self.url], 10, 'back')
+            player.make_selection()
+            #Make the feed due again.
+            player.database.dbi.execute("DELETE FROM poll_v1")
+            player.database.dbi.commit()
+            selection = player.make_selection()
+            phases    = [record[1] for record in player.database.dbi.execute("SELECT metric_time, metric_phase FROM metric_v1 ORDER BY metric_id")]
+            player.http.close()
+            player.database.dbi.close()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(self.server.requests("/feed.xml")[-1].get("If-None-Match"), '"one"')
+        self.assertEqual(phases.count("parse"), 1)
+        self.assertEqual(selection.episode_url, self.generator.enclosure_url(1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Tests for HttpClient against a local HTTP server."""
+
+import gzip
+import http.server
+import threading
+import time
+import unittest
+import zlib
+
+import podplayer
+
+
+BODY = b"<rss><channel><title>Test</title></channel></rss>" * 2000
+
+
+class Handler (http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.connections.add(self.client_address)
+
+        if self.path == "/gzip":
+            self.respond(200, gzip.compress(BODY), {"Content-Encoding": "gzip"})
+        elif self.path == "/deflate-zlib":
+            self.respond(200, zlib.compress(BODY), {"Content-Encoding": "deflate"})
+        elif self.path == "/deflate-raw":
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            self.respond(200, compressor.compress(BODY) + compressor.flush(), {"Content-Encoding": "deflate"})
+        elif self.path == "/corrupt":
+            self.respond(200, b"this is not gzip at all", {"Content-Encoding": "gzip"})
+        elif self.path in ("/moved-301", "/moved-308", "/moved-302"):
+            self.respond(int(self.path[-3:]), b"", {"Location": "/plain"})
+        elif self.path == "/drop":
+            #Answer as though the connection will stay open, then close it.
+            self.respond(200, BODY)
+            self.close_connection = True
+        else:
+            self.respond(200, BODY)
+
+
+class HttpClientTest (unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.lock           = threading.Lock()
+        self.server.hits           = {}
+        self.server.connections    = set()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.base   = "http://127.0.0.1:%d" % (self.server.server_address[1],)
+        self.client = podplayer.HttpClient(timeout=5)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, path, **kwargs):
+        return self.client.fetch(self.base + path, **kwargs)
+
+    def test_gzip(self):
+        status, headers, body = self.fetch("/gzip")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(body, BODY)
+
+    def test_deflate_zlib(self):
+        self.assertEqual(self.fetch("/deflate-zlib")[2], BODY)
+
+    def test_deflate_raw(self):
+        self.assertEqual(self.fetch("/deflate-raw")[2], BODY)
+
+    def test_sink(self):
+        pieces = []
+        status, headers, body = self.fetch("/gzip", sink=pieces.append)
+        self.assertEqual(body, b"")
+        self.assertEqual(b"".join(pieces), BODY)
+
+    def test_corrupt_encoding(self):
+        with self.assertRaises(podplayer.FetchError):
+            self.fetch("/corrupt")
+
+    def test_permanent_redirects_remembered(self):
+        for status in ("301", "308"):
+            for attempt in range(3):
+                self.assertEqual(self.fetch("/moved-" + status)[2], BODY)
+            self.assertEqual(self.server.hits["/moved-" + status], 1)
+        self.assertEqual(self.server.hits["/plain"], 6)
+
+    def test_temporary_redirects_not_remembered(self):
+        for attempt in range(3):
+            self.assertEqual(self.fetch("/moved-302")[2], BODY)
+        self.assertEqual(self.server.hits["/moved-302"], 3)
+
+    def test_connection_reused(self):
+        for attempt in range(3):
+            self.fetch("/plain")
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_stale_connection_retried(self):
+        self.assertEqual(self.fetch("/drop")[2], BODY)
+        #Give the server time to close its end of the pooled connection.
+        time.sleep(0.2)
+        self.assertEqual(self.fetch("/plain")[2], BODY)
+        self.assertEqual(self.server.hits["/plain"], 1)
+        self.assertEqual(len(self.server.connections), 2)
+
+    def test_cancelled_before_start(self):
+        with self.assertRaises(podplayer.FetchError):
+            self.fetch("/plain", cancelled=lambda: True)
+
+    def test_cancelled_partway(self):
+        checks = []
+        def cancelled():
+            checks.append(True)
+            return len(checks) > 1
+        with self.assertRaises(podplayer.FetchError):
+            self.fetch("/plain", cancelled=cancelled)
+        #The half-read connection isn't put back in the pool.
+        self.assertEqual(self.client.idle.get(("http", "127.0.0.1", self.server.server_address[1]), []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Tests for EpisodeIndex, and for keeping it from one refresh to the next."""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+def random_feed(generator, count, prefix="http://media.example.com/"):
+    """A feed-order list of Episodes with repeated publish times, undated
+    items and the odd URL listed twice."""
+
+    episodes = []
+    for position in range(count):
+        published = generator.choice([0, generator.randrange(1000), generator.randrange(1000000)])
+        episodes += [podplayer.Episode("%s%d.mp3" % (prefix, generator.randrange(count * 2)), published)]
+    return episodes
+
+
+def by_insert(episodes, index=None):
+    if index is None:
+        index = podplayer.EpisodeIndex()
+    for position, episode in enumerate(episodes):
+        index.insert(episode, position)
+    return index
+
+
+def contents(index):
+    #The generations depend on how the episodes went in, so only the
+    #order and the rest of the keys are compared.
+    found = [index.get(episode.url) is episode for episode in index.episodes]
+    return [(key[:2], episode.url) for key, episode in zip(index.keys, index.episodes)], dict([(url, key[:2]) for url, key in index.key_of.items()]), all(found)
+
+
+class EpisodeIndexTest (unittest.TestCase):
+
+    def test_build_matches_insert(self):
+        generator = random.Random(9)
+        for trial in range(200):
+            episodes = random_feed(generator, generator.randrange(1, 300))
+            self.assertEqual(contents(podplayer.EpisodeIndex(episodes)), contents(by_insert(episodes)))
+
+    def test_update_matches_insert_of_new_episodes(self):
+        generator = random.Random(10)
+        for trial in range(200):
+            old      = random_feed(generator, generator.randrange(0, 200))
+            feed     = random_feed(generator, generator.randrange(1, 200))
+            index    = podplayer.EpisodeIndex(old)
+            expected = podplayer.EpisodeIndex(old)
+            new      = [(position, episode) for position, episode in enumerate(feed) if episode.url not in expected]
+            for position, episode in new:
+                expected.insert(episode, position)
+            added = index.update(feed)
+            self.assertEqual(contents(index), contents(expected))
+            self.assertEqual(added, len(set([episode.url for position, episode in new])))
+
+    def test_update_keeps_episodes_already_there(self):
+        index = podplayer.EpisodeIndex([podplayer.Episode("http://media.example.com/1.mp3", 100)])
+        #The feed has dropped 1.mp3 and moved its date, and added 2.mp3.
+        added = index.update([podplayer.Episode("http://media.example.com/2.mp3", 200), podplayer.Episode("http://media.example.com/1.mp3", 300)])
+        self.assertEqual(added, 1)
+        self.assertEqual([episode.url for episode in index.episodes], ["http://media.example.com/1.mp3", "http://media.example.com/2.mp3"])
+
+
+class KeptIndexTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.server    = support.FeedServer()
+        base_url       = self.server.start()
+        self.generator = support.FeedGenerator(base_url=base_url)
+        self.server.add("/feed.xml", self.generator.make_feed(50))
+        self.player    = podplayer.PodPlayer(dbpath=os.path.join(self.directory, "test.db"), cachedir=os.path.join(self.directory, "media"))
+        self.player.add_podcasts([base_url + "/feed.xml"], 10, 'back')
+
+    def tearDown(self):
+        self.player.http.close()
+        self.player.database.dbi.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def refresh(self):
+        self.player.database.dbi.execute("DELETE FROM poll_v1")
+        self.player.database.dbi.commit()
+        return self.player.make_selection()
+
+    def test_index_is_kept_and_only_new_episodes_go_in(self):
+        self.refresh()
+        index = list(self.player.indexes.values())[0]
+        self.assertEqual(len(index), 50)
+
+        #Unchanged, then one more episode.
+        self.refresh()
+        self.server.add("/feed.xml", self.generator.make_feed(51))
+        built = []
+        original = podplayer.EpisodeIndex.__init__
+        def spy(index, episodes=None):
+            built.append(len(episodes or []))
+            original(index, episodes)
+        podplayer.EpisodeIndex.__init__ = spy
+        try:
+            self.refresh()
+        finally:
+            podplayer.EpisodeIndex.__init__ = original
+        self.assertIs(list(self.player.indexes.values())[0], index)
+        self.assertEqual(len(index), 51)
+        self.assertEqual(built, [])
+        self.assertEqual(index.newest(), self.generator.enclosure_url(51))
+
+    def test_gone_podcasts_are_forgotten(self):
+        self.refresh()
+        self.player.remove_podcasts([self.player.database.podcast_urls().pop()])
+        self.refresh()
+        self.assertEqual(self.player.indexes, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
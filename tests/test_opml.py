@@ -0,0 +1,84 @@
+"""Tests for exporting subscriptions to OPML and importing them again."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import podplayer
+
+
+class OpmlRoundTripTest (unittest.TestCase):
+
+    podcasts = [
+        ("http://feeds.example.com/a.xml", 'back',  10, "A & B's show"),
+        ("http://feeds.example.com/b.xml", 'front', 1,  None),
+        ("http://feeds.example.com/c.xml", 'back',  25, "<Third>"),
+        ("http://feeds.example.com/d.xml?id=4&format=rss", 'front', 5, "D"),
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.opml_path = os.path.join(self.directory, "subscriptions.opml")
+        self.players   = []
+        exporter = self.player("export.db")
+        exporter.add_podcast_list(self.podcasts)
+        with open(self.opml_path, 'w') as outfile:
+            exporter.export_opml(outfile)
+
+    def tearDown(self):
+        for player in self.players:
+            player.http.close()
+            player.database.dbi.close()
+        shutil.rmtree(self.directory)
+
+    def player(self, name):
+        player = podplayer.PodPlayer(dbpath=os.path.join(self.directory, name), cachedir=os.path.join(self.directory, "media"))
+        self.players += [player]
+        return player
+
+    def subscriptions(self, player):
+        return sorted([(podcast.podcast_url, podcast.podcast_load_type, podcast.podcast_priority, podcast.podcast_name) for podcast in player.database.scan_podcasts()])
+
+    def import_opml(self, player, paths, priority=10, load_type=None):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            player.import_opml(paths, priority, load_type)
+        return output.getvalue()
+
+    def test_round_trip_keeps_priorities_and_load_types(self):
+        importer = self.player("import.db")
+        self.assertEqual(self.import_opml(importer, [self.opml_path], 99, 'back'), "")
+        self.assertEqual(self.subscriptions(importer), sorted(self.podcasts))
+
+    def test_duplicates_are_skipped(self):
+        importer = self.player("import.db")
+        importer.add_podcasts([self.podcasts[1][0]], 30, 'back')
+        warnings = self.import_opml(importer, [self.opml_path, self.opml_path])
+        #Once for the one already there, and once for each in the
+        #second copy of the file.
+        self.assertEqual(warnings.count("Skipping %s" % (self.podcasts[1][0],)), 2)
+        self.assertEqual(warnings.count("Warning:"), 1 + len(self.podcasts))
+        subscriptions = self.subscriptions(importer)
+        self.assertEqual([podcast[0] for podcast in subscriptions], sorted([podcast[0] for podcast in self.podcasts]))
+        #The one already there is left as it was.
+        self.assertIn((self.podcasts[1][0], 'back', 30, None), subscriptions)
+
+        self.assertEqual(self.import_opml(importer, [self.opml_path]).count("Warning:"), len(self.podcasts))
+        self.assertEqual(self.subscriptions(importer), subscriptions)
+
+    def test_folders_and_defaults(self):
+        opml_path = os.path.join(self.directory, "other.opml")
+        with open(opml_path, 'w') as outfile:
+            outfile.write('<?xml version="1.0"?>\n<opml version="2.0"><head/><body>'
+                          '<outline text="News"><outline type="rss" text="E" xmlUrl="http://feeds.example.com/e.xml"/></outline>'
+                          '</body></opml>\n')
+        importer = self.player("import.db")
+        self.import_opml(importer, [opml_path], 7, 'front')
+        self.assertEqual(self.subscriptions(importer), [("http://feeds.example.com/e.xml", 'front', 7, "E")])
+
+
+if __name__ == "__main__":
+    unittest.main()
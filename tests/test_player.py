@@ -0,0 +1,73 @@
+"""Tests for what PodPlayer counts as played."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+class HeldEpisodeTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.server    = support.FeedServer()
+        base_url       = self.server.start()
+        self.generator = support.FeedGenerator(title="Held", base_url=base_url)
+        self.server.add("/feed.xml", self.generator.make_feed(2))
+        self.player    = podplayer.PodPlayer(dbpath=os.path.join(self.directory, "test.db"), cachedir=os.path.join(self.directory, "media"))
+        self.player.add_podcasts([base_url + "/feed.xml"], 10, 'back')
+        #Nothing is really played.
+        self.played    = []
+        self.player.play_file = lambda media_path: self.played.append(media_path) or True
+        self.episode_url = podplayer.Podcast().clean_url(self.generator.enclosure_url(1))
+
+    def tearDown(self):
+        self.player.http.close()
+        self.player.database.dbi.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def last_played(self):
+        return list(self.player.database.scan_podcasts())[0].podcast_last_played
+
+    def test_failed_download_is_not_played(self):
+        self.assertTrue(self.player.play_one())
+        self.assertEqual(self.played, [])
+        self.assertIsNone(self.last_played())
+        self.assertEqual(self.player.held_episodes(), set([self.episode_url]))
+        #While it is held, there is nothing else to play.
+        self.assertIsNone(self.player.make_selection())
+
+    def test_held_episode_comes_up_again(self):
+        self.player.play_one()
+        failures, until = self.player.held[self.episode_url]
+        self.player.held[self.episode_url] = (failures, 0)
+        selection = self.player.make_selection()
+        self.assertEqual(selection.episode_url, self.episode_url)
+
+        self.server.add("/held/episode-1.mp3", b"x" * 1000000)
+        self.player.held[self.episode_url] = (failures, 0)
+        self.assertTrue(self.player.play_one())
+        self.assertEqual(len(self.played), 1)
+        self.assertEqual(self.last_played(), self.episode_url)
+        self.assertEqual(self.player.held, {})
+
+    def test_backoff_doubles(self):
+        selection = podplayer.Selection(episode_url=self.episode_url)
+        self.player.hold_episode(selection)
+        first = self.player.held[self.episode_url][1]
+        self.player.hold_episode(selection)
+        failures, second = self.player.held[self.episode_url]
+        self.assertEqual(failures, 2)
+        self.assertAlmostEqual(second - first, self.player.download_min_wait, delta=5)
+        for count in range(20):
+            self.player.hold_episode(selection)
+        self.assertLessEqual(self.player.held[self.episode_url][1], podplayer.time.time() + self.player.download_max_wait)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests for replaying recorded feeds with podsim."""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ET
+
+import podplayer
+import podsim
+
+from tests import support
+
+
+START = 1700000000
+
+
+def snapshot(title, items, newest=START, dropped=0):
+    """Makes the text of a feed of items an hour apart, the newest
+    published at newest, less the oldest dropped of them."""
+    tree    = ET.fromstring(support.FeedGenerator(title=title, start=newest).make_feed(items))
+    channel = tree.find('channel')
+    for item in channel.findall('item')[items - dropped:]:
+        channel.remove(item)
+    return ET.tostring(tree, encoding='unicode')
+
+
+class ReplayFeedTest (unittest.TestCase):
+
+    def test_items_turn_up_when_published(self):
+        feed = podsim.ReplayFeed("http://feeds.example.com/a.xml")
+        feed.add_snapshot(snapshot("A", 10))
+        self.assertEqual(feed.name, "A")
+        self.assertEqual(feed.first_published(), START - 9 * 3600)
+        self.assertEqual(feed.last_published(), START)
+
+        body = feed.build(START - 5 * 3600)
+        self.assertEqual(len(ET.fromstring(body).findall('channel/item')), 5)
+        self.assertIsNone(feed.build(START - 5 * 3600 + 60))
+        items = ET.fromstring(feed.build(START)).findall('channel/item')
+        self.assertEqual([item.findtext('guid') for item in items], ["A-%d" % (number,) for number in range(10, 0, -1)])
+
+    def test_snapshots_keep_items_that_dropped_off(self):
+        paths     = []
+        directory = tempfile.mkdtemp(prefix="podtest-")
+        try:
+            for fetched, text in ((START, snapshot("A", 10)), (START + 5 * 3600, snapshot("A", 15, START + 5 * 3600, dropped=8))):
+                paths += [os.path.join(directory, "%d.json" % (fetched,))]
+                with open(paths[-1], 'w') as outfile:
+                    json.dump({"recorded": fetched, "feeds": [{"url": "http://feeds.example.com/a.xml", "priority": 5, "load_type": 'front', "fetched": fetched, "feed": text}]}, outfile)
+            feeds = podsim.load(list(reversed(paths)))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(feeds), 1)
+        self.assertEqual((feeds[0].priority, feeds[0].load_type), (5, 'front'))
+        self.assertEqual(len(feeds[0].items), 15)
+        self.assertEqual(feeds[0].first_published(), START - 9 * 3600)
+        self.assertEqual(feeds[0].last_published(), START + 5 * 3600)
+
+
+class SimulatorTest (unittest.TestCase):
+
+    def feeds(self):
+        feeds = []
+        for title, items, load_type in (("Daily", 200, 'back'), ("News", 100, 'front')):
+            feed = podsim.ReplayFeed("http://feeds.example.com/%s.xml" % (title.lower(),), load_type=load_type)
+            feed.add_snapshot(snapshot(title, items))
+            feeds += [feed]
+        return feeds
+
+    def replay(self):
+        return podsim.Simulator(self.feeds(), weeks=1, hours=2, seed=3).run()
+
+    def test_replay(self):
+        started = time.time()
+        report  = self.replay()
+        self.assertEqual(report["feeds"], 2)
+        self.assertEqual(report["start"], START - 7 * 86400)
+        self.assertEqual(len(report["days"]), 7)
+        self.assertGreater(report["plays"], 0)
+        self.assertGreater(report["fetches"], 0)
+        self.assertEqual(report["plays"], sum([day["plays"] for day in report["days"]]))
+        #The replay ran on its own clock, and left podplayer's alone.
+        self.assertGreaterEqual(report["end"], START - 86400)
+        self.assertLess(report["end"], started)
+        self.assertIs(podplayer.time, time)
+        self.assertGreater(report["phases"]["fetch"]["count"], 0)
+
+    def test_replay_is_repeatable(self):
+        first  = self.replay()
+        second = self.replay()
+        for key in ("plays", "fetches", "bytes", "backlog_start", "backlog_end", "end"):
+            self.assertEqual(first[key], second[key])
+        self.assertEqual(first["days"], second["days"])
+
+    def test_no_feeds(self):
+        with self.assertRaises(podplayer.ImNotDoingThat):
+            podsim.Simulator([]).run()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Tests for the polling schedule of a feed that fails and comes back."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import podplayer
+
+from tests import support
+
+
+class BackoffTest (unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.server    = support.FeedServer()
+        base_url       = self.server.start()
+        self.generator = support.FeedGenerator(base_url=base_url)
+        self.url       = base_url + "/feed.xml"
+        self.player    = podplayer.PodPlayer(dbpath=os.path.join(self.directory, "test.db"), cachedir=os.path.join(self.directory, "media"))
+        self.player.add_podcasts([self.url], 10, 'back')
+
+    def tearDown(self):
+        self.player.http.close()
+        self.player.database.dbi.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def poll(self):
+        return self.player.database.dbi.execute("SELECT poll_next_due, poll_failures, poll_last_error FROM poll_v1 WHERE podcast_url = ?", (self.url,)).fetchone()
+
+    def fetches(self):
+        return len(self.server.requests("/feed.xml"))
+
+    def come_due(self):
+        """Moves the next poll into the past, as though the wait were over."""
+        self.player.database.dbi.execute("UPDATE poll_v1 SET poll_next_due = ? WHERE podcast_url = ?", (time.time() - 1, self.url))
+        self.player.database.dbi.commit()
+
+    def cycle(self):
+        """Runs a selection cycle, and returns the poll afterwards and
+        how long the wait for the next one is."""
+        started = time.time()
+        self.player.make_selection()
+        next_due, failures, error = self.poll()
+        return next_due - started, failures, error
+
+    def assertWait(self, wait, expected):
+        jitter = podplayer.Podcast.poll_jitter
+        self.assertGreaterEqual(wait, expected * (1.0 - jitter) - 1)
+        self.assertLessEqual(wait, expected * (1.0 + jitter) + 1)
+
+    def test_failing_feed_backs_off_and_recovers(self):
+        minimum = podplayer.Podcast.failure_min_wait
+        maximum = podplayer.Podcast.failure_max_wait
+        for failure in range(1, 10):
+            if failure > 1:
+                #Not due yet, so not fetched.
+                fetched = self.fetches()
+                self.assertIsNone(self.player.make_selection())
+                self.assertEqual(self.fetches(), fetched)
+                self.assertEqual(self.poll()[1], failure - 1)
+                self.come_due()
+
+            fetched = self.fetches()
+            wait, failures, error = self.cycle()
+            self.assertEqual(self.fetches(), fetched + 1)
+            self.assertEqual(failures, failure)
+            self.assertIn("404", error)
+            self.assertWait(wait, min(maximum, minimum * 2.0 ** (failure - 1)))
+
+        #Down, and only probed when its retry comes due.  The first
+        #probe that works puts it back on its usual schedule.
+        podcast = list(self.player.database.scan_podcasts())[0]
+        self.assertTrue(podcast.is_down())
+        self.server.add("/feed.xml", self.generator.make_feed(5))
+        self.assertIsNone(self.player.make_selection())
+        self.assertEqual(self.fetches(), fetched + 1)
+        self.come_due()
+        wait, failures, error = self.cycle()
+        self.assertEqual(self.fetches(), fetched + 2)
+        self.assertEqual(failures, 0)
+        self.assertIsNone(error)
+        self.assertWait(wait, podplayer.Podcast.poll_min_interval)
+        self.assertFalse(list(self.player.database.scan_podcasts())[0].is_down())
+        self.assertEqual(self.player.make_selection().episode_url, self.generator.enclosure_url(1))
+        self.assertEqual(self.fetches(), fetched + 2)
+
+    def test_failure_after_recovery_starts_backoff_over(self):
+        for failure in range(3):
+            self.come_due()
+            self.cycle()
+        self.assertEqual(self.poll()[1], 3)
+
+        self.server.add("/feed.xml", self.generator.make_feed(5))
+        self.come_due()
+        self.assertEqual(self.cycle()[1], 0)
+
+        self.server.add("/feed.xml", b"this is not a feed")
+        self.come_due()
+        wait, failures, error = self.cycle()
+        self.assertEqual(failures, 1)
+        self.assertIsNotNone(error)
+        self.assertWait(wait, podplayer.Podcast.failure_min_wait)
+
+
+if __name__ == "__main__":
+    unittest.main()
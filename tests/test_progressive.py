@@ -0,0 +1,147 @@
+"""Tests for playing an episode while it downloads, with a stub player
+reading from a slow local server."""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import podplayer
+
+from tests import support
+
+
+#The stub player copies what it reads into the file named first, as
+#the mode second says:  play reads to the end, quit stops partway and
+#exits cleanly, crash stops partway and fails, and hang reads slowly
+#until it is killed.
+STUB = """
+import sys, time
+output, mode, path = sys.argv[1:]
+total = 0
+with open(path, 'rb') as infile, open(output, 'wb') as outfile:
+    while mode not in ('quit', 'crash') or total < 100000:
+        chunk = infile.read(16384)
+        if not chunk:
+            break
+        outfile.write(chunk)
+        outfile.flush()
+        total += len(chunk)
+        if mode == 'hang':
+            time.sleep(0.05)
+sys.exit(3 if mode == 'crash' else 0)
+"""
+
+
+class StubPlayer (podplayer.PodPlayer):
+    """Plays with STUB, and notes how much of the episode the server
+    had sent when playback started."""
+
+    mode = 'play'
+
+    def play_file(self, media_path):
+        self.sent_at_start = self.server.sent - self.feed_size
+        self.player_command = [sys.executable, self.stub_path, self.output_path, self.mode]
+        if self.mode == 'hang':
+            threading.Timer(0.3, self.stop_playback).start()
+        return podplayer.PodPlayer.play_file(self, media_path)
+
+
+class ProgressiveTest (unittest.TestCase):
+
+    threshold = 300000
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="podtest-")
+        self.server    = support.FeedServer()
+        base_url       = self.server.start()
+        self.generator = support.FeedGenerator(base_url=base_url)
+        self.body      = random.Random(1).randbytes(1000000)
+        feed           = self.generator.make_feed(1, length=len(self.body))
+        self.server.add("/feed.xml", feed)
+        self.server.add(self.generator.enclosure_path(1), self.body, delay=0.01, chunk_size=16384)
+
+        self.player = StubPlayer(dbpath=os.path.join(self.directory, "test.db"), cachedir=os.path.join(self.directory, "media"), readahead_bytes=self.threshold)
+        self.player.server      = self.server
+        self.player.feed_size   = len(feed)
+        self.player.stub_path   = os.path.join(self.directory, "stub.py")
+        self.player.output_path = os.path.join(self.directory, "played")
+        with open(self.player.stub_path, 'w') as outfile:
+            outfile.write(STUB)
+        self.player.add_podcasts([base_url + "/feed.xml"], 10, 'back')
+
+        #Every read of the file for the player has to be of what is
+        #already on disk.
+        self.overruns = []
+        pread = os.pread
+        def checked_pread(fd, count, position):
+            if position + count > os.fstat(fd).st_size:
+                self.overruns += [(position, count, os.fstat(fd).st_size)]
+            return pread(fd, count, position)
+        patcher = mock.patch.object(os, "pread", checked_pread)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        #Downloads the player gave up on carry on in the background.
+        for thread in threading.enumerate():
+            if isinstance(thread, podplayer.ProgressiveDownload):
+                thread.join()
+        self.player.http.close()
+        self.player.database.dbi.close()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def played(self):
+        with open(self.player.output_path, 'rb') as infile:
+            return infile.read()
+
+    def last_played(self):
+        return list(self.player.database.scan_podcasts())[0].podcast_last_played
+
+    def test_plays_while_downloading(self):
+        self.assertTrue(self.player.play_one())
+        #Started once the threshold was in, well before the end.
+        self.assertGreaterEqual(self.player.sent_at_start, self.threshold)
+        self.assertLess(self.player.sent_at_start, len(self.body))
+        self.assertEqual(self.played(), self.body)
+        self.assertEqual(self.overruns, [])
+        self.assertEqual(self.last_played(), self.generator.enclosure_url(1))
+        self.assertEqual(self.player.held, {})
+
+    def test_short_episode_plays_from_the_file(self):
+        self.player.readahead_bytes = 2 * len(self.body)
+        self.assertTrue(self.player.play_one())
+        self.assertEqual(self.player.sent_at_start, len(self.body))
+        self.assertEqual(self.played(), self.body)
+        self.assertEqual(self.last_played(), self.generator.enclosure_url(1))
+
+    def test_quitting_partway_is_not_played(self):
+        self.player.mode = 'quit'
+        self.assertTrue(self.player.play_one())
+        self.assertEqual(self.played(), self.body[:len(self.played())])
+        self.assertLess(len(self.played()), len(self.body))
+        self.assertEqual(self.overruns, [])
+        self.assertIsNone(self.last_played())
+        self.assertEqual(list(self.player.held), [self.generator.enclosure_url(1)])
+
+    def test_failing_player_is_not_played(self):
+        self.player.mode = 'crash'
+        self.assertTrue(self.player.play_one())
+        self.assertIsNone(self.last_played())
+        self.assertEqual(list(self.player.held), [self.generator.enclosure_url(1)])
+
+    def test_skip_counts_as_played(self):
+        self.player.mode = 'hang'
+        self.assertTrue(self.player.play_one())
+        self.assertLess(len(self.played()), len(self.body))
+        self.assertEqual(self.last_played(), self.generator.enclosure_url(1))
+        self.assertEqual(self.player.held, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Tests for the order PlayQueue plays podcasts in."""
+
+import unittest
+
+import podplayer
+
+
+class PlayQueueTest (unittest.TestCase):
+
+    def podcast(self, podcast_id, priority, load_type):
+        return podplayer.Podcast(podcast_id=podcast_id, podcast_priority=priority, podcast_load_type=load_type, podcast_url="http://feeds.example.com/%d.xml" % (podcast_id,))
+
+    def test_priority_comes_first(self):
+        queue = podplayer.PlayQueue()
+        queue.update(self.podcast(1, 20, 'back'), podplayer.Episode("http://media.example.com/old.mp3", 1000))
+        queue.update(self.podcast(2, 10, 'back'), podplayer.Episode("http://media.example.com/new.mp3", 2000))
+        self.assertEqual(queue.peek()[0].podcast_id, 2)
+
+    def test_front_loaded_head_is_not_starved(self):
+        #A front-loaded podcast's head is its newest episode, which
+        #must not lose the tie to an older back-loaded backlog.
+        queue = podplayer.PlayQueue()
+        queue.update(self.podcast(1, 10, 'front'), podplayer.Episode("http://media.example.com/news.mp3", 2000))
+        queue.update(self.podcast(2, 10, 'back'), podplayer.Episode("http://media.example.com/backlog.mp3", 1000))
+        self.assertEqual(queue.peek()[0].podcast_id, 1)
+
+    def test_equal_priority_goes_by_podcast_id(self):
+        queue = podplayer.PlayQueue()
+        queue.update(self.podcast(2, 10, 'back'), podplayer.Episode("http://media.example.com/a.mp3", 1000))
+        queue.update(self.podcast(1, 10, 'back'), podplayer.Episode("http://media.example.com/b.mp3", 2000))
+        self.assertEqual(queue.peek()[0].podcast_id, 1)
+        queue.remove(1)
+        self.assertEqual(queue.peek()[0].podcast_id, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()